@@ -2,7 +2,7 @@ const { app, BrowserWindow, dialog, ipcMain, shell } = require('electron');
 const path = require('path');
 const fs = require('fs');
 const os = require('os');
-const { exec } = require('child_process');
+const { exec, spawn } = require('child_process');
 const util = require('util');
 const execPromise = util.promisify(exec);
 
@@ -12,6 +12,67 @@ let globalFolderPath = '';
 let globalOutputDir = '';
 global.selectedLanguage = null;
 
+// The most recent earlier analysis of the same source folder, its manifest.json lets main_invoker reuse unchanged artifacts
+function findPreviousAnalysis(analysisRoot, folderPath, outputDir) {
+  if (!fs.existsSync(analysisRoot)) {
+    return null;
+  }
+  const candidates = fs.readdirSync(analysisRoot)
+    .map(name => path.join(analysisRoot, name))
+    .filter(dir => dir !== outputDir && fs.existsSync(path.join(dir, 'manifest.json')))
+    .sort()
+    .reverse();
+  for (const dir of candidates) {
+    try {
+      const manifest = JSON.parse(fs.readFileSync(path.join(dir, 'manifest.json'), 'utf-8'));
+      if (path.resolve(manifest.source_root) === path.resolve(folderPath)) {
+        return dir;
+      }
+    } catch (error) {
+      console.warn(`Skipping unreadable manifest in ${dir}: ${error.message}`);
+    }
+  }
+  return null;
+}
+
+// A folder holding several pyproject.toml packages is analyzed per package, each package in its own output folder
+// listed in packages.json. The folder and output of the analysis covering targetPath, the package's when it is in one,
+// and the folder its code_info is relative to. ast_info and the call graphs are always those of the whole folder.
+function readPackages() {
+  const packagesFile = path.join(globalOutputDir, 'packages.json');
+  if (!globalOutputDir || !fs.existsSync(packagesFile)) {
+    return [];
+  }
+  return JSON.parse(fs.readFileSync(packagesFile, 'utf-8')).packages;
+}
+
+function analysisNamespace(targetPath) {
+  const match = readPackages()
+    .filter(pkg => isPathUnder(pkg.folder, targetPath))
+    .sort((a, b) => b.folder.length - a.folder.length)[0];
+  if (match && isPathUnder(match.source, targetPath)) {
+    return { folderPath: match.folder, outputDir: match.output, sourcePath: match.source };
+  }
+  // Files of a package outside its source folder have their code_info in the folder's namespace
+  return match ? { folderPath: match.folder, outputDir: match.output, sourcePath: globalFolderPath, codeInfoDir: globalOutputDir }
+    : { folderPath: globalFolderPath, outputDir: globalOutputDir, sourcePath: globalFolderPath };
+}
+
+function isPathUnder(folder, targetPath) {
+  const relative = path.relative(folder, targetPath);
+  return !relative.startsWith('..') && !path.isAbsolute(relative);
+}
+
+app.on('will-quit', () => {
+  // Stop the call stack servers of the current analysis, they would otherwise exit on their idle timeout
+  const outputDirs = [globalOutputDir, ...readPackages().map(pkg => pkg.output)];
+  for (const outputDir of outputDirs) {
+    if (outputDir && fs.existsSync(path.join(outputDir, 'ast_info.server.json'))) {
+      exec(`conda activate repo_advisor && python ..\\python\\folder_dependency\\call_stack_client.py -a "${path.join(outputDir, 'ast_info')}" --op shutdown`);
+    }
+  }
+});
+
 app.on('ready', () => {
   mainWindow = new BrowserWindow({
     width: 2560,
@@ -58,6 +119,8 @@ app.on('ready', () => {
     if (!fs.existsSync(outputDir)) {
       fs.mkdirSync(outputDir, { recursive: true });
     }
+    const previousDir = findPreviousAnalysis(path.join(appRoot, 'analysis_output'), folderPath, outputDir);
+    const previousOption = previousDir ? ` -p "${previousDir}"` : '';
 
     const runDotnetAnalysis = () => {
       return new Promise((resolve, reject) => {
@@ -83,13 +146,47 @@ app.on('ready', () => {
           if (global.selectedLanguage == 'csharp') {
             const csharpDir = path.join(outputDir, 'folder_package_dep_info');
             // the input is outputDir/csharpcsv, output should be root folder to align with python analyser
-            command = `conda activate repo_advisor && python ..\\python\\folder_dependency\\main_invoker.py -s "${folderPath}" -o "${outputDir}" -l csharp -c "${csharpDir}"`;
+            command = `conda activate repo_advisor && python ..\\python\\folder_dependency\\main_invoker.py -s "${folderPath}" -o "${outputDir}" -l csharp -c "${csharpDir}" --info-depth 2 --progress${previousOption}`;
           }
           else {
-            command = `conda activate repo_advisor && python ..\\python\\folder_dependency\\main_invoker.py  -s "${folderPath}" -o "${outputDir}"`;
+            command = `conda activate repo_advisor && python ..\\python\\folder_dependency\\main_invoker.py  -s "${folderPath}" -o "${outputDir}" --ast-format binary --info-depth 2 --lazy-render --progress${previousOption}`;
           }
-          exec(command, { maxBuffer: 1024*1024*10 }, (error, stdout, stderr) => {
-              if (error) {
+          // main_invoker reports its stages, file counts and ready artifacts as JSON lines, they are passed on to
+          // the renderer as they come so it can show the folder info long before the analysis is done
+          const child = spawn(command, { shell: true });
+          let stdout = '';
+          let stderr = '';
+          let pending = '';
+          child.stdout.on('data', (data) => {
+              pending += data.toString();
+              const lines = pending.split(/\r?\n/);
+              pending = lines.pop();
+              for (const line of lines) {
+                  stdout += line + '\n';
+                  if (!line.startsWith('{')) {
+                      console.log(`Output: ${line}`);
+                      continue;
+                  }
+                  try {
+                      event.sender.send('analysis-progress', JSON.parse(line));
+                  } catch (error) {
+                      console.log(`Output: ${line}`);
+                  }
+              }
+          });
+          child.stderr.on('data', (data) => {
+              stderr += data.toString();
+          });
+          child.on('error', (error) => {
+              console.error(`Error executing command: ${error.message}`);
+              reject(error);
+          });
+          child.on('close', (code) => {
+              if (stderr) {
+                  console.warn(`Stderr: ${stderr}`);
+              }
+              if (code !== 0) {
+                  const error = new Error(`Command failed with exit code ${code}: ${command}`);
                   console.error(`Error executing command: ${error.message}`);
                   if(global.selectedLanguage != 'csharp') {
                     // Ignore error for csharp scenario temporarily as we already known it's caused by filename path too long.
@@ -98,10 +195,6 @@ app.on('ready', () => {
                   resolve({ stdout, stderr, error });
                   return;
               }
-              console.log(`Output: ${stdout}`);
-              if (stderr) {
-                  console.warn(`Stderr: ${stderr}`);
-              }
               resolve({ stdout, stderr });
           });
       });
@@ -128,13 +221,16 @@ app.on('ready', () => {
     if (!globalFolderPath || !globalOutputDir) {
       return { error: 'Analysis has not been run yet.' };
     }
-    const relativePath = path.relative(globalFolderPath, filePath);
+    // ast_info covers the whole folder, packages included
+    const folderPath = globalFolderPath;
+    const relativePath = path.relative(folderPath, filePath);
     const filePathWithoutExtension = relativePath.replace('.py', '');
     const astFolderPath = path.join(globalOutputDir, "ast_info");
     const resultPath = path.join(globalOutputDir, "internal-call-graph", filePathWithoutExtension + functionName + '.json');
   
     if (!fs.existsSync(resultPath)) {
-      const command = `conda activate repo_advisor && python ..\\python\\folder_dependency\\python_call_stack_generator.py -a "${astFolderPath}" -f "${relativePath}" -m "${functionName}" -o "${resultPath}"`;
+      // The client hands the query to a long-lived call_stack_server.py (started on first use) that keeps the ASTs loaded
+      const command = `conda activate repo_advisor && python ..\\python\\folder_dependency\\call_stack_client.py -a "${astFolderPath}" -f "${relativePath}" -m "${functionName}" -o "${resultPath}"`;
       console.log(command);
   
       try {
@@ -145,19 +241,26 @@ app.on('ready', () => {
       }
     }
   
-    return { internal_call_graph_path: resultPath, relative_path: relativePath, global_folder_path: globalFolderPath };
+    return { internal_call_graph_path: resultPath, relative_path: relativePath, global_folder_path: folderPath };
   });
 
 
-  ipcMain.handle('function-call-stack-analysis', async (event, function_name) => {
+  ipcMain.handle('function-call-stack-analysis', async (event, function_name, filePath) => {
     if (!globalFolderPath || !globalOutputDir) {
       return { error: 'Analysis has not been run yet.' };
     }
   
-    const callstackPath = path.join(globalOutputDir, function_name + '.png');
+    // The call stacks of a function are searched in the call graph of the whole folder, across packages.
+    // function_name is class-qualified (Class.method) and the file tells apart functions of the same name
+    const outputDir = globalOutputDir;
+    const relativeFile = filePath ? path.relative(globalFolderPath, filePath) : '';
+    const callstackPath = path.join(outputDir, 'function_call_graph_info', relativeFile, function_name + '.png');
+    const astFolderPath = path.join(outputDir, "ast_info");
+    const fileOption = relativeFile ? ` -f "${relativeFile}"` : '';
   
     if (!fs.existsSync(callstackPath)) {
-      const command = `conda activate repo_advisor && python ..\\python\\folder_dependency\\main_invoker.py -s "${globalFolderPath}" -o "${globalOutputDir}" -t "${function_name}"`;
+      // Answered by the call_stack_server.py of the analysis from its code2flow call graph model
+      const command = `conda activate repo_advisor && python ..\\python\\folder_dependency\\call_stack_client.py -a "${astFolderPath}" --op subset -m "${function_name}"${fileOption} -o "${callstackPath}"`;
       console.log(command);
   
       try {
@@ -176,15 +279,40 @@ app.on('ready', () => {
     return { call_stack_path: callstackPath };
   });
 
-  ipcMain.handle('get-analysis-info', async (event, subfolderPath) => {
+  ipcMain.handle('get-analysis-info', async (event, subfolderPath, render = true) => {
     if (!globalFolderPath || !globalOutputDir) {
       return { error: 'Analysis has not been run yet.' , package_dep_info_path: analysisPackageDepInfoFile};
     }
 
-    const relativePath = path.relative(globalFolderPath, subfolderPath);
-    const analysisFolderInfoFile = path.join(globalOutputDir, 'folder_info', relativePath + '\\info.json');
-    const analysisPackageDepInfoFile = path.join(globalOutputDir, 'folder_package_dep_info', 'folder_package_dep_info', relativePath + '\\graph.gv');
-    const analysisFolderCallGraphInfoFile = path.join(globalOutputDir, 'folder_call_graph_info', relativePath + '\\call_graph.png');
+    const { folderPath, outputDir } = analysisNamespace(subfolderPath);
+    const relativePath = path.relative(folderPath, subfolderPath);
+    // The call graphs are those of the whole folder, relative to it
+    const callGraphRelativePath = path.relative(globalFolderPath, subfolderPath);
+    const analysisFolderInfoFile = path.join(outputDir, 'folder_info', relativePath + '\\info.json');
+    const analysisPackageDepInfoFile = path.join(outputDir, 'folder_package_dep_info', 'folder_package_dep_info', relativePath + '\\graph.gv');
+    const analysisFolderCallGraphInfoFile = path.join(globalOutputDir, 'folder_call_graph_info', callGraphRelativePath + '\\call_graph.png');
+    const callGraphModelFile = path.join(globalOutputDir, 'folder_call_graph_info', 'call_graph_model.json');
+    // Written by lazy_render.py even when nothing was drawn, e.g. no python files or a failed render
+    const lazyRenderManifestFile = path.join(globalOutputDir, 'folder_call_graph_info', callGraphRelativePath, 'render_manifest.json');
+
+    // render is false while the analysis still runs, its stages are writing the graphs
+    if (render && global.selectedLanguage != 'csharp' && !fs.existsSync(analysisFolderCallGraphInfoFile) && fs.existsSync(callGraphModelFile)
+        && !fs.existsSync(lazyRenderManifestFile)) {
+      // The analysis ran with --lazy-render, draw this folder's graphs on its first view, a package's dependency
+      // graph in its own namespace
+      const renders = [[globalOutputDir, callGraphRelativePath]];
+      if (outputDir != globalOutputDir) {
+        renders.push([outputDir, relativePath]);
+      }
+      for (const [renderOutputDir, renderRelativePath] of renders) {
+        const command = `conda activate repo_advisor && python ..\\python\\folder_dependency\\lazy_render.py -o "${renderOutputDir}" -r "${renderRelativePath}"`;
+        try {
+          await execPromise(command);
+        } catch (error) {
+          console.error(`Error rendering graphs of ${subfolderPath}: ${error.message}`);
+        }
+      }
+    }
 
     if (fs.existsSync(analysisFolderInfoFile) || fs.existsSync(analysisPackageDepInfoFile)) {
       if(global.selectedLanguage=='csharp') {
@@ -204,10 +332,12 @@ app.on('ready', () => {
       return { error: 'Analysis has not been run yet.' };
     }
 
-    const relativePath = path.relative(globalFolderPath, filePath);
+    // code_info of a package is relative to its source folder, not to the package folder
+    const { outputDir, sourcePath, codeInfoDir } = analysisNamespace(filePath);
+    const relativePath = path.relative(sourcePath, filePath);
     const relativeFolderPath = path.dirname(relativePath);
     const fileName = path.basename(filePath).replace('.py', '');
-    const analysisFileInfoFile = path.join(globalOutputDir, 'code_info', relativeFolderPath + `\\${fileName}.json`);
+    const analysisFileInfoFile = path.join(codeInfoDir || outputDir, 'code_info', relativeFolderPath + `\\${fileName}.json`);
 
     if (fs.existsSync(analysisFileInfoFile)) {
       return { file_code_info_path: analysisFileInfoFile};
@@ -8,9 +8,10 @@ contextBridge.exposeInMainWorld('electron', {
   readDirectory: (path) => ipcRenderer.invoke('read-directory', path),
   readFile: (path) => ipcRenderer.invoke('read-file', path),
   runAnalysis: (folderPath) => ipcRenderer.invoke('run-analysis', folderPath),
-  getAnalysisInfo: (folderPath) => ipcRenderer.invoke('get-analysis-info', folderPath),
+  onAnalysisProgress: (callback) => ipcRenderer.on('analysis-progress', (event, progress) => callback(progress)),
+  getAnalysisInfo: (folderPath, render) => ipcRenderer.invoke('get-analysis-info', folderPath, render),
   getFileAnalysisInfo: (filePath) => ipcRenderer.invoke('get-file-analysis-info', filePath),
-  getFunctionCallStackAnalysis: (functionName) => ipcRenderer.invoke('function-call-stack-analysis', functionName),
+  getFunctionCallStackAnalysis: (functionName, filePath) => ipcRenderer.invoke('function-call-stack-analysis', functionName, filePath),
   getFunctionInternalCallStackAnalysis: (filePath, functionName) => ipcRenderer.invoke('function-internal-call-graph-analysis', filePath, functionName),
   openExternal: (url) => ipcRenderer.invoke('open-external', url),
   showItemInFolder: (filePath) => ipcRenderer.invoke('show-item-in-folder', filePath),
@@ -168,9 +168,28 @@ async function displayInteractDot() {
     // Handle dragging behavior here
   });
 }
+// A sharded info.json (main_invoker --info-depth) holds stubs with a "shard" path, relative to that file
+function resolveFolderInfoShards(node, infoFilePath) {
+  const infoDir = infoFilePath.replace(/[\\/][^\\/]*$/, '');
+  const sep = infoFilePath.includes('\\') ? '\\' : '/';
+  const resolve = (child) => {
+    if (child.shard) {
+      child.shard = infoDir + sep + child.shard.split('/').join(sep);
+    }
+    (child.children || []).forEach(resolve);
+  };
+  resolve(node);
+  return node;
+}
+
+async function loadFolderInfoShard(shardPath) {
+  const content = await window.electron.readFile(shardPath);
+  return resolveFolderInfoShards(JSON.parse(content), shardPath);
+}
+
 async function displayFolderBasicInfo(filePath) {
   const content = await window.electron.readFile(filePath);
-  const treeData = JSON.parse(content);
+  const treeData = resolveFolderInfoShards(JSON.parse(content), filePath);
   const contentContainer = document.getElementById('file-content1');
   contentContainer.innerHTML = ''; // Clear the content container
 
@@ -246,7 +265,7 @@ async function displayFolderBasicInfo(filePath) {
     nodeEnter.append('circle')
       .attr('class', 'node')
       .attr('r', 1e-6)
-      .style("fill", d => d._children ? "lightsteelblue" : "#fff");
+      .style("fill", d => d._children || d.data.shard ? "lightsteelblue" : "#fff");
 
     // // Add labels for the nodes
     // nodeEnter.append('text')
@@ -270,7 +289,7 @@ async function displayFolderBasicInfo(filePath) {
     // Update the node attributes and style
     nodeUpdate.select('circle.node')
       .attr('r', d => Math.sqrt(d.data.total_source_lines / totalCodeFileLineCount * 100)) // Set radius based on count
-      .style("fill", d => d._children ? "lightsteelblue" : "#fff")
+      .style("fill", d => d._children || d.data.shard ? "lightsteelblue" : "#fff")
       .attr('cursor', 'pointer');
 
     // Remove any exiting nodes
@@ -333,8 +352,29 @@ async function displayFolderBasicInfo(filePath) {
       return path;
     }
 
+    // Attach the children of a stub node from its shard, collapsed like the initial levels
+    async function expandShard(d) {
+      const shardData = await loadFolderInfoShard(d.data.shard);
+      d.data.children = shardData.children;
+      delete d.data.shard;
+      const shardRoot = d3.hierarchy(d.data, c => c.children);
+      d.children = shardRoot.children || null;
+      if (d.children) {
+        d.children.forEach(child => {
+          child.parent = d;
+          child.each(node => { node.depth += d.depth; });
+          collapse(child);
+        });
+      }
+    }
+
     // Toggle children on click.
-    function click(event, d) {
+    async function click(event, d) {
+      if (d.data.shard && !d.children && !d._children) {
+        await expandShard(d);
+        update(d);
+        return;
+      }
       if (d.children) {
         d._children = d.children;
         d.children = null;
@@ -427,13 +467,35 @@ $(function () {
 
 
 
+let analyzingFolderPath = null;
+
+// Progress events of main_invoker.py while an analysis runs, the folder info is shown as soon as its preview is ready
+// and shown again with the graphs once the analysis is done
+window.electron.onAnalysisProgress((progress) => {
+  const status = document.getElementById('analysis-progress');
+  if (progress.event === 'stage') {
+    status.textContent = `${progress.stage}: ${progress.status}`;
+  } else if (progress.event === 'files') {
+    status.textContent = `${progress.stage}: ${progress.done}/${progress.total} files`;
+  } else if (progress.event === 'artifact' && analyzingFolderPath && progress.name === 'folder_info' && progress.preview) {
+    displayAnalysisInfo(analyzingFolderPath, false);
+  } else if (progress.event === 'stages') {
+    status.textContent = `Analysis done in ${progress.elapsed_seconds}s`;
+  }
+});
+
 async function analyzeFromHere(folderPath) {
-  await window.electron.runAnalysis(folderPath);
-  const analysisInfo = await window.electron.getAnalysisInfo(folderPath);
+  analyzingFolderPath = folderPath;
+  try {
+    await window.electron.runAnalysis(folderPath);
+  } finally {
+    analyzingFolderPath = null;
+  }
+  await displayAnalysisInfo(folderPath);
 }
 
-async function displayAnalysisInfo(folderPath) {
-  const analysisInfo = await window.electron.getAnalysisInfo(folderPath);
+async function displayAnalysisInfo(folderPath, render = true) {
+  const analysisInfo = await window.electron.getAnalysisInfo(folderPath, render);
   const contentContainer = document.getElementById('file-content1');
   if (analysisInfo.error) {
     contentContainer.textContent = analysisInfo.error;
@@ -556,13 +618,14 @@ async function displayFileFunctions(filePath) {
   rows.append("td").append("button")
     .text("callstack")
     .on("click", (event, d) => {
-      processFunctionCallstack(d.functionName);
+      // The call graph tells methods of different classes apart by their class-qualified name
+      processFunctionCallstack(d.classname ? `${d.classname}.${d.functionName}` : d.functionName, filePath);
       processInternalFunctionCallstack(filePath, d.functionName);
     });
 }
 
-async function processFunctionCallstack(functionName) {
-  const callstackPath = await window.electron.getFunctionCallStackAnalysis(functionName);
+async function processFunctionCallstack(functionName, filePath) {
+  const callstackPath = await window.electron.getFunctionCallStackAnalysis(functionName, filePath);
   displayPngFile(callstackPath.call_stack_path);
   // console.log(`Classname: ${d.classname}, Function Name: ${d.functionName}`);
 
@@ -594,22 +657,26 @@ async function displayInternalCallJson(filePath, target_root_file, target_root_f
     name: target_root_function,
     file: target_root_file,
     fullPath: global_folder_path + "\\" + target_root_file,
-    children: buildTree(target_root_file + ":" + target_root_function)
+    children: buildTree(target_root_file + ":" + target_root_function, new Set([target_root_file + ":" + target_root_function]))
   };
 
-  function buildTree(key) {
+  // path holds the keys above key, a call back into one of them closes a cycle and is not expanded again
+  function buildTree(key, path) {
     if (!data[key]) 
       return [];
   
     var result = [];
     for (var i = 0; i < data[key].length; i++) {
       var item = data[key][i];
+      var itemKey = item.file + ":" + item.name;
+      var cycle = item.cycle || path.has(itemKey);
       var treeNode = {
         name: item.name,
         file: item.file,
         fullPath: global_folder_path + "\\" + item.file,
         lineno: item.lineno,
-        children: buildTree(item.file + ":" + item.name)
+        marker: cycle ? " \u21ba cycle" : (item.truncated ? " \u2026" : ""),
+        children: cycle ? [] : buildTree(itemKey, new Set(path).add(itemKey))
       };
       result.push(treeNode);
     }
@@ -650,7 +717,7 @@ async function displayInternalCallJson(filePath, target_root_file, target_root_f
       .attr("dy", 3)
       .attr("x", d => d.children ? -8 : 8)
       .style("text-anchor", d => d.children ? "end" : "start")
-      .html(d => `${d.data.lineno}: <a href="#" onclick="locateFile('${encodeURIComponent(d.data.fullPath)}', '${d.data.name}')">${d.data.name}</a> (${d.data.file})`);
+      .html(d => `${d.data.lineno}: <a href="#" onclick="locateFile('${encodeURIComponent(d.data.fullPath)}', '${d.data.name}')">${d.data.name}</a> (${d.data.file})${d.data.marker || ""}`);
 
 
 }
@@ -683,9 +750,10 @@ async function displayFileContent(filePath) {
   contentContainer.innerHTML = `<pre><code class="language-${language}">${Prism.highlight(content, Prism.languages[language], language)}</code></pre>`;
 }
 async function displayGraphvizFile(filePath) {
+  // Outside the try, a graph.gv not written yet by a running analysis ends up in the catch
+  const contentContainer = document.getElementById('file-content2');
   try {
     const content = await window.electron.readFile(filePath); // read graph.gv
-    const contentContainer = document.getElementById('file-content2');
     contentContainer.innerHTML = ''; // clean container
     const svg = await window.electron.vizRender(content);
     console.log('Generated SVG:', svg);
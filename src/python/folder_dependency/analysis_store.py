@@ -0,0 +1,370 @@
+import os
+import json
+import sqlite3
+import argparse
+from ast_store import decode_ast_binary, AST_BINARY_EXTENSION, BINARY_AST_MEMORY_FACTOR
+from memory_budget import BoundedCache
+from stage_metrics import count_written
+
+# The store of an analysis sits in the analysis folder, in place of code_info and ast_info
+STORE_FILE = 'analysis.db'
+# Seconds a connection waits for another stage process to finish writing
+STORE_TIMEOUT = 600
+
+FOLDER_TOTALS = ['total_files', 'total_folders', 'total_source_files', 'total_source_lines', 'total_class_count',
+                 'total_function_count', 'total_public_function_count', 'total_private_function_count']
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, folder TEXT NOT NULL, module TEXT, code_info TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS files_folder ON files (folder);
+CREATE INDEX IF NOT EXISTS files_module ON files (module);
+CREATE TABLE IF NOT EXISTS imports (file TEXT NOT NULL, module TEXT NOT NULL, name TEXT);
+CREATE INDEX IF NOT EXISTS imports_file ON imports (file);
+CREATE INDEX IF NOT EXISTS imports_module ON imports (module);
+CREATE TABLE IF NOT EXISTS asts (file TEXT PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS symbols (name TEXT PRIMARY KEY, short_name TEXT NOT NULL, file TEXT NOT NULL,
+                                    line INTEGER, kind TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS symbols_file ON symbols (file);
+CREATE INDEX IF NOT EXISTS symbols_short_name ON symbols (short_name);
+CREATE TABLE IF NOT EXISTS folders (folder TEXT PRIMARY KEY, parent TEXT, name TEXT NOT NULL, position INTEGER,
+                                    {', '.join(f'{total} INTEGER' for total in FOLDER_TOTALS)});
+CREATE INDEX IF NOT EXISTS folders_parent ON folders (parent);
+CREATE TABLE IF NOT EXISTS graph_nodes (kind TEXT NOT NULL, folder TEXT NOT NULL, position INTEGER, name TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS graph_nodes_folder ON graph_nodes (kind, folder);
+CREATE TABLE IF NOT EXISTS edges (kind TEXT NOT NULL, folder TEXT NOT NULL, position INTEGER, source TEXT NOT NULL,
+                                  target TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS edges_folder ON edges (kind, folder);
+CREATE INDEX IF NOT EXISTS edges_source ON edges (kind, source);
+CREATE INDEX IF NOT EXISTS edges_target ON edges (kind, target);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def store_key(relative_path):
+    # Paths are kept with / on every platform, so a store can be queried wherever it is copied to
+    return relative_path.replace(os.path.sep, '/')
+
+
+def native_path(key):
+    return key.replace('/', os.path.sep)
+
+
+def _folder_of(key):
+    return key.rsplit('/', 1)[0] if '/' in key else ''
+
+
+def _below(column, folder):
+    # A range on the column instead of LIKE, so the primary key index serves folder queries
+    if not folder:
+        return '1', ()
+    return f'{column} >= ? AND {column} < ?', (folder + '/', folder + '0')
+
+
+def store_for_ast_dir(ast_dir):
+    """The store to read ASTs from for ast_dir: ast_dir itself when it is a store, the store beside a missing
+    ast_info folder of a --store analysis, None otherwise."""
+    if os.path.isfile(ast_dir):
+        return ast_dir
+    if not os.path.isdir(ast_dir):
+        store_path = os.path.join(os.path.dirname(os.path.normpath(ast_dir)), STORE_FILE)
+        if os.path.isfile(store_path):
+            return store_path
+    return None
+
+
+class StoreAstDirectory:
+    """Dict-like view of the ASTs of a store like AstDirectory, keyed by the files of the symbol index.
+
+    With max_bytes, only the ASTs used last that fit in it stay decoded.
+    """
+
+    def __init__(self, store, max_bytes=None):
+        self.store = store
+        self.asts = BoundedCache(max_bytes)
+
+    def __contains__(self, file):
+        return file in self.asts or self.store.ast(store_key(file)) is not None
+
+    def __getitem__(self, file):
+        module = self.asts.get(file)
+        if module is None:
+            data = self.store.ast(store_key(file))
+            if data is None:
+                raise KeyError(file)
+            module = self.asts.put(file, decode_ast_binary(data, file), len(data) * BINARY_AST_MEMORY_FACTOR)
+        return module
+
+
+class AnalysisStore:
+    """Single-file SQLite store of an analysis: the code_info of every file with its imports, the binary AST and
+    symbols of every module, the folder_info totals and the dependency graph of every folder.
+
+    Writes stay in one transaction until commit(). export() writes the same data in the folder layout.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=STORE_TIMEOUT)
+        # Stage processes write to the store side by side, with WAL their reads never block a writer
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(SCHEMA)
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def set_meta(self, key, value):
+        self.connection.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, json.dumps(value)))
+
+    def meta(self, key, default=None):
+        row = self.connection.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    # code_info, keyed by the source file relative to the analyzed source folder, e.g. pkg/mod.py
+
+    def put_code_info(self, path, code_info):
+        module = code_info['package_name'] + "." + code_info['file_name'].replace(".py", "")
+        data = json.dumps(code_info)
+        self.connection.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+                                (path, _folder_of(path), module, data))
+        count_written(size=len(data))
+        self.connection.execute('DELETE FROM imports WHERE file = ?', (path,))
+        rows = [(path, imported, None) for imported in code_info['imports']]
+        rows += [(path, imported, name) for imported, names in code_info['from_imports'].items() for name in names]
+        self.connection.executemany('INSERT INTO imports VALUES (?, ?, ?)', rows)
+
+    def code_info(self, path):
+        row = self.connection.execute('SELECT code_info FROM files WHERE path = ?', (path,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def code_infos(self, folder=''):
+        """(path, code_info) of every file below folder, in path order."""
+        condition, parameters = _below('path', folder)
+        for path, code_info in self.connection.execute(
+                f'SELECT path, code_info FROM files WHERE {condition} ORDER BY path', parameters):
+            yield path, json.loads(code_info)
+
+    def files(self, folder='', recursive=True):
+        if recursive:
+            condition, parameters = _below('path', folder)
+        else:
+            condition, parameters = 'folder = ?', (folder,)
+        return [row[0] for row in self.connection.execute(
+            f'SELECT path FROM files WHERE {condition} ORDER BY path', parameters)]
+
+    def module_file(self, module):
+        row = self.connection.execute('SELECT path FROM files WHERE module = ?', (module,)).fetchone()
+        return None if row is None else row[0]
+
+    def imports_of(self, path):
+        """(module, name) of every import of a file, name is None for a plain import."""
+        return self.connection.execute('SELECT module, name FROM imports WHERE file = ?', (path,)).fetchall()
+
+    def importers_of(self, module):
+        """Files importing module, by "import module", "from module import ..." or "from package import module"."""
+        package, _, name = module.rpartition('.')
+        rows = self.connection.execute('SELECT DISTINCT file FROM imports WHERE module = ? OR (module = ? AND name = ?) '
+                                       'ORDER BY file', (module, package, name))
+        return [row[0] for row in rows]
+
+    def code_info_reader(self, code_info_dir):
+        """A read_metadata for folder_analyzer: the code_info of a path of the code_info folder layout."""
+        def read_metadata(metadata_file):
+            relative_path = os.path.relpath(metadata_file, code_info_dir)
+            if not relative_path.endswith('.json'):
+                return None
+            return self.code_info(store_key(relative_path)[:-len('.json')] + '.py')
+        return read_metadata
+
+    # ASTs in the ast_store binary encoding and the symbol index, keyed like ast_info
+
+    def put_ast(self, file, data):
+        self.connection.execute('INSERT OR REPLACE INTO asts VALUES (?, ?)', (file, data))
+        count_written(size=len(data))
+
+    def ast(self, file):
+        row = self.connection.execute('SELECT data FROM asts WHERE file = ?', (file,)).fetchone()
+        return None if row is None else row[0]
+
+    def ast_files(self):
+        return [row[0] for row in self.connection.execute('SELECT file FROM asts ORDER BY file')]
+
+    def put_symbols(self, symbols):
+        self.connection.executemany('INSERT OR REPLACE INTO symbols VALUES (?, ?, ?, ?, ?)',
+                                    [(name, name.split('.')[-1], store_key(file), line, kind)
+                                     for name, (file, line, kind) in symbols.items()])
+
+    def symbol_index(self):
+        """The symbols like load_symbol_index returns them."""
+        return {name: (native_path(file), line, kind) for name, file, line, kind in
+                self.connection.execute('SELECT name, file, line, kind FROM symbols')}
+
+    def find_symbols(self, name):
+        """(name, file, line, kind) of the symbols called name, qualified or by their own name."""
+        return self.connection.execute('SELECT name, file, line, kind FROM symbols WHERE name = ? OR short_name = ? '
+                                       'ORDER BY name', (name, name)).fetchall()
+
+    def symbols_in_file(self, file):
+        return self.connection.execute('SELECT name, line, kind FROM symbols WHERE file = ? ORDER BY line',
+                                       (file,)).fetchall()
+
+    def ast_directory(self, max_bytes=None):
+        return StoreAstDirectory(self, max_bytes)
+
+    # folder_info totals, keyed by the folder relative to the analyzed folder ('' is the root)
+
+    def put_folder_info(self, folder_info, folder='', parent=None, position=0):
+        """Store a gather_folder_info result and all of its sub folders."""
+        self.connection.execute(f'INSERT OR REPLACE INTO folders VALUES (?, ?, ?, ?, {", ".join("?" * len(FOLDER_TOTALS))})',
+                                (folder, parent, folder.rsplit('/', 1)[-1], position,
+                                 *[folder_info[total] for total in FOLDER_TOTALS]))
+        for index, (name, subfolder_info) in enumerate(folder_info['first_level_subfolders'].items()):
+            self.put_folder_info(subfolder_info, f"{folder}/{name}" if folder else name, folder, index)
+
+    def folder_totals(self, folder=''):
+        row = self.connection.execute(f'SELECT {", ".join(FOLDER_TOTALS)} FROM folders WHERE folder = ?',
+                                      (folder,)).fetchone()
+        return None if row is None else dict(zip(FOLDER_TOTALS, row))
+
+    def subfolders(self, folder=''):
+        return [row[0] for row in self.connection.execute('SELECT folder FROM folders WHERE parent = ? ORDER BY position',
+                                                          (folder,))]
+
+    def folder_info(self, folder=''):
+        """The gather_folder_info result of folder, sub folders included."""
+        totals = self.folder_totals(folder)
+        if totals is None:
+            return None
+        # One query for every folder below, nested in memory
+        condition, parameters = _below('folder', folder)
+        children = {}
+        for child, parent, name, *values in self.connection.execute(
+                f'SELECT folder, parent, name, {", ".join(FOLDER_TOTALS)} FROM folders WHERE {condition} '
+                f'ORDER BY position', parameters):
+            children.setdefault(parent, []).append((child, name, dict(zip(FOLDER_TOTALS, values))))
+
+        def nest(folder, totals):
+            totals['first_level_subfolders'] = {name: nest(child, child_totals)
+                                                for child, name, child_totals in children.get(folder, [])}
+            return totals
+        return nest(folder, totals)
+
+    # Dependency graphs, one per folder of folder_package_dep_info
+
+    def put_graph(self, kind, folder, csv_data):
+        """Store the nodes and edges of the graph.csv rows of folder."""
+        self.connection.execute('DELETE FROM graph_nodes WHERE kind = ? AND folder = ?', (kind, folder))
+        self.connection.execute('DELETE FROM edges WHERE kind = ? AND folder = ?', (kind, folder))
+        nodes = [row[1] for row in csv_data if row[0] == 'Node']
+        edges = [(row[2], row[3]) for row in csv_data if row[0] == 'Edge']
+        self.connection.executemany('INSERT INTO graph_nodes VALUES (?, ?, ?, ?)',
+                                    [(kind, folder, index, node) for index, node in enumerate(nodes)])
+        self.connection.executemany('INSERT INTO edges VALUES (?, ?, ?, ?, ?)',
+                                    [(kind, folder, index, source, target) for index, (source, target) in enumerate(edges)])
+
+    def graph_folders(self, kind='dependency'):
+        return [row[0] for row in self.connection.execute('SELECT DISTINCT folder FROM graph_nodes WHERE kind = ? '
+                                                          'ORDER BY folder', (kind,))]
+
+    def graph_csv(self, kind, folder):
+        """The graph.csv rows of folder, as generate_dependency_graph_csv made them."""
+        csv_data = [['Type', 'Identifier', 'Source', 'Target', 'Label', 'TypeKind']]
+        for (node,) in self.connection.execute('SELECT name FROM graph_nodes WHERE kind = ? AND folder = ? '
+                                               'ORDER BY position', (kind, folder)):
+            csv_data.append(['Node', node, '', '', node, 'Class'])
+        for source, target in self.edges(kind, folder):
+            csv_data.append(['Edge', '', source, target, 'reference', ''])
+        return csv_data
+
+    def edges(self, kind, folder):
+        return self.connection.execute('SELECT source, target FROM edges WHERE kind = ? AND folder = ? ORDER BY position',
+                                       (kind, folder)).fetchall()
+
+    def edges_from(self, kind, source):
+        """(folder, target) of the edges leaving node source in every graph of kind."""
+        return self.connection.execute('SELECT folder, target FROM edges WHERE kind = ? AND source = ? ORDER BY folder',
+                                       (kind, source)).fetchall()
+
+    def edges_to(self, kind, target):
+        return self.connection.execute('SELECT folder, source FROM edges WHERE kind = ? AND target = ? ORDER BY folder',
+                                       (kind, target)).fetchall()
+
+    def export(self, analysis_info_folder, ast_format='binary'):
+        """Write the store in the folder layout of an analysis, for the consumers that read the files.
+
+        Returns the number of files written.
+        """
+        # Imported here, python_call_stack_generator reads stores itself
+        from python_call_stack_generator import ast_to_dict, write_ast_info, save_symbol_index
+        from folder_analyzer import save_folder_info_to_json
+        written = 0
+        for path, code_info in self.code_infos():
+            output_path = os.path.join(analysis_info_folder, 'code_info', native_path(path)[:-len('.py')] + '.json')
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            with open(output_path, 'w') as f:
+                json.dump(code_info, f, indent=4)
+            written += 1
+
+        ast_dir = os.path.join(analysis_info_folder, 'ast_info')
+        files = self.ast_files()
+        if files:
+            for file in files:
+                relative_path = native_path(file)
+                data = self.ast(file)
+                if ast_format == 'binary':
+                    output_path = os.path.join(ast_dir, relative_path + AST_BINARY_EXTENSION)
+                    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                    with open(output_path, 'wb') as f:
+                        f.write(data)
+                else:
+                    write_ast_info(ast_to_dict(decode_ast_binary(data, file)), relative_path,
+                                   os.path.join(ast_dir, relative_path + '.json'))
+                written += 1
+            save_symbol_index(self.symbol_index(), ast_dir)
+            written += 1
+
+        folder_info = self.folder_info()
+        if folder_info is not None:
+            # save_folder_info_to_json only uses the folder paths relative to the root, any root does
+            save_folder_info_to_json(os.curdir, os.path.join(analysis_info_folder, 'folder_info'), os.curdir, None,
+                                     folder_info=folder_info, max_depth=self.meta('info_depth'))
+            written += self.connection.execute('SELECT COUNT(*) FROM folders').fetchone()[0]
+
+        for folder in self.graph_folders():
+            output_folder = os.path.join(analysis_info_folder, 'folder_package_dep_info', native_path(folder))
+            os.makedirs(output_folder, exist_ok=True)
+            with open(os.path.join(output_folder, 'graph.csv'), 'w') as f:
+                for row in self.graph_csv('dependency', folder):
+                    f.write(','.join(row) + '\n')
+            written += 1
+        return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Query or export the SQLite store of an analysis.')
+    parser.add_argument('-d', '--database', type=str, required=True, help=f'The {STORE_FILE} of an analysis.')
+    parser.add_argument('-e', '--export', type=str, help='Write the store in the folder layout into this folder.')
+    parser.add_argument('--ast-format', type=str, choices=['json', 'binary'], default='binary',
+                        help='The format of the exported ast_info.')
+    parser.add_argument('--symbol', type=str, help='Print the definitions of a symbol, qualified or by its own name.')
+    parser.add_argument('--importers', type=str, help='Print the files importing a module.')
+    parser.add_argument('--folder', type=str, help='Print the totals and files of a folder, "" is the root.')
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.database):
+        print(f"The store {args.database} does not exist.")
+    else:
+        store = AnalysisStore(args.database)
+        if args.export:
+            print(f"Exported {store.export(args.export, args.ast_format)} files to {args.export}")
+        if args.symbol:
+            print(json.dumps(store.find_symbols(args.symbol), indent=4))
+        if args.importers:
+            print(json.dumps(store.importers_of(args.importers), indent=4))
+        if args.folder is not None:
+            print(json.dumps({'totals': store.folder_totals(args.folder), 'subfolders': store.subfolders(args.folder),
+                              'files': store.files(args.folder, recursive=False)}, indent=4))
+        store.close()
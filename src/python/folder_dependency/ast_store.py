@@ -0,0 +1,142 @@
+import ast
+import os
+import json
+import time
+import zlib
+import marshal
+import argparse
+from stage_metrics import count_written
+
+# Layout of a .astb file: MAGIC followed by a zlib compressed marshal of
+#   (namespace, file, [(type_name, field_names), ...], root)
+# where every node is the tuple (type_index, lineno, *field_values) with the values in field_names
+# order, lists stay lists and constants are stored as they are. Node types and field slots are
+# interned once per file, so no node repeats its type string or field names.
+MAGIC = b'CRAST\x01'
+AST_BINARY_EXTENSION = '.astb'
+# Rough bytes of memory a loaded module takes per byte of its ast_info file, measured on the standard library:
+# the json dict is about as large as its text, the tree of a compressed .astb about 40 times its size
+JSON_AST_MEMORY_FACTOR = 1.25
+BINARY_AST_MEMORY_FACTOR = 40
+
+
+def _encode_tree(tree):
+    type_indexes = {}
+    types = []
+
+    def encode(node):
+        if isinstance(node, ast.AST):
+            node_type = type(node)
+            index = type_indexes.get(node_type)
+            if index is None:
+                index = type_indexes[node_type] = len(types)
+                types.append((node_type.__name__, node_type._fields))
+            return (index, getattr(node, 'lineno', None), *[encode(getattr(node, field, None)) for field in node_type._fields])
+        elif isinstance(node, list):
+            return [encode(elem) for elem in node]
+        else:
+            return node
+
+    root = encode(tree)
+    return types, root
+
+
+def encode_ast_binary(tree, namespace, file_name):
+    types, root = _encode_tree(tree)
+    return MAGIC + zlib.compress(marshal.dumps((namespace, file_name, types, root)), 1)
+
+
+def save_ast_binary(tree, namespace, file_name, output_path):
+    with open(output_path, 'wb') as f:
+        f.write(encode_ast_binary(tree, namespace, file_name))
+    count_written(output_path)
+
+
+def _node_builders(types):
+    builders = []
+    for type_name, fields in types:
+        node_type = getattr(ast, type_name)
+        if tuple(fields) == node_type._fields:
+            builders.append(node_type)
+        else:
+            # Written by a python with a different grammar, fall back to keyword construction
+            builders.append(lambda *values, node_type=node_type, fields=fields: node_type(**dict(zip(fields, values))))
+    return builders
+
+
+def load_ast_binary(input_path):
+    """Load a .astb file straight into ast nodes, the module carries _namespace and _file attributes."""
+    with open(input_path, 'rb') as f:
+        return decode_ast_binary(f.read(), input_path)
+
+
+def decode_ast_binary(data, source='data'):
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{source} is not a binary AST file")
+    namespace, file_name, types, root = marshal.loads(zlib.decompress(data[len(MAGIC):]))
+    builders = _node_builders(types)
+
+    def decode(value):
+        if type(value) is tuple:
+            node = builders[value[0]](*[decode(item) for item in value[2:]])
+            if value[1] is not None:
+                node.lineno = value[1]
+            return node
+        elif type(value) is list:
+            return [decode(item) for item in value]
+        else:
+            return value
+
+    tree = decode(root)
+    tree._namespace = namespace
+    tree._file = file_name
+    return tree
+
+
+def compare_ast_formats(ast_dir):
+    """Size and load time of every module in a json ast_info folder against its binary encoding."""
+    from python_call_stack_generator import load_ast_from_json, dict_to_ast
+
+    json_paths = []
+    for root, _, files in os.walk(ast_dir):
+        json_paths.extend(os.path.join(root, file) for file in files if file.endswith('.json'))
+
+    binary_dir = os.path.normpath(ast_dir) + '_binary_compare'
+    json_size = binary_size = 0
+    binary_paths = []
+    for json_path in json_paths:
+        ast_dict = load_ast_from_json(json_path)
+        binary_path = os.path.join(binary_dir, os.path.relpath(json_path, ast_dir)[:-len('.json')] + AST_BINARY_EXTENSION)
+        os.makedirs(os.path.dirname(binary_path), exist_ok=True)
+        save_ast_binary(dict_to_ast(ast_dict), ast_dict.get('_namespace', ''), ast_dict.get('_file', ''), binary_path)
+        json_size += os.path.getsize(json_path)
+        binary_size += os.path.getsize(binary_path)
+        binary_paths.append(binary_path)
+
+    started = time.perf_counter()
+    for json_path in json_paths:
+        dict_to_ast(load_ast_from_json(json_path))
+    json_load = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for binary_path in binary_paths:
+        load_ast_binary(binary_path)
+    binary_load = time.perf_counter() - started
+
+    return {
+        'files': len(json_paths),
+        'json_bytes': json_size,
+        'binary_bytes': binary_size,
+        'size_ratio': json_size / binary_size if binary_size else None,
+        'json_load_seconds': json_load,
+        'binary_load_seconds': binary_load,
+        'load_speedup': json_load / binary_load if binary_load else None,
+        'binary_dir': binary_dir,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare the json and binary ast_info formats.')
+    parser.add_argument('-a', '--ast_dir', type=str, required=True, help='A json ast_info folder.')
+    args = parser.parse_args()
+    print(json.dumps(compare_ast_formats(args.ast_dir), indent=4))
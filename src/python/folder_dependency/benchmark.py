@@ -0,0 +1,303 @@
+import io
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import platform
+import subprocess
+import tempfile
+from pathlib import Path
+from contextlib import redirect_stdout
+from main_invoker import project_analysis
+from python_file_analyzer import process_python_files
+from python_call_stack_generator import retrieve_method_callstack
+from stage_metrics import METRICS_FILE
+
+SYNTHETIC_PACKAGE = 'synth'
+
+
+def synthetic_folders(depth, branching):
+    """Relative folders of a package tree with depth levels below the root and branching sub folders each."""
+    folders = ['']
+    level = ['']
+    for _ in range(depth):
+        level = [os.path.join(parent, f'pkg_{index}') for parent in level for index in range(branching)]
+        folders.extend(level)
+    return folders
+
+
+def generate_synthetic_repo(root, files=100, depth=3, branching=2, fan_out=3, calls=3, functions=5, seed=0):
+    """Write a python tree of files modules under root/synth, returns their paths relative to root.
+
+    Modules are spread over the folders of synthetic_folders. Each one imports a function from fan_out
+    other modules and every function makes calls calls, to its own module's functions and the imported ones.
+    """
+    rng = random.Random(seed)
+    package_root = os.path.join(root, SYNTHETIC_PACKAGE)
+    if os.path.exists(package_root):
+        shutil.rmtree(package_root)
+    folders = synthetic_folders(depth, branching)
+    for folder in folders:
+        os.makedirs(os.path.join(package_root, folder), exist_ok=True)
+        with open(os.path.join(package_root, folder, '__init__.py'), 'w') as f:
+            f.write('')
+
+    modules = [os.path.join(folders[index % len(folders)], f'mod_{index}') for index in range(files)]
+    module_names = ['.'.join([SYNTHETIC_PACKAGE] + module.split(os.path.sep)) for module in modules]
+    for index, module in enumerate(modules):
+        imported = []
+        lines = []
+        for other in rng.sample(range(files), min(fan_out, files - 1)) if files > 1 else []:
+            function_name = f'imported_{rng.randrange(functions)}'
+            if other == index or function_name in imported:
+                continue
+            lines.append(f'from {module_names[other]} import {function_name}')
+            imported.append(function_name)
+        lines.append('')
+        for function_index in range(functions):
+            lines.append('')
+            # The functions other modules import, kept apart from func_* so imports never shadow local names
+            lines.append(f'def imported_{function_index}(value):')
+            lines.append(f'    return func_{function_index}(value)')
+            lines.append('')
+            lines.append(f'def func_{function_index}(value):')
+            for _ in range(calls):
+                # Calls only go to lower numbered local functions so the module has no call cycles of its own
+                targets = imported + [f'func_{local}' for local in range(function_index)]
+                if not targets:
+                    break
+                lines.append(f'    value = {rng.choice(targets)}(value)')
+            lines.append('    return value')
+        lines.append('')
+        lines.append('')
+        lines.append(f'class Model{index}:')
+        lines.append('    def run(self, value):')
+        lines.append(f'        return func_{functions - 1}(value)')
+        with open(os.path.join(package_root, module + '.py'), 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+    return [os.path.join(SYNTHETIC_PACKAGE, module + '.py') for module in modules]
+
+
+def benchmark_queries(ast_dir, modules, functions, queries, output_dir, seed=0):
+    """Time retrieve_method_callstack on queries random functions of the synthetic modules."""
+    rng = random.Random(seed)
+    seconds = []
+    for query in range(queries):
+        module = rng.choice(modules)
+        method = f"{module.removesuffix('.py').replace(os.path.sep, '.')}.func_{rng.randrange(functions)}"
+        started = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            retrieve_method_callstack(ast_dir, module, method, os.path.join(output_dir, f'query_{query}.json'))
+        seconds.append(time.perf_counter() - started)
+    if not seconds:
+        return {'count': 0}
+    return {
+        'count': len(seconds),
+        'mean_seconds': round(sum(seconds) / len(seconds), 4),
+        'max_seconds': round(max(seconds), 4),
+        'queries_per_second': round(len(seconds) / sum(seconds), 2) if sum(seconds) else None,
+    }
+
+
+def scaling_exponents(runs):
+    """Per stage, the exponent k of seconds ~ files^k between the smallest and the largest run."""
+    if len(runs) < 2:
+        return {}
+    first, last = runs[0], runs[-1]
+    exponents = {}
+    for name, stage in last['stages'].items():
+        before = first['stages'].get(name)
+        if before and before['wall_seconds'] > 0 and stage['wall_seconds'] > 0:
+            exponents[name] = round(math.log(stage['wall_seconds'] / before['wall_seconds']) /
+                                    math.log(last['files'] / first['files']), 3)
+    return exponents
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(sizes, work_dir, depth=3, branching=2, fan_out=3, calls=3, functions=5, queries=20, workers=1,
+                  ast_format='json', render=False, seed=0):
+    """Analyse a synthetic tree of every size in sizes, returns the results written by --result."""
+    runs = []
+    for files in sorted(sizes):
+        source_dir = os.path.join(work_dir, f'source_{files}')
+        output_dir = os.path.join(work_dir, f'output_{files}')
+        for folder in (source_dir, output_dir):
+            if os.path.exists(folder):
+                shutil.rmtree(folder)
+        modules = generate_synthetic_repo(source_dir, files, depth, branching, fan_out, calls, functions, seed)
+
+        started = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            # Without render the graphs are left to lazy_render.py, so Graphviz is not needed
+            project_analysis(source_dir, output_dir, workers=workers, ast_format=ast_format, lazy_render=not render)
+        total = time.perf_counter() - started
+        with open(os.path.join(output_dir, METRICS_FILE), 'r') as f:
+            metrics = json.load(f)
+
+        stages = {}
+        for stage in metrics['stages']:
+            stages[stage['name']] = {
+                'wall_seconds': stage['wall_seconds'],
+                'cpu_seconds': stage['cpu_seconds'],
+                'files_per_second': round(files / stage['wall_seconds'], 1) if stage['wall_seconds'] else None,
+                'bytes_written': stage['bytes_written'],
+            }
+        run = {
+            'files': files,
+            'wall_seconds': round(total, 3),
+            'files_per_second': round(files / total, 1) if total else None,
+            'peak_rss_bytes': metrics['peak_rss_bytes'],
+            'stages': stages,
+            'query': benchmark_queries(os.path.join(output_dir, 'ast_info'), modules, functions, queries,
+                                       os.path.join(work_dir, f'queries_{files}'), seed),
+        }
+        print(f"{files} files: {run['wall_seconds']}s, {run['files_per_second']} files/s, "
+              f"query {run['query'].get('mean_seconds')}s")
+        runs.append(run)
+
+    return {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {'depth': depth, 'branching': branching, 'fan_out': fan_out, 'calls': calls,
+                       'functions': functions, 'queries': queries, 'workers': workers, 'ast_format': ast_format,
+                       'render': render, 'seed': seed},
+        'runs': runs,
+        'scaling_exponents': scaling_exponents(runs),
+    }
+
+
+# Run in the folder_dependency folder being timed, so an older checkout can be compared on the same code_info
+DEPENDENCY_TIMING = """
+import io, sys, time
+from contextlib import redirect_stdout
+from dependency_analyzer import analysis_dependency
+started = time.perf_counter()
+with redirect_stdout(io.StringIO()):
+    analysis_dependency(sys.argv[1], sys.argv[2], "csv")
+print(time.perf_counter() - started)
+"""
+
+
+def run_dependency_benchmark(trees, work_dir, fan_out=3, calls=3, functions=5, seed=0, source=None):
+    """Time analysis_dependency alone on the code_info of synthetic trees, given as (depth, branching, files).
+
+    The trees are deep rather than large, the cost of the stage grows with the folder levels above every file.
+    source is the folder_dependency folder whose analysis_dependency is timed, this one by default.
+    """
+    source = source or os.path.dirname(os.path.abspath(__file__))
+    runs = []
+    for depth, branching, files in trees:
+        name = f'{depth}x{branching}_{files}'
+        source_dir = os.path.join(work_dir, f'dependency_source_{name}')
+        code_info = os.path.join(work_dir, f'dependency_code_info_{name}')
+        output_dir = os.path.join(work_dir, f'dependency_output_{name}')
+        for folder in (source_dir, code_info, output_dir):
+            if os.path.exists(folder):
+                shutil.rmtree(folder)
+        generate_synthetic_repo(source_dir, files, depth, branching, fan_out, calls, functions, seed)
+        with redirect_stdout(io.StringIO()):
+            process_python_files(Path(source_dir), Path(code_info))
+
+        timing = subprocess.run([sys.executable, '-c', DEPENDENCY_TIMING, code_info, output_dir], cwd=source,
+                                capture_output=True, text=True, check=True)
+        seconds = float(timing.stdout.split()[-1])
+        graphs = sum('graph.csv' in file_names for _, _, file_names in os.walk(output_dir))
+        run = {'depth': depth, 'branching': branching, 'files': files, 'graphs': graphs,
+               'wall_seconds': round(seconds, 3)}
+        print(f"depth {depth}, branching {branching}, {files} files, {graphs} graphs: {run['wall_seconds']}s")
+        runs.append(run)
+    return runs
+
+
+def parse_tree(value):
+    # DEPTHxBRANCHING:FILES, e.g. 8x2:2555
+    try:
+        shape, files = value.split(':')
+        depth, branching = shape.split('x')
+        return int(depth), int(branching), int(files)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected DEPTHxBRANCHING:FILES, got {value}")
+
+
+def compare_results(baseline, current, tolerance=0.1):
+    """Stages of runs of the same size that got slower than baseline by more than tolerance."""
+    baseline_runs = {run['files']: run for run in baseline['runs']}
+    regressions = []
+    for run in current['runs']:
+        previous = baseline_runs.get(run['files'])
+        if previous is None:
+            continue
+        timings = [(name, stage['wall_seconds'], previous['stages'].get(name, {}).get('wall_seconds'))
+                   for name, stage in run['stages'].items()]
+        timings.append(('query', run['query'].get('mean_seconds'), previous['query'].get('mean_seconds')))
+        for name, seconds, previous_seconds in timings:
+            if seconds and previous_seconds and seconds > previous_seconds * (1 + tolerance):
+                regressions.append({'files': run['files'], 'stage': name, 'baseline_seconds': previous_seconds,
+                                    'seconds': seconds, 'ratio': round(seconds / previous_seconds, 2)})
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark project_analysis and call stack queries on synthetic '
+                                                 'python trees.')
+    parser.add_argument('-s', '--sizes', type=int, nargs='+', default=[100, 400, 1600],
+                        help='File counts of the generated trees.')
+    parser.add_argument('-d', '--depth', type=int, default=3, help='Levels of sub folders.')
+    parser.add_argument('-b', '--branching', type=int, default=2, help='Sub folders per folder.')
+    parser.add_argument('-f', '--fan_out', type=int, default=3, help='Modules imported by every module.')
+    parser.add_argument('-c', '--calls', type=int, default=3, help='Calls made by every function.')
+    parser.add_argument('--functions', type=int, default=5, help='Functions defined by every module.')
+    parser.add_argument('-q', '--queries', type=int, default=20, help='Call stack queries timed per tree.')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Parse processes passed to project_analysis.')
+    parser.add_argument('--ast-format', type=str, choices=['json', 'binary'], default='json')
+    parser.add_argument('--render', action='store_true', help='Render the graphs too, needs Graphviz.')
+    parser.add_argument('--work_dir', type=str, help='Where the trees and outputs go, a temporary folder by default.')
+    parser.add_argument('-r', '--result', type=str, help='Write the results to this json file.')
+    parser.add_argument('--baseline', type=str, help='A previous --result file, slower stages are reported and '
+                                                     'make the exit code 1.')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Allowed slowdown against the baseline.')
+    parser.add_argument('--dependency-trees', type=parse_tree, nargs='+',
+                        help='Only time the dependency stage on the code_info of these trees, as '
+                             'DEPTHxBRANCHING:FILES, e.g. 8x2:2555 30x1:620 4x4:2728.')
+    parser.add_argument('--dependency-source', type=str, help='The folder_dependency folder timed by '
+                                                              '--dependency-trees, e.g. of an older checkout. Those '
+                                                              'from before the one pass dependency model only run '
+                                                              'on Windows.')
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='folder_dependency_benchmark_')
+    if args.dependency_trees:
+        runs = run_dependency_benchmark(args.dependency_trees, work_dir, args.fan_out, args.calls, args.functions,
+                                        source=args.dependency_source)
+        if args.result:
+            with open(args.result, 'w') as f:
+                json.dump({'commit': git_commit(), 'python': platform.python_version(),
+                       'dependency_source': args.dependency_source, 'dependency_runs': runs}, f, indent=4)
+        if not args.work_dir:
+            shutil.rmtree(work_dir)
+        sys.exit(0)
+    results = run_benchmark(args.sizes, work_dir, args.depth, args.branching, args.fan_out, args.calls,
+                            args.functions, args.queries, args.workers, args.ast_format, args.render)
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            results['regressions'] = compare_results(json.load(f), results, args.tolerance)
+    if args.result:
+        with open(args.result, 'w') as f:
+            json.dump(results, f, indent=4)
+    print(json.dumps(results, indent=4))
+    if not args.work_dir:
+        shutil.rmtree(work_dir)
+    if results.get('regressions'):
+        sys.exit(1)
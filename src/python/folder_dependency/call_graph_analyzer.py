@@ -1,44 +1,435 @@
-import code2flow
-from code2flow.engine import SubsetParams
+from code2flow.engine import make_file_group
+from code2flow.model import (TRUNK_COLOR, LEAF_COLOR, NODE_COLOR, EDGE_COLORS, GROUP_TYPE, OWNER_CONST, Group, Node,
+                             Variable, flatten)
 import os
+import ast
+import json
 import pathlib
+from collections import defaultdict
+from source_ingest import find_python_files, read_and_parse
+from render_pool import render_dot
+from stage_metrics import count_written
+from source_walker import walk_source
 
 
-def _generate_call_path(raw_source_paths, output_file, target_function = "", upstream_depth = 5, downstream_depth = 10):
-    
-    if target_function is None or target_function == '':
-        try: 
-            code2flow.code2flow(raw_source_paths=raw_source_paths, language='py',  output_file=output_file)
-        except Exception as e:
-            print(f"Error generating call graph: {e}")
-    else:       
-        subset_params = SubsetParams.generate(target_function, upstream_depth,
-                                            downstream_depth)
+CALL_GRAPH_MODEL_FILE = 'call_graph_model.json'
+# 2: Class().method() calls are narrowed to the methods of Class
+CALL_GRAPH_MODEL_VERSION = 2
+
+
+def _make_file_groups(trees):
+    """code2flow's groups and functions of every file, with their variables resolved across all files, as
+    (source, file group, constructed owners) of every (source, tree) in trees.
+
+    Follows code2flow's map_it up to the call linking, a file code2flow fails on is only left out. The groups
+    keep no part of the trees, so with trees a generator only one tree is held at a time.
+    """
+    file_groups = []
+    for source, tree in trees:
         try:
-            code2flow.code2flow(raw_source_paths=raw_source_paths, language='py', subset_params=subset_params, output_file=output_file)
+            file_groups.append((source, make_file_group(tree, source, 'py'), _constructed_owners(tree)))
         except Exception as e:
-            print(f"Error generating call graph: {e}")
-    
-def generate_call_graphs_for_folders(src_folder: str, output_folder: str, extension ='.png'):
-    """Recursively generate call graphs for each folder"""
-    for root, dirs, files in os.walk(src_folder):
+            print(f"Error generating call graph for {source}: {e}")
+    groups = [group for _, group, _ in file_groups]
+
+    nodes_by_subgroup_token = defaultdict(list)
+    for subgroup in flatten(group.all_groups() for group in groups):
+        nodes_by_subgroup_token[subgroup.token] += subgroup.nodes
+    for group in groups:
+        for subgroup in group.all_groups():
+            subgroup.inherits = [nodes_by_subgroup_token.get(token) for token in subgroup.inherits]
+            subgroup.inherits = list(filter(None, subgroup.inherits))
+            for inherit_nodes in subgroup.inherits:
+                for node in subgroup.nodes:
+                    node.variables += [Variable(n.token, n, n.line_number) for n in inherit_nodes]
+
+    for node in flatten(group.all_nodes() for group in groups):
+        node.resolve_variables(groups)
+    return file_groups
+
+
+def _constructed_owners(tree):
+    """The class of every call made on a new instance, Class().method(), keyed by (line, method).
+
+    code2flow keeps no owner for such calls, so they would be ambiguous between every method of that name.
+    """
+    owners = {}
+    for element in ast.walk(tree):
+        if isinstance(element, ast.Call) and isinstance(element.func, ast.Attribute) \
+                and isinstance(element.func.value, ast.Call) and isinstance(element.func.value.func, ast.Name):
+            owners[(element.func.lineno, element.func.attr)] = element.func.value.func.id
+    return owners
+
+
+def _call_candidates(call, node_a, nodes_by_token, constructors_by_class_token, constructed_owners=None):
+    """The functions a call may link to, code2flow's _find_link_for_call without the final choice.
+
+    code2flow only links a call with exactly one candidate. Keeping all of them lets the graph of a
+    folder link a call whose only candidate below that folder is ambiguous in the whole repo.
+    constructed_owners, see _constructed_owners, narrows Class().method() calls to the methods of Class.
+    """
+    for variable in node_a.get_variables(call.line_number):
+        variable_match = call.matches_variable(variable)
+        if variable_match:
+            # Unknown modules (e.g. third party) are never linked
+            return [variable_match] if isinstance(variable_match, Node) else []
+    if call.is_attr():
+        candidates = [node for node in nodes_by_token.get(call.token, []) if node.parent != node_a.file_group()]
+        class_name = (constructed_owners or {}).get((call.line_number, call.token))
+        if class_name is not None and call.owner_token == OWNER_CONST.UNKNOWN_VAR:
+            owned = [node for node in nodes_by_token.get(call.token, [])
+                     if isinstance(node.parent, Group) and node.parent.group_type == GROUP_TYPE.CLASS
+                     and node.parent.token == class_name]
+            if owned:
+                return owned
+        return candidates
+    return [node for node in nodes_by_token.get(call.token, [])
+            if isinstance(node.parent, Group) and node.parent.group_type == GROUP_TYPE.FILE] \
+        + constructors_by_class_token.get(call.token, [])
+
+
+def build_call_graph(src_folder, parsed_sources=None, source_tree=None):
+    """Run code2flow's analysis once over every python file under src_folder.
+
+    Returns a JSON-able model: the files relative to src_folder, the groups (files and classes, each
+    after its parent), the functions and every call as [caller, [candidate callees]] indexes.
+
+    Files are parsed one at a time and their trees let go once code2flow has read them, only the groups,
+    functions and calls of the whole folder are held.
+    """
+    src_folder = os.path.abspath(src_folder)
+
+    def trees():
+        for source in sorted(find_python_files(src_folder, source_tree)):
+            tree = parsed_sources.get_tree(source) if parsed_sources is not None else None
+            if tree is None:
+                try:
+                    tree = read_and_parse(source)
+                except Exception as e:
+                    print(f"Error parsing {source} for the call graph: {e}")
+                    continue
+            yield source, tree
+
+    file_groups = _make_file_groups(trees())
+
+    files = []
+    groups = []
+    group_indexes = {}
+
+    def add_group(group, file_index, parent_index):
+        group_indexes[group] = len(groups)
+        groups.append({'uid': group.uid, 'label': group.label(), 'token': group.token, 'file': file_index,
+                       'parent': parent_index})
+        for subgroup in group.subgroups:
+            add_group(subgroup, file_index, group_indexes[group])
+
+    constructed_owners = {}
+    for source, file_group, owners in file_groups:
+        files.append(os.path.relpath(source, src_folder))
+        add_group(file_group, len(files) - 1, None)
+        constructed_owners[file_group] = owners
+
+    nodes = []
+    node_indexes = {}
+    nodes_by_token = defaultdict(list)
+    constructors_by_class_token = defaultdict(list)
+    for group, group_index in group_indexes.items():
+        for node in group.nodes:
+            node_indexes[node] = len(nodes)
+            nodes.append({'uid': node.uid, 'label': node.label(), 'name': node.name(), 'token': node.token,
+                          'qualname': node.token_with_ownership(), 'line': node.line_number, 'group': group_index})
+            nodes_by_token[node.token].append(node)
+            if node.is_constructor:
+                constructors_by_class_token[node.parent.token].append(node)
+
+    calls = []
+    for node_a, caller in node_indexes.items():
+        for call in node_a.calls:
+            candidates = _call_candidates(call, node_a, nodes_by_token, constructors_by_class_token,
+                                          constructed_owners.get(node_a.file_group()))
+            if candidates:
+                calls.append([caller, [node_indexes[node] for node in candidates]])
+
+    return {
+        'version': CALL_GRAPH_MODEL_VERSION,
+        'source_root': src_folder,
+        'files': files,
+        'groups': groups,
+        'nodes': nodes,
+        'calls': calls,
+    }
+
+
+def save_call_graph(graph, output_path):
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(graph, f)
+    count_written(output_path)
+
+
+def load_call_graph(input_path):
+    if not os.path.exists(input_path):
+        return None
+    with open(input_path, 'r') as f:
+        graph = json.load(f)
+    return graph if graph.get('version') == CALL_GRAPH_MODEL_VERSION else None
+
+
+class CallGraphProjection:
+    """Per-folder subgraphs of a build_call_graph model.
+
+    The subgraph of a folder keeps the calls between functions defined below it, resolved and trimmed
+    like code2flow does for a graph of that folder alone: functions without such a call are dropped.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.folder_files = defaultdict(list)
+        for file_index, file in enumerate(graph['files']):
+            folder = os.path.dirname(file)
+            while True:
+                self.folder_files[folder].append(file_index)
+                if folder == '':
+                    break
+                folder = os.path.dirname(folder)
+        self.file_nodes = defaultdict(list)
+        for node_index, node in enumerate(graph['nodes']):
+            self.file_nodes[graph['groups'][node['group']]['file']].append(node_index)
+        self.calls = defaultdict(list)
+        for caller, candidates in graph['calls']:
+            self.calls[caller].append(candidates)
+        # Reverse of the calls linked in the whole model, built by the first subset()
+        self.callers = None
+
+    def has_sources(self, relative_folder):
+        return bool(self.folder_files.get(relative_folder))
+
+    def project(self, relative_folder):
+        """(node indexes, edges) of the calls between the functions below relative_folder ('' is the root)."""
+        folder_nodes = set()
+        for file_index in self.folder_files.get(relative_folder, []):
+            folder_nodes.update(self.file_nodes[file_index])
+        edges = []
+        for caller in folder_nodes:
+            for candidates in self.calls.get(caller, []):
+                # Like code2flow on this folder alone: a call links when one candidate is below it
+                callees = [callee for callee in candidates if callee in folder_nodes]
+                if len(callees) == 1:
+                    edges.append((caller, callees[0]))
+        kept_nodes = {node for edge in edges for node in edge}
+        return kept_nodes, edges
+
+    def subset(self, target_function, upstream_depth=5, downstream_depth=10, file=None):
+        """(node indexes, edges) within upstream_depth callers and downstream_depth callees of target_function.
+
+        Calls are resolved over the whole model and the target is matched like code2flow's SubsetParams:
+        by function token, class.func or filename::class.func, and only in file (relative to the source root)
+        when one is given. Only the reached functions are visited.
+        """
+        nodes, groups = self.graph['nodes'], self.graph['groups']
+        targets = [index for index, node in enumerate(nodes) if target_function in (node['token'], node['qualname'], node['name'])]
+        if file is not None:
+            file = os.path.normpath(file)
+            targets = [index for index in targets if self.graph['files'][groups[nodes[index]['group']]['file']] == file]
+        if not targets:
+            raise ValueError(f"Could not find node {target_function!r} to build a subset.")
+        if len(targets) > 1:
+            raise ValueError(f"Found multiple nodes for {target_function!r}: {[nodes[index]['name'] for index in targets]}. "
+                             f"Try either a `class.func` or `filename::class.func`.")
+        if self.callers is None:
+            self.callers = defaultdict(set)
+            for caller, candidates_list in self.calls.items():
+                for candidates in candidates_list:
+                    if len(candidates) == 1:
+                        self.callers[candidates[0]].add(caller)
+
+        def callees(node_index):
+            return {candidates[0] for candidates in self.calls.get(node_index, []) if len(candidates) == 1}
+
+        kept_nodes = {targets[0]}
+        for depth, neighbours in ((downstream_depth, callees), (upstream_depth, lambda index: self.callers.get(index, ()))):
+            step_nodes = {targets[0]}
+            for _ in range(depth):
+                step_nodes = {neighbour for node_index in step_nodes for neighbour in neighbours(node_index)}
+                kept_nodes.update(step_nodes)
+        edges = {(caller, callee) for caller in kept_nodes for callee in callees(caller) if callee in kept_nodes}
+        return kept_nodes, sorted(edges)
+
+    def to_dot(self, subgraph):
+        # Same layout as code2flow's write_file, with the legend hidden like code2flow.code2flow does by default
+        nodes, groups = self.graph['nodes'], self.graph['groups']
+        kept_nodes, edges = subgraph
+        callers = {caller for caller, _ in edges}
+        callees = {callee for _, callee in edges}
+
+        content = "digraph G {\n"
+        content += "concentrate=true;\n"
+        content += f'splines="{"polyline" if len(edges) >= 500 else "ortho"}";\n'
+        content += 'rankdir="LR";\n'
+        for node_index in sorted(kept_nodes, key=lambda index: nodes[index]['name']):
+            node = nodes[node_index]
+            fillcolor = TRUNK_COLOR if node_index not in callees else LEAF_COLOR if node_index not in callers else NODE_COLOR
+            content += (f'{node["uid"]} [label="{node["label"]}" name="{node["name"]}" shape="rect" '
+                        f'style="rounded,filled" fillcolor="{fillcolor}" ];\n')
+        for caller, callee in sorted(edges, key=lambda edge: (nodes[edge[0]]['name'], nodes[edge[1]]['name'])):
+            caller_uid = nodes[caller]['uid']
+            color = EDGE_COLORS[int(caller_uid.split("_")[-1], 16) % len(EDGE_COLORS)]
+            content += f'{caller_uid} -> {nodes[callee]["uid"]} [color="{color}" penwidth="2"];\n'
+
+        group_nodes = defaultdict(list)
+        for node_index in sorted(kept_nodes):
+            group_nodes[nodes[node_index]['group']].append(node_index)
+        subgroups = defaultdict(list)
+        kept_groups = set()
+        for group_index in group_nodes:
+            while group_index is not None and group_index not in kept_groups:
+                kept_groups.add(group_index)
+                group_index = groups[group_index]['parent']
+        for group_index in sorted(kept_groups):
+            subgroups[groups[group_index]['parent']].append(group_index)
+
+        def group_dot(group_index):
+            group = groups[group_index]
+            ret = 'subgraph ' + group['uid'] + ' {\n'
+            if group_nodes[group_index]:
+                ret += '    ' + ' '.join(nodes[node_index]['uid'] for node_index in group_nodes[group_index]) + ';\n'
+            for key, value in (('label', group['label']), ('name', group['token']), ('style', 'filled')):
+                ret += f'    {key}="{value}";\n'
+            ret += '    graph[style=dotted];\n'
+            for subgroup_index in subgroups[group_index]:
+                ret += '    ' + ('\n'.join('    ' + line for line in group_dot(subgroup_index).split('\n'))).strip() + '\n'
+            ret += '};\n'
+            return ret
+
+        for group_index in sorted(subgroups[None], key=lambda index: groups[index]['label']):
+            content += group_dot(group_index)
+        content += '}\n'
+        return content
+
+    def to_json(self, subgraph):
+        # Same shape as code2flow's json output
+        nodes = self.graph['nodes']
+        kept_nodes, edges = subgraph
+        return json.dumps({"graph": {
+            "directed": True,
+            "nodes": {nodes[index]['uid']: {'uid': nodes[index]['uid'], 'label': nodes[index]['label'],
+                                             'name': nodes[index]['name']}
+                      for index in sorted(kept_nodes, key=lambda index: nodes[index]['name'])},
+            "edges": [{'source': nodes[caller]['uid'], 'target': nodes[callee]['uid'], 'directed': True}
+                      for caller, callee in sorted(edges, key=lambda edge: (nodes[edge[0]]['name'], nodes[edge[1]]['name']))],
+        }})
+
+    def write(self, subgraph, output_file, renderer=None):
+        """Write a project() or subset() subgraph the way code2flow writes output_file (.png/.svg, .gv/.dot or .json).
+
+        Images are rendered on renderer when one is given.
+        """
+        output_base, extension = output_file.rsplit('.', 1)
+        directory = os.path.dirname(output_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if extension == 'json':
+            with open(output_file, 'w') as f:
+                f.write(self.to_json(subgraph))
+            count_written(output_file)
+            return
+        dot_file = output_file if extension in ('gv', 'dot') else output_base + '.gv'
+        with open(dot_file, 'w') as f:
+            f.write(self.to_dot(subgraph))
+        count_written(dot_file)
+        if dot_file != output_file:
+            render_dot(dot_file, output_file, extension, renderer)
+
+
+def generate_call_graphs_for_folders(src_folder: str, output_folder: str, extension ='.png', parsed_sources=None, incremental=None,
+                                     renderer=None, lazy=False, source_tree=None):
+    """Generate a call graph for each folder, all projected from one call graph of src_folder
+
+    With lazy only the call graph model is written, render_folder_call_graph draws a folder when it is asked for.
+    """
+    model_path = os.path.join(output_folder, CALL_GRAPH_MODEL_FILE)
+    model_digest = incremental.folder_digest(src_folder, '.py') if incremental is not None else None
+    projection = None
+
+    def get_projection():
+        nonlocal projection
+        if projection is None:
+            graph = None
+            if incremental is not None and incremental.reuse(model_path, model_digest):
+                graph = load_call_graph(model_path)
+            if graph is None:
+                graph = build_call_graph(src_folder, parsed_sources, source_tree)
+                save_call_graph(graph, model_path)
+                if incremental is not None:
+                    incremental.record(model_path, model_digest)
+            projection = CallGraphProjection(graph)
+        return projection
+
+    for root, dirs, files in walk_source(src_folder, source_tree):
+        if lazy:
+            break
         relative_path = os.path.relpath(root, src_folder)
         output_dir = os.path.join(output_folder, relative_path)
         pathlib.Path(output_dir).mkdir(parents=True, exist_ok=True)
         output_file = os.path.join(output_dir, 'call_graph'+ extension)
-        _generate_call_path(root, output_file)
-        # if dirs:
-        #     python_files = [os.path.join(root, file) for file in files if file.endswith('.py')]
-        #     if python_files:
-        #         relative_path = os.path.relpath(root, src_folder)
-        #         output_dir = os.path.join(output_folder, relative_path)
-        #         pathlib.Path(output_dir).mkdir(parents=True, exist_ok=True)
-        #         output_file = os.path.join(output_dir, 'call_graph.png')
-        #         generate_call_path(python_files, output_file, target_function)
-
-def generate_call_graphs_for_function(src_folder: str, output_folder: str, target_function: str):
-    
-    _generate_call_path(src_folder, os.path.join( output_folder, target_function+".png"), target_function)
+        if incremental is not None:
+            # The graph of a folder only depends on the python files below it
+            digest = incremental.folder_digest(root, '.py')
+            if incremental.reuse(output_file, digest):
+                continue
+        relative_folder = '' if relative_path == '.' else relative_path
+        projection = get_projection()
+        if not projection.has_sources(relative_folder):
+            print(f"Error generating call graph: no python files found in {root}")
+            continue
+        projection.write(projection.project(relative_folder), output_file, renderer)
+        if incremental is not None and (renderer is not None or os.path.exists(output_file)):
+            # A queued image is recorded before it exists, reuse() skips it if it never got rendered
+            incremental.record(output_file, digest)
+    if projection is None and (incremental is None or not incremental.reuse(model_path, model_digest)):
+        # Every folder graph was reused, the model is still kept for later queries on this output
+        get_projection()
+
+def render_folder_call_graph(output_folder: str, relative_folder: str, extension ='.png', renderer=None):
+    """Draw the call graph of one folder from the model of a lazy run, returns the image path.
+
+    The image is cached next to the model, so only the first request of a folder renders it. With a renderer,
+    e.g. a RenderPool, the image is rendered there.
+    """
+    output_file = os.path.join(output_folder, relative_folder, 'call_graph' + extension)
+    if os.path.exists(output_file):
+        return output_file
+    graph = load_call_graph(os.path.join(output_folder, CALL_GRAPH_MODEL_FILE))
+    if graph is None:
+        raise FileNotFoundError(f"No call graph model in {output_folder}")
+    projection = CallGraphProjection(graph)
+    relative_folder = '' if relative_folder in ('', '.') else os.path.normpath(relative_folder)
+    if not projection.has_sources(relative_folder):
+        raise FileNotFoundError(f"No python files below {relative_folder}")
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    projection.write(projection.project(relative_folder), output_file, renderer)
+    return output_file
+
+def generate_call_graphs_for_function(src_folder: str, output_folder: str, target_function: str, upstream_depth = 5,
+                                      downstream_depth = 10, call_graph_folder = 'folder_call_graph_info'):
+    """Draw the up/downstream call graph of target_function into output_folder, an analysis output of src_folder.
+
+    The subset is cut from the call graph model of that analysis. Without one the model is built and kept for
+    the next query.
+    """
+    output_file = os.path.join(output_folder, target_function + ".png")
+    model_path = os.path.join(output_folder, call_graph_folder, CALL_GRAPH_MODEL_FILE)
+    graph = load_call_graph(model_path)
+    if graph is None or graph['source_root'] != os.path.abspath(src_folder):
+        graph = build_call_graph(src_folder)
+        save_call_graph(graph, model_path)
+    graph_index = CallGraphProjection(graph)
+    try:
+        graph_index.write(graph_index.subset(target_function, upstream_depth, downstream_depth), output_file)
+    except ValueError as e:
+        print(f"Error generating call graph: {e}")
+        return None
+    return output_file
 
 
 if __name__ == "__main__":
@@ -0,0 +1,167 @@
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+from call_stack_server import server_info_path, read_server_info
+from python_call_stack_generator import write_call_stack
+
+
+def server_lock_path(ast_dir):
+    # Held by the one client starting the server of ast_dir, the others wait for that server
+    return server_info_path(ast_dir) + '.lock'
+
+
+class CallStackClient:
+    """Sends queries to the call stack server of an ast_info folder, starting it when none is running."""
+
+    def __init__(self, ast_dir, start_server=True, startup_timeout=120, memory_budget=None):
+        self.ast_dir = ast_dir
+        # Megabytes of ASTs a server started by this client keeps loaded
+        self.memory_budget = memory_budget
+        self.start_server = start_server
+        self.startup_timeout = startup_timeout
+        self.next_id = 0
+        # Read from the info file of the server, which only this user can read
+        self.token = None
+
+    def _connect(self):
+        info = read_server_info(self.ast_dir)
+        if info is None:
+            return None
+        try:
+            connection = socket.create_connection(('127.0.0.1', info['port']), timeout=self.startup_timeout)
+        except OSError:
+            # The server went away without removing its info file
+            return None
+        self.token = info.get('token')
+        return connection
+
+    def _acquire_start_lock(self):
+        lock_path = server_lock_path(self.ast_dir)
+        try:
+            os.close(os.open(lock_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600))
+            return True
+        except FileExistsError:
+            pass
+        try:
+            # A client that died while starting the server leaves its lock behind
+            if time.time() - os.path.getmtime(lock_path) > self.startup_timeout:
+                os.remove(lock_path)
+        except OSError:
+            pass
+        return False
+
+    def _start_server(self):
+        # Only the client holding the lock starts a server, the other ones wait for its info file
+        deadline = time.time() + self.startup_timeout
+        while time.time() < deadline:
+            if self._acquire_start_lock():
+                try:
+                    return self._connect() or self._spawn_server()
+                finally:
+                    os.remove(server_lock_path(self.ast_dir))
+            connection = self._connect()
+            if connection is not None:
+                return connection
+            time.sleep(0.05)
+        raise TimeoutError(f"The call stack server for {self.ast_dir} did not start")
+
+    def _spawn_server(self):
+        server_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'call_stack_server.py')
+        kwargs = {'stdout': subprocess.DEVNULL, 'stderr': subprocess.DEVNULL, 'stdin': subprocess.DEVNULL}
+        if os.name == 'nt':
+            kwargs['creationflags'] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            kwargs['start_new_session'] = True
+        # A stale info file is left as it is, the new server replaces it
+        command = [sys.executable, server_script, '-a', self.ast_dir]
+        if self.memory_budget is not None:
+            command += ['--memory-budget', str(self.memory_budget)]
+        subprocess.Popen(command, **kwargs)
+
+        deadline = time.time() + self.startup_timeout
+        while time.time() < deadline:
+            connection = self._connect()
+            if connection is not None:
+                return connection
+            time.sleep(0.05)
+        raise TimeoutError(f"The call stack server for {self.ast_dir} did not start")
+
+    def request(self, op, **params):
+        connection = self._connect()
+        if connection is None:
+            if not self.start_server:
+                raise ConnectionError(f"No call stack server is running for {self.ast_dir}")
+            connection = self._start_server()
+        self.next_id += 1
+        with connection, connection.makefile('rwb') as stream:
+            stream.write((json.dumps(dict(params, op=op, id=self.next_id, token=self.token)) + '\n').encode('utf-8'))
+            stream.flush()
+            response = json.loads(stream.readline())
+        if not response.get('ok'):
+            raise RuntimeError(response.get('error'))
+        return response['result']
+
+    def callstack(self, file_name, method_name, output_file=None, max_depth=None, max_nodes=None):
+        return self.request('callstack', file=file_name, method=method_name, output_file=output_file,
+                            max_depth=max_depth, max_nodes=max_nodes)
+
+    def batch(self, file_name=None, output_file=None, max_depth=None):
+        return self.request('batch', file=file_name, output_file=output_file, max_depth=max_depth)
+
+    def callees(self, name):
+        return self.request('callees', name=name)
+
+    def callers(self, name):
+        return self.request('callers', name=name)
+
+    def subset(self, name, file_name=None, output_file=None, upstream_depth=5, downstream_depth=10):
+        return self.request('subset', name=name, file=file_name, output_file=output_file, upstream_depth=upstream_depth,
+                            downstream_depth=downstream_depth)
+
+    def shutdown(self):
+        return self.request('shutdown')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Retrieve a method call stack from the call stack server.')
+    parser.add_argument('-a','--ast_dir', type=str, help='The directory containing the ASTs.')
+    parser.add_argument('-f','--file_name', type=str, help='The name of the file to analyze.')
+    parser.add_argument('-m','--method_name', type=str, help='The name of the method to analyze.')
+    parser.add_argument('-o','--output_file', type=str, help='The file to save the output.')
+    parser.add_argument('--op', type=str, default='callstack', choices=['callstack', 'batch', 'callees', 'callers', 'subset', 'shutdown'],
+                        help='The query to run, callees and callers take the qualified name in -m. subset draws '
+                             'the up/downstream call graph of -m (func, Class.func or file::Class.func, in the file '
+                             '-f when given) from the call graph model into -o (.png, .svg, .gv or .json). batch writes '
+                             'the call stacks of every function in -f, or in every file without -f.')
+    parser.add_argument('--max-depth', type=int, help='Calls followed below the method, unlimited by default.')
+    parser.add_argument('--max-nodes', type=int, help='Functions expanded at most, unlimited by default.')
+    parser.add_argument('--memory-budget', type=float, help='Megabytes of ASTs a started server keeps loaded, all of '
+                                                            'them by default.')
+    args = parser.parse_args()
+
+    client = CallStackClient(args.ast_dir, memory_budget=args.memory_budget)
+    # Call stacks are written here, like python_call_stack_generator.py does, the server only writes the drawn
+    # subsets, and only below its analysis folder
+    if args.op == 'callstack':
+        result = client.callstack(args.file_name, args.method_name, max_depth=args.max_depth, max_nodes=args.max_nodes)
+        if args.output_file:
+            write_call_stack(result, args.output_file)
+    elif args.op == 'batch':
+        result = client.batch(args.file_name, max_depth=args.max_depth)
+        if args.output_file:
+            write_call_stack(result, args.output_file)
+    elif args.op == 'subset':
+        result = client.subset(args.method_name, args.file_name,
+                               os.path.abspath(args.output_file) if args.output_file else None)
+    elif args.op == 'shutdown':
+        result = client.shutdown()
+    else:
+        result = client.request(args.op, name=args.method_name)
+        if args.output_file:
+            with open(args.output_file, 'w') as f:
+                json.dump(result, f, indent=4)
+    print(json.dumps(result, indent=4))
@@ -0,0 +1,245 @@
+import os
+import sys
+import json
+import hmac
+import time
+import secrets
+import argparse
+import threading
+import socketserver
+from python_call_stack_generator import open_ast_store, write_call_stack, CallStackExpander
+from call_graph_analyzer import CallGraphProjection, load_call_graph, CALL_GRAPH_MODEL_FILE
+from memory_budget import budget_bytes
+from source_ingest import is_path_under
+
+
+def server_info_path(ast_dir):
+    # Same convention as the symbol index: a sibling of the ast_info folder
+    return os.path.normpath(ast_dir) + '.server.json'
+
+
+def read_server_info(ast_dir):
+    """port, pid and token of the server of ast_dir, None when it is not running or not readable."""
+    try:
+        with open(server_info_path(ast_dir), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_server_info(info_path, info):
+    # Readable by this user only, the token in it lets a client in. Written aside and moved in place, so a
+    # client never reads half of it
+    temp_path = f'{info_path}.{os.getpid()}.tmp'
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(info, f)
+    os.replace(temp_path, info_path)
+
+
+class CallStackService:
+    """Answers call stack queries from one ast_info folder kept loaded in memory."""
+
+    def __init__(self, ast_dir, memory_budget=None):
+        self.ast_dir = ast_dir
+        # Output files are only written below the analysis folder holding ast_info
+        self.analysis_folder = os.path.dirname(os.path.normpath(os.path.abspath(ast_dir)))
+        # Bytes of ASTs kept loaded between queries, all of them when None
+        self.memory_budget = memory_budget
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        self.asts, self.symbol_index = open_ast_store(self.ast_dir, self.memory_budget)
+        # Every callee list found by a query is kept for the next ones
+        self.expander = CallStackExpander(self.asts, self.symbol_index)
+        self.function_definitions = self.expander.function_definitions
+        self.callers = None
+        self.call_graph = None
+
+    def _output_path(self, output_file):
+        output_file = os.path.realpath(output_file)
+        if not is_path_under(output_file, os.path.realpath(self.analysis_folder)):
+            raise PermissionError(f"{output_file} is outside the analysis folder {self.analysis_folder}")
+        return output_file
+
+    def callstack(self, file, method, output_file=None, max_depth=None, max_nodes=None):
+        call_stack = self.expander.expand(file, method, max_depth, max_nodes)
+        if output_file:
+            write_call_stack(call_stack, self._output_path(output_file))
+        return call_stack
+
+    def _resolve(self, name=None, file=None, method=None):
+        if file is None:
+            if name not in self.function_definitions:
+                raise KeyError(f"Unknown function {name}")
+            file, method = self.function_definitions[name], name
+        return file, method
+
+    def callees(self, name=None, file=None, method=None):
+        file, method = self._resolve(name, file, method)
+        if file not in self.asts:
+            raise KeyError(f"Unknown file {file}")
+        return self.expander.callees_of(file, method)
+
+    def _build_callers(self):
+        # Built once on the first callers query, every later one is a dict lookup
+        callers = {}
+        for name, file in self.function_definitions.items():
+            if file not in self.asts:
+                continue
+            for call in self.expander.callees_of(file, name):
+                callers.setdefault(call['name'], []).append({'name': name, 'file': file, 'lineno': call['lineno']})
+        self.callers = callers
+
+    def callers_of(self, name):
+        if self.callers is None:
+            self._build_callers()
+        return self.callers.get(name, [])
+
+    def subset(self, name, file=None, upstream_depth=5, downstream_depth=10, output_file=None):
+        # Cut from the code2flow call graph model of the analysis, which resolves self and instance method calls.
+        # It is loaded by the first subset query and kept for the next ones
+        if self.call_graph is None:
+            graph = load_call_graph(os.path.join(self.analysis_folder, 'folder_call_graph_info', CALL_GRAPH_MODEL_FILE))
+            if graph is None:
+                raise FileNotFoundError(f"No call graph model in {self.analysis_folder}")
+            self.call_graph = CallGraphProjection(graph)
+        subgraph = self.call_graph.subset(name, upstream_depth, downstream_depth, file)
+        if output_file:
+            self.call_graph.write(subgraph, self._output_path(output_file))
+        nodes = self.call_graph.graph['nodes']
+        kept_nodes, edges = subgraph
+        return {'functions': sorted(nodes[index]['name'] for index in kept_nodes),
+                'edges': [(nodes[caller]['name'], nodes[callee]['name']) for caller, callee in edges]}
+
+    def handle(self, request):
+        op = request.get('op')
+        with self.lock:
+            if op == 'ping':
+                return {'ast_dir': self.ast_dir, 'symbols': len(self.symbol_index)}
+            if op == 'callstack':
+                return self.callstack(request['file'], request['method'], request.get('output_file'),
+                                      request.get('max_depth'), request.get('max_nodes'))
+            if op == 'batch':
+                call_stack = self.expander.expand_all(request.get('file'), request.get('max_depth'))
+                if request.get('output_file'):
+                    write_call_stack(call_stack, self._output_path(request['output_file']))
+                return call_stack
+            if op == 'callees':
+                return self.callees(request.get('name'), request.get('file'), request.get('method'))
+            if op == 'callers':
+                return self.callers_of(request['name'])
+            if op == 'subset':
+                return self.subset(request['name'], request.get('file'), request.get('upstream_depth', 5),
+                                   request.get('downstream_depth', 10), request.get('output_file'))
+            if op == 'reload':
+                self.load()
+                return {'symbols': len(self.symbol_index)}
+        raise ValueError(f"Unknown op {op}")
+
+    def respond(self, line):
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            return {'ok': False, 'error': f"Invalid request: {e}"}
+        started = time.perf_counter()
+        try:
+            result = self.handle(request)
+            response = {'id': request.get('id'), 'ok': True, 'result': result}
+        except Exception as e:
+            response = {'id': request.get('id'), 'ok': False, 'error': f"{type(e).__name__}: {e}"}
+        response['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        return response
+
+
+def _is_shutdown(line):
+    try:
+        return json.loads(line).get('op') == 'shutdown'
+    except (ValueError, AttributeError):
+        return False
+
+
+def _has_token(line, token):
+    try:
+        return hmac.compare_digest(str(json.loads(line).get('token')), token)
+    except (ValueError, AttributeError):
+        return False
+
+
+def serve_stdio(service):
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        if _is_shutdown(line):
+            break
+        sys.stdout.write(json.dumps(service.respond(line)) + '\n')
+        sys.stdout.flush()
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            self.server.last_request = time.time()
+            # Any local process can connect, only the ones that could read the info file get an answer
+            if not _has_token(line, self.server.token):
+                self.wfile.write(b'{"ok": false, "error": "Invalid token"}\n')
+                return
+            if _is_shutdown(line):
+                self.wfile.write(b'{"ok": true, "result": "shutdown"}\n')
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+                return
+            self.wfile.write((json.dumps(self.server.service.respond(line)) + '\n').encode('utf-8'))
+
+
+class CallStackServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, service, port=0):
+        super().__init__(('127.0.0.1', port), _RequestHandler)
+        self.service = service
+        self.token = secrets.token_hex(16)
+        self.last_request = time.time()
+
+
+def _stop_when_idle(server, idle_timeout):
+    while True:
+        time.sleep(min(idle_timeout, 30))
+        if time.time() - server.last_request > idle_timeout:
+            server.shutdown()
+            return
+
+
+def serve_socket(service, port=0, idle_timeout=None):
+    server = CallStackServer(service, port)
+    info_path = server_info_path(service.ast_dir)
+    _write_server_info(info_path, {'port': server.server_address[1], 'pid': os.getpid(), 'token': server.token})
+    print(f"Serving call stacks for {service.ast_dir} on 127.0.0.1:{server.server_address[1]}")
+    if idle_timeout:
+        threading.Thread(target=_stop_when_idle, args=(server, idle_timeout), daemon=True).start()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        # Only our own, a server started after this one may have replaced it
+        if (read_server_info(service.ast_dir) or {}).get('token') == server.token:
+            os.remove(info_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve call stack queries for an ast_info folder.')
+    parser.add_argument('-a', '--ast_dir', type=str, required=True, help='The directory containing the ASTs.')
+    parser.add_argument('--stdio', action='store_true', help='Read JSON requests from stdin instead of a local socket.')
+    parser.add_argument('-p', '--port', type=int, default=0, help='The local port to listen on, 0 picks a free one.')
+    parser.add_argument('--idle-timeout', type=float, default=1800, help='Exit after this many idle seconds.')
+    parser.add_argument('--memory-budget', type=float, help='Megabytes of ASTs kept loaded, all of them by default.')
+    args = parser.parse_args()
+
+    call_stack_service = CallStackService(args.ast_dir, budget_bytes(args.memory_budget))
+    if args.stdio:
+        serve_stdio(call_stack_service)
+    else:
+        serve_socket(call_stack_service, args.port, args.idle_timeout)
@@ -2,10 +2,16 @@ from dataclasses import dataclass, field,asdict
 from typing import List,Dict
 import json
 import os
+import sqlite3
+import tempfile
 from pathlib import Path
 from collections import defaultdict
 from typing import Dict, List, Set
 from generate_class_graph import recursively_traverse_and_create_graphs
+from render_pool import render_dot
+from analysis_store import store_key, native_path
+from memory_budget import BoundedCache
+from stage_metrics import count_written
 # Define a data class to store information
 @dataclass
 class FileInfo:
@@ -26,39 +32,109 @@ def load_file_info_from_json(file_path: str) -> FileInfo:
         data = json.load(f)
     return FileInfo(**data)
 
-def summarize_defined_modules(input_folder: Path) -> Dict[str,str]:
-    defined_modules = {}
+def iter_defined_modules(input_folder: Path):
+    """Yield (module name, file path) of every code_info JSON below input_folder, one file loaded at a time."""
     for json_file in input_folder.rglob('*.json'):
         file_info = load_file_info_from_json(json_file)
-        defined_modules[file_info.package_name+"."+file_info.file_name.replace(".py", "")] = file_info.relative_path+"\\"+file_info.file_name
-    return defined_modules
+        yield file_info.package_name+"."+file_info.file_name.replace(".py", ""), file_info.relative_path+"\\"+file_info.file_name
+
+def summarize_defined_modules(input_folder: Path) -> Dict[str,str]:
+    return dict(iter_defined_modules(input_folder))
+
+@dataclass
+class FolderDependencies:
+    """Imports and module names of one code_info folder, aggregated over everything below it."""
+    # First-level entries in listdir order: (folder name, relative folder, None) or (module name, None, imports)
+    items: List[tuple] = field(default_factory=list)
+    imports: Set[str] = field(default_factory=set)
+    modules: Set[str] = field(default_factory=set)
+
+
+def build_dependency_model(root_folder, max_depth=None) -> Dict[str, FolderDependencies]:
+    """
+    Load every code_info JSON below root_folder once and aggregate imports and modules bottom-up.
 
-def traverse_folder_recursively(folder_path):
+    Returns the FolderDependencies of every folder keyed by its path relative to root_folder ('' is the root),
+    or only of the folders at most max_depth levels below it.
     """
-    Recursively traverse the files and folders starting from folder_path.
+    def entries(folder_path):
+        for item in os.listdir(folder_path):
+            item_path = os.path.join(folder_path, item)
+            if os.path.isdir(item_path):
+                yield item, entries(item_path)
+            elif item_path.endswith('.json'):
+                yield item, load_file_info_from_json(item_path)
+            else:
+                # Process other file types if necessary
+                print(f"Found non-JSON file: {item_path}")
+
+    model: Dict[str, FolderDependencies] = {}
+    _aggregate_folder(model, '', entries(str(root_folder)), max_depth)
+    return model
+
+
+def build_dependency_model_from_store(store, max_depth=None) -> Dict[str, FolderDependencies]:
+    """build_dependency_model of the code_info kept in an AnalysisStore, folders and files in name order."""
+    root = {}
+    for path, code_info in store.code_infos():
+        *folders, name = path.split('/')
+        folder = root
+        for folder_name in folders:
+            folder = folder.setdefault(folder_name, {})
+        folder[name] = FileInfo(**code_info)
+
+    def entries(folder):
+        for name in sorted(folder):
+            yield name, entries(folder[name]) if isinstance(folder[name], dict) else folder[name]
+
+    model: Dict[str, FolderDependencies] = {}
+    _aggregate_folder(model, '', entries(root), max_depth)
+    return model
+
+
+def _aggregate_folder(model, relative_folder, entries, max_depth=None, depth=0) -> FolderDependencies:
+    # entries yields (name, entries of a sub folder) or (name, FileInfo of a file)
+    folder = FolderDependencies()
+    for item, entry in entries:
+        if isinstance(entry, FileInfo):
+            module = entry.package_name + "." + entry.file_name.replace(".py", "")
+            imports = file_imports(entry)
+            folder.items.append((module, None, imports))
+            folder.imports |= imports
+            folder.modules.add(module)
+        else:
+            child_folder = os.path.join(relative_folder, item) if relative_folder else item
+            child = _aggregate_folder(model, child_folder, entry, max_depth, depth + 1)
+            folder.items.append((item, child_folder, None))
+            folder.imports |= child.imports
+            folder.modules |= child.modules
+    if max_depth is None or depth <= max_depth:
+        model[relative_folder] = folder
+    return folder
+
+
+def folder_dependencies(model: Dict[str, FolderDependencies], relative_folder='', package_root=""):
+    """
+    Dependencies and packages of the first-level files and folders of one folder of the model.
 
     Parameters:
-    - folder_path (str): The path to the folder to traverse.
+    - model: The result of build_dependency_model.
+    - relative_folder (str): The folder to process, relative to the model root.
+    - package_root (str): The package prefix of the first-level folders.
     """
-    import_deps: Set[str] = set()
-    package_full_set : Set[str] = set()
-    for item in os.listdir(folder_path):
-        item_path = os.path.join(folder_path, item)
-        if (item_path.find("executable") != -1):
-            print(item_path)
-        if os.path.isdir(item_path):
-            # If the item is a folder, recurse into it
-            inner_imports,inner_package_full_set = traverse_folder_recursively(item_path)
-            import_deps = import_deps.union(inner_imports)
-            package_full_set = package_full_set.union(inner_package_full_set)
-        elif item_path.endswith('.json'):
-            import_deps = import_deps.union(fetch_dep_imports(item_path))
-            package_full_set.add(fetch_package_full(item_path))
-            
+    item_dependencies: Dict[str, Set[str]] = defaultdict(set)
+    package_dict: Dict[str, Set[str]] = defaultdict(set)
+    for name, child_folder, imports in model[relative_folder].items:
+        if child_folder is not None:
+            folder_key = package_root + "." + name
+            item_dependencies[folder_key] = model[child_folder].imports
+            package_dict[folder_key] = model[child_folder].modules
         else:
-            # Process other file types if necessary
-            print(f"Found non-JSON file: {item_path}")
-    return import_deps,package_full_set
+            # A file keeps its module name as a plain string, as the graph.csv format expects
+            item_dependencies[name] = imports
+            package_dict[name] = name
+    return item_dependencies, package_dict
+
 
 def process_folder(folder_path,package_root="") :
     """
@@ -67,32 +143,18 @@ def process_folder(folder_path,package_root="") :
     Parameters:
     - folder_path (str): The path to the folder to process.
     """
-    item_dependencies: Dict[str, Set[str]] = defaultdict(set)
-    package_dict: Dict[str, Set[str]] = defaultdict(set)
-    for item in os.listdir(folder_path):
-        item_path = os.path.join(folder_path, item)
-        if os.path.isdir(item_path):
-            folder_key = package_root+"."+item_path.split("\\")[-1] 
-            # If the item is a folder, delegate to the recursive traversal function
-            deps,package_full_set = traverse_folder_recursively(item_path)
-            item_dependencies[folder_key] = deps
-            package_dict[folder_key] = package_full_set
-        elif item_path.endswith('.json'):
-            # If the item is a JSON file, read it
-            file_info = load_file_info_from_json(item_path)
-            folder_key = file_info.package_name + "." + file_info.file_name.replace(".py", "")
-            item_dependencies[folder_key] = fetch_dep_imports(item_path)
-            package_dict[folder_key] = fetch_package_full(item_path)
-        else:
-            # Process other file types if necessary
-            print(f"Found non-JSON file: {item_path}")
+    return folder_dependencies(build_dependency_model(folder_path, max_depth=1), '', package_root)
 
-    return item_dependencies,package_dict
 
+def file_imports(file_info: FileInfo) -> Set[str]:
+    # "from pkg import mod" may import a submodule, keep pkg.mod and let resolution fall back to pkg
+    imports = set(file_info.imports).union(file_info.from_imports.keys())
+    for module, names in file_info.from_imports.items():
+        imports.update(module + "." + name for name in names if module and name != "*")
+    return imports
 
-def fetch_dep_imports(file_path: Path) -> List[str]:
-    file_info = load_file_info_from_json(file_path)
-    return set(file_info.imports).union(file_info.from_imports.keys())
+def fetch_dep_imports(file_path: Path) -> Set[str]:
+    return file_imports(load_file_info_from_json(file_path))
 
 def fetch_package_full(file_path: Path) -> str:
     file_info = load_file_info_from_json(file_path)
@@ -100,31 +162,46 @@ def fetch_package_full(file_path: Path) -> str:
 
 import graphviz
 
+def build_module_index(package_dict) -> Dict[str, str]:
+    """Owning package key of every module name, the first key of package_dict wins."""
+    module_index = {}
+    for package, modules in package_dict.items():
+        # A file maps to its own module name, a folder to the set of modules below it
+        for module in ([modules] if isinstance(modules, str) else modules):
+            module_index.setdefault(module, package)
+            if module.endswith(".__init__"):
+                # "import pkg.sub" is owned by pkg/sub/__init__.py
+                module_index.setdefault(module[:-len(".__init__")], package)
+    return module_index
+
+def resolve_dependency(dep, module_index: Dict[str, str]) -> str:
+    """Owning package key of an import, trying its parents when unknown: pkg.sub.mod.name -> pkg.sub.mod -> pkg.sub."""
+    while dep:
+        package = module_index.get(dep)
+        if package is not None:
+            return package
+        dep = dep.rpartition(".")[0]
+    return ''
+
 def generate_dep_node_edges(package_dict,dependency_dict): 
-        # Filter the dependencies to only include those in the package list
-    def is_dependency_valid(dep, package_dict:Dict[str,Set[str]]) -> str:
-        for package, deps in package_dict.items():
-            if dep in deps:
-                return package
-        return ''
+    # Filter the dependencies to only include those in the package list
+    module_index = build_module_index(package_dict)
 
     filtered_dependencies = {}
     for package, deps in dependency_dict.items():
         valid_deps = set()
         for dep in deps:
-            founded_dep = is_dependency_valid(dep, package_dict)
+            founded_dep = resolve_dependency(dep, module_index)
             if founded_dep != '' and founded_dep != package:
                 valid_deps.add(founded_dep)
-        # if is_dependency_valid(package, package_list):
         filtered_dependencies[package] = valid_deps
-    
-
 
     return filtered_dependencies
 
 def generate_dependency_graph_graphviz(package_dict:Dict[str,Set[str]], dependency_dict):
-    filtered_dependencies = generate_dep_node_edges(package_dict,dependency_dict)
+    return dependency_graphviz(generate_dep_node_edges(package_dict,dependency_dict))
 
+def dependency_graphviz(filtered_dependencies):
     # # Return the DOT graph representation
     # return dot
     # Initialize a directed graph
@@ -145,7 +222,9 @@ def generate_dependency_graph_graphviz(package_dict:Dict[str,Set[str]], dependen
     return dot
 
 def generate_dependency_graph_csv(package_dict:Dict[str,Set[str]], dependency_dict):
-    filtered_dependencies = generate_dep_node_edges(package_dict,dependency_dict)
+    return dependency_csv_data(generate_dep_node_edges(package_dict,dependency_dict))
+
+def dependency_csv_data(filtered_dependencies):
     # Prepare data for CSV
     csv_data = []
     csv_data.append(['Type', 'Identifier', 'Source', 'Target', 'Label', 'TypeKind'])
@@ -178,54 +257,266 @@ def topological_sort(dependencies: Dict[str, Set[str]]) -> List[str]:
 
     return [node for node, _ in sort_in_degree]
 
-import os
-
-def find_subfolders(root_folder):
-    subfolders = ['']
-    for root, dirs, files in os.walk(root_folder):
-        for dir in dirs:
-            # Calculate the relative path of the subfolder
-            rel_path = os.path.relpath(os.path.join(root, dir), start=root_folder)
-            # Replace os.path.sep with '\' to ensure the format matches your example
-            rel_path = rel_path.replace(os.path.sep, '\\')
-            subfolders.append(rel_path)
-    return subfolders
-
 def write_csv_data(output_folder, csv_data):
     with open(output_folder, 'w') as f:
         for row in csv_data:
             f.write(','.join(row) + '\n')
+    count_written(output_folder)
 
-def analysis_dependency(root_folder, output_folder, format="png"):
-    targetfolders = find_subfolders(root_folder)
+SPILL_SCHEMA = """
+CREATE TABLE folders (folder TEXT PRIMARY KEY);
+CREATE TABLE entries (folder TEXT NOT NULL, position INTEGER NOT NULL, name TEXT NOT NULL, child TEXT, module TEXT,
+                      UNIQUE (folder, name));
+CREATE TABLE module_names (path TEXT NOT NULL, name TEXT NOT NULL);
+CREATE INDEX module_names_path ON module_names (path, name);
+CREATE TABLE import_names (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE prefixes (import_id INTEGER NOT NULL, level INTEGER NOT NULL, prefix TEXT NOT NULL);
+CREATE INDEX prefixes_import ON prefixes (import_id, level);
+CREATE TABLE file_imports (path TEXT NOT NULL, import_id INTEGER NOT NULL);
+CREATE INDEX file_imports_path ON file_imports (path, import_id);
+CREATE TABLE current (item TEXT PRIMARY KEY, rank INTEGER NOT NULL);
+CREATE TABLE owners (module TEXT PRIMARY KEY, rank INTEGER NOT NULL);
+"""
+
+
+IMPORT_ID_BYTES = 120
+
+
+def _item_of(path, start):
+    # The first-level entry of a folder that path is in, start being where path continues below the folder
+    return path[start:].split('/', 1)[0]
+
+
+def _below(column, folder):
+    if not folder:
+        return '1', ()
+    return f'{column} >= ? AND {column} < ?', (folder + '/', folder + '0')
+
+
+class DependencySpill:
+    """
+    The dependency model of analysis_dependency kept in a temporary SQLite file instead of in memory.
+
+    Files are spilled one at a time, and each folder's dependencies are then resolved in SQL like
+    generate_dep_node_edges does, so memory holds cache_bytes, shared by the SQLite page cache and the ids of
+    the import names met last, and one folder's graph whatever the size of the repository. Paths use / like
+    the store.
+    """
+
+    def __init__(self, cache_bytes):
+        handle, self.path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(handle)
+        self.connection = sqlite3.connect(self.path)
+        # A negative cache_size is in KiB, the file is thrown away afterwards so it needs no journal
+        self.connection.execute(f'PRAGMA cache_size = -{max(cache_bytes // 2048, 1024)}')
+        self.connection.execute('PRAGMA journal_mode = OFF')
+        self.connection.execute('PRAGMA synchronous = OFF')
+        self.connection.execute('PRAGMA temp_store = FILE')
+        self.connection.create_function('item_of', 2, _item_of, deterministic=True)
+        self.connection.executescript(SPILL_SCHEMA)
+        self.import_ids = BoundedCache(cache_bytes // 2)
+
+    def close(self):
+        self.connection.close()
+        os.remove(self.path)
+
+    def _add_entry(self, folder, position, name, child=None, module=None):
+        self.connection.execute('INSERT OR IGNORE INTO entries (folder, position, name, child, module) '
+                                'VALUES (?, ?, ?, ?, ?)', (folder, position, name, child, module))
+
+    def _import_id(self, name):
+        import_id = self.import_ids.get(name)
+        if import_id is not None:
+            return import_id
+        cursor = self.connection.execute('INSERT OR IGNORE INTO import_names (name) VALUES (?)', (name,))
+        if cursor.rowcount:
+            import_id = cursor.lastrowid
+            # The names resolve_dependency tries in turn: pkg.sub.mod.name, pkg.sub.mod, pkg.sub, pkg
+            prefixes = []
+            prefix = name
+            while prefix:
+                prefixes.append((import_id, len(prefixes), prefix))
+                prefix = prefix.rpartition(".")[0]
+            self.connection.executemany('INSERT INTO prefixes (import_id, level, prefix) VALUES (?, ?, ?)', prefixes)
+        else:
+            import_id = self.connection.execute('SELECT id FROM import_names WHERE name = ?', (name,)).fetchone()[0]
+        # About what a short str key and int take in the cache
+        return self.import_ids.put(name, import_id, len(name) + IMPORT_ID_BYTES)
+
+    def _add_file(self, path, file_info):
+        module = file_info.package_name + "." + file_info.file_name.replace(".py", "")
+        names = [(path, module)]
+        if module.endswith(".__init__"):
+            names.append((path, module[:-len(".__init__")]))
+        self.connection.executemany('INSERT INTO module_names (path, name) VALUES (?, ?)', names)
+        self.connection.executemany('INSERT INTO file_imports (path, import_id) VALUES (?, ?)',
+                                    [(path, self._import_id(name)) for name in file_imports(file_info)])
+        return module
+
+    def add_code_info_folder(self, root_folder):
+        """Spill the code_info JSON files below root_folder, entries in listdir order like build_dependency_model."""
+        folders = ['']
+        while folders:
+            folder = folders.pop()
+            self.connection.execute('INSERT INTO folders (folder) VALUES (?)', (folder,))
+            folder_path = os.path.join(str(root_folder), native_path(folder))
+            for position, item in enumerate(os.listdir(folder_path)):
+                item_path = os.path.join(folder_path, item)
+                relative_path = f"{folder}/{item}" if folder else item
+                if os.path.isdir(item_path):
+                    self._add_entry(folder, position, item, child=relative_path)
+                    folders.append(relative_path)
+                elif item_path.endswith('.json'):
+                    module = self._add_file(relative_path, load_file_info_from_json(item_path))
+                    self._add_entry(folder, position, item, module=module)
+                else:
+                    print(f"Found non-JSON file: {item_path}")
+
+    def add_store(self, store):
+        """Spill the code_info of an AnalysisStore, entries in name order like build_dependency_model_from_store."""
+        self.connection.execute('INSERT INTO folders (folder) VALUES (?)', ('',))
+        for path, code_info in store.code_infos():
+            *folder_names, name = path.split('/')
+            folder = ''
+            for folder_name in folder_names:
+                child = f"{folder}/{folder_name}" if folder else folder_name
+                self._add_entry(folder, 0, folder_name, child=child)
+                self.connection.execute('INSERT OR IGNORE INTO folders (folder) VALUES (?)', (child,))
+                folder = child
+            self._add_entry(folder, 0, name, module=self._add_file(path, FileInfo(**code_info)))
+
+    def drop_unknown_imports(self):
+        """Once every file is spilled: forget the import names that are no module of the analysed code, e.g.
+        os or typing, they can never be resolved and most imports of a repository are such."""
+        self.connection.execute('CREATE INDEX module_names_name ON module_names (name)')
+        self.connection.execute('DELETE FROM prefixes WHERE prefix NOT IN (SELECT name FROM module_names)')
+        self.connection.execute('DELETE FROM file_imports WHERE import_id NOT IN (SELECT import_id FROM prefixes)')
+
+    def folders(self):
+        return [native_path(folder) for folder, in self.connection.execute('SELECT folder FROM folders ORDER BY folder')]
+
+    def folder_dependencies(self, relative_folder='', package_root=""):
+        """generate_dep_node_edges of folder_dependencies(model, relative_folder, package_root), deps sorted."""
+        folder = store_key(relative_folder)
+        # Like the dicts of folder_dependencies, a key met twice keeps its first place and the last item's content
+        ranks = {}
+        items = {}
+        for name, child, module in self.connection.execute(
+                'SELECT name, child, module FROM entries WHERE folder = ? ORDER BY position, name', (folder,)):
+            key = package_root + "." + name if child is not None else module
+            ranks.setdefault(key, len(ranks))
+            items[key] = name
+        keys = list(ranks)
+        self.connection.execute('DELETE FROM current')
+        self.connection.executemany('INSERT INTO current (item, rank) VALUES (?, ?)',
+                                    [(name, ranks[key]) for key, name in items.items()])
+
+        start = len(folder) + 1 if folder else 0
+        # The module index of build_module_index: the first item owning a module wins
+        condition, parameters = _below('m.path', folder)
+        self.connection.execute('DELETE FROM owners')
+        self.connection.execute(f'INSERT INTO owners (module, rank) SELECT m.name, MIN(c.rank) FROM module_names m '
+                                f'JOIN current c ON c.item = item_of(m.path, ?) WHERE {condition} GROUP BY m.name',
+                                (start, *parameters))
+        # Every import of an item resolves to the owner of its longest known prefix, like resolve_dependency
+        condition, parameters = _below('f.path', folder)
+        # Filtered here rather than in SQL, which would run the owner lookup once more for every condition on it
+        edges = self.connection.execute(
+            'SELECT DISTINCT c.rank, (SELECT o.rank FROM prefixes p JOIN owners o ON o.module = p.prefix'
+            ' WHERE p.import_id = i.import_id ORDER BY p.level LIMIT 1)'
+            f' FROM (SELECT DISTINCT item_of(f.path, ?) AS item, f.import_id FROM file_imports f WHERE {condition}) i'
+            ' JOIN current c ON c.item = i.item', (start, *parameters))
+        filtered_dependencies = {key: set() for key in keys}
+        for source, target in edges:
+            if target is not None and target != source:
+                filtered_dependencies[keys[source]].add(keys[target])
+        return {key: sorted(deps) for key, deps in filtered_dependencies.items()}
+
+
+def analysis_dependency(root_folder, output_folder, format="png", incremental=None, renderer=None, store=None,
+                        memory_budget=None):
+    """
+    The dependency graph of every folder of the code_info in root_folder (or in store), into output_folder.
+
+    With memory_budget (bytes), the code_info is spilled to a temporary SQLite file and read back one folder at
+    a time instead of being aggregated in memory.
+    """
+    spill = None
+    if memory_budget is None:
+        # One pass over the code_info files (or the store's), every folder level below is served from the same model
+        model = build_dependency_model(root_folder) if store is None else build_dependency_model_from_store(store)
+        folders = sorted(model)
+
+        def dependencies(folder, sub_package):
+            import_dependencies, package_dict = folder_dependencies(model, folder, package_root=sub_package)
+            return generate_dep_node_edges(package_dict, import_dependencies)
+    else:
+        spill = DependencySpill(memory_budget)
+        if store is None:
+            spill.add_code_info_folder(root_folder)
+        else:
+            spill.add_store(store)
+        spill.drop_unknown_imports()
+        folders = spill.folders()
+        dependencies = spill.folder_dependencies
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
-    for folder in targetfolders:
-        print(folder)
-        input_folder = Path(root_folder) / folder
-        sub_package = '' if folder == '' else '.'+folder.replace("\\",".")
-        print(input_folder)
-        # import_dependencies, package_dict = process_folder(input_folder, package_root="promptflow"+sub_package)
-        import_dependencies, package_dict = process_folder(input_folder, package_root=sub_package)
-        
-        output_pattern = output_folder+sub_package.replace(".",os.path.sep)
-        # if output pattern does not exist, create it
-        if not os.path.exists(output_pattern):
-            os.makedirs(output_pattern)
-        
-        if format == "csv":
-            csv_data = generate_dependency_graph_csv(package_dict, import_dependencies)
-            write_csv_data(output_pattern+"\\graph.csv", csv_data)
-                     
-        else:
-            generate_dependency_graph_graphviz(package_dict, import_dependencies).render(output_pattern+"\\dependency_graph_", format=format, cleanup=True)
+    try:
+        for folder in folders:
+            print(folder)
+            input_folder = Path(root_folder) / folder
+            sub_package = '' if folder == '' else '.'+folder.replace(os.path.sep,".")
+            print(input_folder)
+            output_pattern = output_folder+sub_package.replace(".",os.path.sep)
+            graph_csv = os.path.join(output_pattern, "graph.csv")
+            if format == "csv" and incremental is not None:
+                # graph.csv only depends on the code_info files below this folder
+                digest = incremental.artifact_folder_digest(input_folder)
+                if incremental.reuse(graph_csv, digest):
+                    continue
+            filtered_dependencies = dependencies(folder, sub_package)
+
+            # if output pattern does not exist, create it
+            if not os.path.exists(output_pattern):
+                os.makedirs(output_pattern)
+
+            if format == "csv":
+                csv_data = dependency_csv_data(filtered_dependencies)
+                write_csv_data(graph_csv, csv_data)
+                if store is not None:
+                    store.put_graph('dependency', store_key(folder), csv_data)
+                if incremental is not None:
+                    incremental.record(graph_csv, digest)
+
+            else:
+                source_path = dependency_graphviz(filtered_dependencies).save(os.path.join(output_pattern, "dependency_graph_"))
+                count_written(source_path)
+                render_dot(source_path, source_path + "." + format, format, renderer, cleanup=True)
+    finally:
+        if spill is not None:
+            spill.close()
 
 
 
-def generate_gv_result(input_folder, output_folder, create_png=True):
+def analysis_package_dependency(package_models, output_folder):
+    """
+    graph.csv in output_folder of the dependencies between the packages of a multi-package folder.
+
+    package_models maps a package name to the build_dependency_model of its code_info, a package depends on
+    another when it imports one of its modules.
+    """
+    import_dependencies = {package: model[''].imports for package, model in package_models.items()}
+    package_dict = {package: model[''].modules for package, model in package_models.items()}
+    os.makedirs(output_folder, exist_ok=True)
+    csv_data = generate_dependency_graph_csv(package_dict, import_dependencies)
+    write_csv_data(os.path.join(output_folder, "graph.csv"), csv_data)
+    return csv_data
+
+
+def generate_gv_result(input_folder, output_folder, create_png=True, renderer=None):
     # temporarily only read 1 graph.csv. Add generate graph.dot in the same folder
-    recursively_traverse_and_create_graphs(input_folder, output_folder, create_png=create_png,output_file_name=None)
+    recursively_traverse_and_create_graphs(input_folder, output_folder, create_png=create_png,output_file_name=None, renderer=renderer)
 
 if __name__ == "__main__":
     project_name = "promptflow"
@@ -1,5 +1,7 @@
 import os
 import json
+from source_walker import walk_source
+from stage_metrics import count_written
 
 def is_source_code_file(filename):
     source_code_extensions = {'.py', '.js', '.java', '.cpp', '.c', '.cs', '.rb', '.html', '.css', '.php'}
@@ -10,10 +12,17 @@ def count_lines_in_file(filepath):
     with open(filepath, 'r', errors='ignore') as file:
         return sum(1 for _ in file)
     
+def read_metadata_file(metadata_file):
+    if not os.path.exists(metadata_file):
+        return None
+    with open(metadata_file, 'r') as file:
+        return json.load(file)
+
 def parse_metadata_file(metadata_file):
     with open(metadata_file, 'r') as file:
-        metadata = json.load(file)
+        return count_metadata(json.load(file))
 
+def count_metadata(metadata):
     class_count = len(metadata.get('classes', []))
     function_count = len(metadata.get('functions', []))
     public_function_count = sum(1 for func in metadata.get('functions', []) if func['access'] =='public')
@@ -21,7 +30,14 @@ def parse_metadata_file(metadata_file):
 
     return class_count, function_count, public_function_count, private_function_count
 
-def gather_folder_info(folder_path,metadata_path):
+def gather_folder_info(folder_path,metadata_path, cached_info=None, source_tree=None, read_metadata=read_metadata_file,
+                       count_lines=count_lines_in_file):
+    # cached_info(folder_path) may return the totals of an unchanged folder from a previous run,
+    # read_metadata(path) returns the code_info of a path of the code_info layout or None
+    if cached_info is not None:
+        folder_info = cached_info(folder_path)
+        if folder_info is not None:
+            return folder_info
     total_files = 0
     total_folders = 0
     total_source_files = 0
@@ -32,12 +48,13 @@ def gather_folder_info(folder_path,metadata_path):
     total_private_function_count = 0
     first_level_subfolders = {}
     
-    for root, dirs, files in os.walk(folder_path):
+    for root, dirs, files in walk_source(folder_path, source_tree):
         if root == folder_path:  # Only first level subfolders
             for dir_name in dirs:
                 subfolder_path = os.path.join(root, dir_name)
                 subfolder_metadata_path = os.path.join(metadata_path, os.path.relpath(subfolder_path, folder_path))
-                subfolder_info = gather_folder_info(subfolder_path,subfolder_metadata_path)
+                subfolder_info = gather_folder_info(subfolder_path,subfolder_metadata_path, cached_info, source_tree,
+                                                     read_metadata, count_lines)
                 first_level_subfolders[dir_name] = subfolder_info
         
         # Handle the files in the current folder
@@ -47,10 +64,11 @@ def gather_folder_info(folder_path,metadata_path):
             file_path = os.path.join(root, file_name)
             if is_source_code_file(file_name):
                 total_source_files += 1
-                total_source_lines += count_lines_in_file(file_path)
+                total_source_lines += count_lines(file_path)
                 metadata_file = os.path.join(metadata_path, os.path.relpath(file_path, folder_path).removesuffix('.py') + '.json')
-                if os.path.exists(metadata_file):
-                    class_count, function_count, public_function_count, private_function_count = parse_metadata_file(metadata_file)
+                metadata = read_metadata(metadata_file)
+                if metadata is not None:
+                    class_count, function_count, public_function_count, private_function_count = count_metadata(metadata)
                     total_class_count += class_count
                     total_function_count += function_count
                     total_public_function_count += public_function_count
@@ -81,8 +99,13 @@ def gather_folder_info(folder_path,metadata_path):
         'first_level_subfolders': first_level_subfolders
     }
 
-def convert_to_d3_tree(data, root_name="root"):
-    def create_node(name, data):
+def convert_to_d3_tree(data, root_name="root", max_depth=None):
+    """d3 tree of a gather_folder_info result.
+
+    With max_depth, only that many levels of children are embedded. A deeper folder is a stub with
+    empty children and a "shard" path to its own info.json, relative to this one.
+    """
+    def create_node(name, data, depth=0, shard=""):
         node = {
             "name": name,
             "total_files": data["total_files"],
@@ -95,30 +118,72 @@ def convert_to_d3_tree(data, root_name="root"):
             "total_private_function_count": data["total_private_function_count"],
             "children": []
         }
+        if max_depth is not None and depth >= max_depth:
+            if data["first_level_subfolders"]:
+                node["shard"] = shard + "info.json"
+            return node
         for subfolder_name, subfolder_data in data["first_level_subfolders"].items():
-            child_node = create_node(subfolder_name, subfolder_data)
+            child_node = create_node(subfolder_name, subfolder_data, depth + 1, shard + subfolder_name + "/")
             node["children"].append(child_node)
         return node
 
     root_node = create_node(root_name, data)
     return root_node
 
-def save_folder_info_to_json(folder_path, output_path, root_folder_path,metadata_path):
-    folder_info = gather_folder_info(folder_path,metadata_path)
+def convert_from_d3_tree(node, info_dir=None):
+    # A stub is replaced by its shard, read from info_dir (the folder of the info.json holding the stub)
+    if node.get('shard') and info_dir is not None:
+        return read_folder_info(os.path.join(info_dir, node['shard']))
+    folder_info = {key: value for key, value in node.items() if key not in ('name', 'children', 'shard')}
+    folder_info['first_level_subfolders'] = {child['name']: convert_from_d3_tree(child, info_dir) for child in node['children']}
+    return folder_info
+
+def read_folder_info(info_path):
+    with open(info_path, 'r') as json_file:
+        return convert_from_d3_tree(json.load(json_file), os.path.dirname(info_path))
+
+def _info_digest(incremental, folder_path, max_depth):
+    # The same folder gives a different info.json for every depth limit
+    return incremental.folder_digest(folder_path, tag=None if max_depth is None else f"depth{max_depth}")
+
+def _previous_folder_info(incremental, output_path, root_folder_path, max_depth=None):
+    def cached_info(folder_path):
+        json_output_path = os.path.join(output_path, os.path.relpath(folder_path, root_folder_path), 'info.json')
+        previous_path = incremental.previous_artifact(json_output_path, _info_digest(incremental, folder_path, max_depth))
+        if previous_path is None:
+            return None
+        return read_folder_info(previous_path)
+    return cached_info
+
+def save_folder_info_to_json(folder_path, output_path, root_folder_path,metadata_path, incremental=None, folder_info=None,
+                             max_depth=None, source_tree=None, read_metadata=read_metadata_file,
+                             count_lines=count_lines_in_file):
+    # One gather_folder_info walk covers the whole tree, every sub folder's info.json is written from
+    # its part of the result instead of walking the sub folder again. Returns the result.
+    if folder_info is None:
+        cached_info = _previous_folder_info(incremental, output_path, root_folder_path, max_depth) if incremental is not None else None
+        folder_info = gather_folder_info(folder_path,metadata_path, cached_info, source_tree, read_metadata, count_lines)
+
     relative_path = os.path.relpath(folder_path, root_folder_path)
     json_output_path = os.path.join(output_path, relative_path, 'info.json')
-    d3_format = convert_to_d3_tree(folder_info, relative_path)
-
-    os.makedirs(os.path.dirname(json_output_path), exist_ok=True)
-    with open(json_output_path, 'w') as json_file:
-        json.dump(d3_format, json_file, indent=4)
+    digest = _info_digest(incremental, folder_path, max_depth) if incremental is not None else None
+    if incremental is None or not incremental.reuse(json_output_path, digest):
+        d3_format = convert_to_d3_tree(folder_info, relative_path, max_depth)
+        os.makedirs(os.path.dirname(json_output_path), exist_ok=True)
+        with open(json_output_path, 'w') as json_file:
+            json.dump(d3_format, json_file, indent=4)
+        count_written(json_output_path)
+        if incremental is not None:
+            incremental.record(json_output_path, digest)
 
-    for subfolder in folder_info['first_level_subfolders']:
-        save_folder_info_to_json(os.path.join(folder_path, subfolder), output_path, root_folder_path,metadata_path)
+    for subfolder, subfolder_info in folder_info['first_level_subfolders'].items():
+        save_folder_info_to_json(os.path.join(folder_path, subfolder), output_path, root_folder_path,metadata_path, incremental,
+                                 subfolder_info, max_depth)
+    return folder_info
 
 
-def main(root_folder_path, output_folder_path, metadata_folder_path):
-    save_folder_info_to_json(root_folder_path, output_folder_path, root_folder_path, metadata_folder_path)
+def main(root_folder_path, output_folder_path, metadata_folder_path, max_depth=None):
+    save_folder_info_to_json(root_folder_path, output_folder_path, root_folder_path, metadata_folder_path, max_depth=max_depth)
 
 if __name__ == '__main__':
     root_folder_path = r'C:\Users\anthu\projects\code2flow\target_repo\promptflow\src\promptflow-core\promptflow\core'  # Change this to your root folder path
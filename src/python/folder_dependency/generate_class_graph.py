@@ -1,23 +1,48 @@
 import os
 import csv
 from graphviz import Digraph
+from render_pool import render_dot
+from stage_metrics import count_written
+
+def add_csv_row(graph, row):
+    if len(row) != 6:
+        return
+    type_, identifier, source, target, label, typekind= row
+    if type_.lower() == 'node':
+        if typekind == "Class":
+            graph.node(identifier, label, shape='rect', style='rounded,filled', fillcolor="#6db33f")
+        elif typekind == "Interface":
+            graph.node(identifier, label, shape='rect', style='rounded,filled', fillcolor="#966F33")
+    elif type_.lower() == 'edge':
+        graph.edge(source, target, label)
 
 def create_graph_from_csv(graph, csv_file_path):
     with open(csv_file_path, mode='r') as file:
-        reader = csv.reader(file)
-        for row in reader:
-            if len(row) != 6:
-                continue
-            type_, identifier, source, target, label, typekind= row
-            if type_.lower() == 'node':
-                if typekind == "Class":
-                    graph.node(identifier, label, shape='rect', style='rounded,filled', fillcolor="#6db33f")
-                elif typekind == "Interface":
-                    graph.node(identifier, label, shape='rect', style='rounded,filled', fillcolor="#966F33")
-            elif type_.lower() == 'edge':
-                graph.edge(source, target, label)
+        for row in csv.reader(file):
+            add_csv_row(graph, row)
+
+def save_graph_from_csv(graph, csv_file_path, directory):
+    """graph.save(directory=directory) with the rows of csv_file_path added, written out row by row.
+
+    Only the lines of one row are in memory at a time, however large the graph.csv.
+    """
+    os.makedirs(directory, exist_ok=True)
+    source_path = os.path.join(directory, graph.filename)
+    *head, tail = list(graph)
+    graph.body.clear()
+    with open(source_path, 'w', encoding=graph.encoding) as f:
+        f.writelines(head)
+        if csv_file_path is not None:
+            with open(csv_file_path, mode='r') as file:
+                for row in csv.reader(file):
+                    add_csv_row(graph, row)
+                    f.writelines(graph.body)
+                    graph.body.clear()
+        f.write(tail)
+    count_written(source_path)
+    return source_path
 
-def recursively_traverse_and_create_graphs(base_folder, output_folder, output_file_name, create_png=True, parent_graph=None):
+def recursively_traverse_and_create_graphs(base_folder, output_folder, output_file_name, create_png=True, parent_graph=None, renderer=None):
     folder_name = os.path.basename(base_folder)
     graph = Digraph(name='graph')
     is_subgraph = bool(parent_graph)
@@ -34,25 +59,30 @@ def recursively_traverse_and_create_graphs(base_folder, output_folder, output_fi
                 item_path = os.path.join(base_folder, item)
                 if os.path.isdir(item_path):
                     is_leaf = False
-                    recursively_traverse_and_create_graphs(item_path, output_folder, output_file_name, subgraph)
+                    recursively_traverse_and_create_graphs(item_path, output_folder, output_file_name, create_png, renderer=renderer)
         parent_graph.subgraph(graph)
     else:
         is_leaf = False
         graph.attr(label=folder_name)
-        if os.path.isfile(os.path.join(base_folder, 'graph.csv')):
-            path = os.path.join(base_folder, 'graph.csv')
+        path = os.path.join(base_folder, 'graph.csv')
+        if os.path.isfile(path):
             print(path)
-            create_graph_from_csv(graph, os.path.join(base_folder, 'graph.csv'))
-        for item in os.listdir(base_folder):
-            item_path = os.path.join(base_folder, item)
-            if os.path.isdir(item_path):
-                recursively_traverse_and_create_graphs(item_path, output_folder, output_file_name, graph)
+        else:
+            path = None
+        # Listed before output_folder, which can be below base_folder, is written
+        sub_folders = [os.path.join(base_folder, item) for item in os.listdir(base_folder)
+                       if os.path.isdir(os.path.join(base_folder, item))]
+        # Written before the sub folders are drawn, so no graph of a parent folder stays in memory meanwhile
+        source_path = save_graph_from_csv(graph, path, output_folder)
+        for item_path in sub_folders:
+            recursively_traverse_and_create_graphs(item_path, output_folder, output_file_name, create_png, renderer=renderer)
     output_file_path = os.path.join(output_folder, f'{output_file_name}.dot')
     if not is_leaf:
-        graph.save(directory=output_folder)
+        if is_subgraph:
+            source_path = graph.save(directory=output_folder)
         if create_png:
             # ignore c# scenario create png as the picture is too large.
-            graph.render(filename='graph', directory=output_folder, format='png')
+            render_dot(source_path, os.path.join(output_folder, 'graph.png'), 'png', renderer)
 
 def main(input_folder, output_folder):
     if not os.path.exists(output_folder):
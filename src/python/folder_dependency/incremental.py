@@ -0,0 +1,234 @@
+import os
+import json
+import shutil
+import hashlib
+from collections import namedtuple
+from source_walker import walk_source
+from stage_metrics import count_written
+
+MANIFEST_FILE = 'manifest.json'
+MANIFEST_VERSION = 2
+
+# Digest of a source file or folder whose files are not hashed yet, resolved when the manifest is saved
+PendingDigest = namedtuple('PendingDigest', ['relative_path', 'suffix', 'tag', 'folder'])
+
+
+def hash_file(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(output_dir):
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def hash_source_tree(source_root, previous_sources=None, source_tree=None, lazy=False):
+    """Content hash of every file under source_root as {relative path: [sha1, size, mtime_ns]}.
+
+    A file whose size and mtime match previous_sources keeps its previous hash without being read. With lazy
+    the other files are not read either, their sha1 is None until IncrementalAnalysis needs it.
+    """
+    previous_sources = previous_sources or {}
+    sources = {}
+    for root, dirs, files in walk_source(source_root, source_tree):
+        # Folders are listed too (with a trailing separator), an empty one still changes the folder counts
+        for dir_name in dirs:
+            sources[os.path.relpath(os.path.join(root, dir_name), source_root) + os.path.sep] = ['folder', 0, 0]
+        for file in files:
+            path = os.path.join(root, file)
+            relative_path = os.path.relpath(path, source_root)
+            try:
+                stat = os.stat(path)
+                previous = previous_sources.get(relative_path)
+                if previous and previous[1] == stat.st_size and previous[2] == stat.st_mtime_ns:
+                    sources[relative_path] = previous
+                elif lazy:
+                    sources[relative_path] = [None, stat.st_size, stat.st_mtime_ns]
+                else:
+                    sources[relative_path] = [hash_file(path), stat.st_size, stat.st_mtime_ns]
+            except OSError as e:
+                print(f"Error hashing {path}: {e}")
+    return sources
+
+
+def folder_digests(entries):
+    """Merkle-style digest of every folder from {relative path: digest}, '' being the root."""
+    members = {}
+    for relative_path, digest in entries.items():
+        folder = os.path.dirname(relative_path)
+        while True:
+            members.setdefault(folder, []).append((relative_path, digest))
+            if folder == '':
+                break
+            folder = os.path.dirname(folder)
+    digests = {}
+    for folder, items in members.items():
+        digest = hashlib.sha1()
+        for relative_path, item_digest in sorted(items):
+            digest.update(f"{relative_path}\0{item_digest}\n".encode('utf-8'))
+        digests[folder] = digest.hexdigest()
+    return digests
+
+
+class IncrementalAnalysis:
+    """Content-hash manifest of one analysis run, able to reuse unchanged artifacts of a previous run.
+
+    Every artifact is recorded with the digest of its inputs (a source file hash or a folder digest).
+    reuse() copies the artifact from the previous output folder when it was produced from the same
+    digest, so a stage only has to regenerate what actually changed. known_sources are hashes of this
+    run already taken, e.g. by the analysis of an enclosing folder, relative to source_root.
+
+    Without a previous run nothing can be reused, so the sources are not hashed by the scan: the digests
+    recorded are PendingDigest until the manifest is saved for the next run.
+    """
+
+    def __init__(self, source_root, output_dir, previous_dir=None, source_tree=None, known_sources=None):
+        self.source_root = os.path.abspath(source_root)
+        self.output_dir = output_dir
+        self.previous_dir = None
+        self.previous_artifacts = {}
+        previous_sources = {}
+        previous = load_manifest(previous_dir) if previous_dir and os.path.abspath(previous_dir) != os.path.abspath(output_dir) else None
+        if previous is not None and previous.get('source_root') == self.source_root:
+            self.previous_dir = previous_dir
+            self.previous_artifacts = previous.get('artifacts', {})
+            previous_sources = previous.get('sources', {})
+        self.sources = hash_source_tree(self.source_root, dict(previous_sources, **(known_sources or {})), source_tree,
+                                        lazy=self.previous_dir is None)
+        # Hashes taken after the scan, handed to the parent by a stage process
+        self.hashed = {}
+        self.artifacts = {}
+        self._digest_cache = {}
+        self.reused = 0
+
+    def _hash(self, relative_path):
+        entry = self.sources[relative_path]
+        if entry[0] is None:
+            try:
+                entry[0] = hash_file(os.path.join(self.source_root, relative_path))
+            except OSError as e:
+                print(f"Error hashing {relative_path}: {e}")
+                return None
+            self.hashed[relative_path] = entry
+        return entry[0]
+
+    def take_hashes(self, sources, prefix=''):
+        """Take the hashes of sources ({relative path: entry}, relative to the folder prefix) that were not
+        taken yet, e.g. by a stage process or the analysis of a package inside source_root."""
+        for relative_path, entry in sources.items():
+            current = self.sources.get(prefix + relative_path)
+            if current is not None and current[0] is None and entry[0] is not None and current[1:] == entry[1:]:
+                current[0] = entry[0]
+                self.hashed[prefix + relative_path] = current
+
+    def source_digest(self, path):
+        relative_path = os.path.relpath(os.path.abspath(path), self.source_root)
+        if relative_path not in self.sources:
+            return None
+        if self.previous_dir is None:
+            return PendingDigest(relative_path, None, None, False)
+        return self._hash(relative_path)
+
+    def folder_digest(self, folder, suffix=None, tag=None):
+        """Digest of every source file below folder, optionally only the files ending with suffix.
+
+        tag tells apart artifacts built differently from the same files.
+        """
+        relative_folder = os.path.relpath(os.path.abspath(folder), self.source_root)
+        relative_folder = '' if relative_folder == '.' else relative_folder
+        if self.previous_dir is None:
+            return PendingDigest(relative_folder, suffix, tag, True)
+        return self._folder_digest(relative_folder, suffix, tag)
+
+    def _folder_digest(self, relative_folder, suffix, tag):
+        if suffix not in self._digest_cache:
+            self._digest_cache[suffix] = folder_digests({relative_path: self._hash(relative_path)
+                                                         for relative_path in self.sources
+                                                         if suffix is None or relative_path.endswith(suffix)})
+        digest = self._digest_cache[suffix].get(relative_folder, hashlib.sha1(b'').hexdigest())
+        return digest if tag is None else f"{digest}:{tag}"
+
+    def _resolve(self, digest):
+        if not isinstance(digest, PendingDigest):
+            return digest
+        if digest.folder:
+            return self._folder_digest(digest.relative_path, digest.suffix, digest.tag)
+        return self._hash(digest.relative_path)
+
+    def artifact_folder_digest(self, folder):
+        """Digest of the artifacts already recorded below folder, e.g. a sub folder of code_info.
+
+        The digests of one artifact folder are computed on first use, so that folder has to be
+        complete by then.
+        """
+        top = self._artifact_key(folder).split(os.path.sep)[0]
+        cache_key = ('artifacts', top)
+        if cache_key not in self._digest_cache:
+            self._digest_cache[cache_key] = folder_digests({key: self._resolve(digest) for key, digest in self.artifacts.items()
+                                                            if key.split(os.path.sep)[0] == top})
+        return self._digest_cache[cache_key].get(self._artifact_key(folder), hashlib.sha1(b'').hexdigest())
+
+    def _artifact_key(self, artifact_path):
+        return os.path.relpath(os.path.abspath(artifact_path), os.path.abspath(self.output_dir))
+
+    def record(self, artifact_path, digest):
+        if digest is not None:
+            self.artifacts[self._artifact_key(artifact_path)] = digest
+
+    def previous_artifact(self, artifact_path, digest):
+        """Path of artifact_path in the previous run if it was built from the same digest, else None."""
+        key = self._artifact_key(artifact_path)
+        if digest is None or self.previous_dir is None or self.previous_artifacts.get(key) != digest:
+            return None
+        previous_path = os.path.join(self.previous_dir, key)
+        return previous_path if os.path.exists(previous_path) else None
+
+    def reuse(self, artifact_path, digest):
+        """Copy artifact_path from the previous run if it was built from the same digest."""
+        previous_path = self.previous_artifact(artifact_path, digest)
+        if previous_path is None:
+            return False
+        os.makedirs(os.path.dirname(artifact_path), exist_ok=True)
+        shutil.copy2(previous_path, artifact_path)
+        count_written(artifact_path)
+        self.artifacts[self._artifact_key(artifact_path)] = digest
+        self.reused += 1
+        return True
+
+    def merge(self, artifacts, reused, hashed=None):
+        """Take the artifacts recorded, the count of those reused and the sources hashed by a copy of this
+        analysis in a stage process."""
+        self.artifacts.update(artifacts)
+        self.reused += reused
+        self.take_hashes(hashed or {})
+        # Artifact folder digests have to be computed again with the new artifacts
+        self._digest_cache = {key: value for key, value in self._digest_cache.items() if not isinstance(key, tuple)}
+
+    def previous_path(self, artifact_path):
+        if self.previous_dir is None:
+            return None
+        return os.path.join(self.previous_dir, self._artifact_key(artifact_path))
+
+    def save(self):
+        self.artifacts = {key: self._resolve(digest) for key, digest in self.artifacts.items()}
+        for relative_path in self.sources:
+            self._hash(relative_path)
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(os.path.join(self.output_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': MANIFEST_VERSION,
+                'source_root': self.source_root,
+                'sources': self.sources,
+                'artifacts': self.artifacts,
+            }, f)
+        print(f"Reused {self.reused} artifacts from {self.previous_dir}" if self.previous_dir else "No previous analysis to reuse")
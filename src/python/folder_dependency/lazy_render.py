@@ -0,0 +1,66 @@
+import os
+import json
+import argparse
+from call_graph_analyzer import render_folder_call_graph
+from render_pool import render_dot, RenderPool, RENDER_MANIFEST_FILE
+
+
+def render_limits(analysis_info_folder):
+    """(timeout, max_bytes) of the Graphviz jobs, those main_invoker ran with, see its render_manifest.json."""
+    try:
+        with open(os.path.join(analysis_info_folder, RENDER_MANIFEST_FILE), 'r') as f:
+            manifest = json.load(f)
+        return manifest.get('timeout'), manifest.get('max_bytes')
+    except (OSError, ValueError):
+        return 120, 2 * 1024 * 1024
+
+
+def folder_render_manifest(analysis_info_folder, relative_folder):
+    # Written on every lazy render of the folder, drawn or not, so a viewer does not ask again for a folder
+    # without python files or whose graphs failed
+    return os.path.join(analysis_info_folder, 'folder_call_graph_info', relative_folder, RENDER_MANIFEST_FILE)
+
+
+def render_folder_graphs(analysis_info_folder, relative_folder, timeout=None, max_bytes=None):
+    """Draw the images of one folder of a main_invoker --lazy-render run, skipping the ones already drawn.
+
+    They are rendered with the timeout and max_bytes of the analysis unless given, every job is listed in
+    the render_manifest.json of the folder.
+    """
+    relative_folder = '' if relative_folder in ('', '.') else os.path.normpath(relative_folder)
+    analysis_timeout, analysis_max_bytes = render_limits(analysis_info_folder)
+    renderer = RenderPool(folder_render_manifest(analysis_info_folder, relative_folder), 1,
+                          timeout if timeout is not None else analysis_timeout,
+                          max_bytes if max_bytes is not None else analysis_max_bytes)
+    result = {}
+    try:
+        result['call_graph'] = render_folder_call_graph(os.path.join(analysis_info_folder, 'folder_call_graph_info'),
+                                                        relative_folder, renderer=renderer)
+    except FileNotFoundError as e:
+        result['call_graph_error'] = str(e)
+
+    # generate_gv_result nests its output in a folder named like its input
+    dependency_folder = os.path.join(analysis_info_folder, 'folder_package_dep_info', 'folder_package_dep_info',
+                                     relative_folder)
+    source_path = os.path.join(dependency_folder, 'graph.gv')
+    output_path = os.path.join(dependency_folder, 'graph.png')
+    if os.path.exists(source_path):
+        if not os.path.exists(output_path):
+            render_dot(source_path, output_path, 'png', renderer)
+        result['dependency_graph'] = output_path
+    result['jobs'] = renderer.close()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Draw the graphs of one folder of a lazily rendered analysis.')
+    parser.add_argument('-o', '--output', type=str, required=True, help='The output folder of main_invoker.')
+    parser.add_argument('-r', '--relative_folder', type=str, default='', help='The folder to draw, relative to '
+                                                                               'the analyzed source folder.')
+    parser.add_argument('--render-timeout', type=float, help='Seconds after which a Graphviz job is killed, '
+                                                             'the analysis\' by default.')
+    parser.add_argument('--render-max-bytes', type=int, help='Graphs whose dot source is larger are not rendered, '
+                                                             'the analysis\' limit by default.')
+    args = parser.parse_args()
+    print(json.dumps(render_folder_graphs(args.output, args.relative_folder, args.render_timeout,
+                                          args.render_max_bytes), indent=4))
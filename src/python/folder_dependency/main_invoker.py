@@ -1,19 +1,31 @@
 from utils import find_folders_with_file
-from python_file_analyzer import analyze_folder_dependency
-from dependency_analyzer import analysis_dependency, generate_gv_result
-from folder_analyzer import save_folder_info_to_json
+from python_file_analyzer import analyze_folder_dependency, process_python_files, resolve_source_folder, CodeInfoWriter
+from dependency_analyzer import analysis_dependency, generate_gv_result, analysis_package_dependency, \
+    build_dependency_model, build_dependency_model_from_store
+from folder_analyzer import save_folder_info_to_json, read_metadata_file, count_lines_in_file
 from call_graph_analyzer import generate_call_graphs_for_folders, generate_call_graphs_for_function
-from python_call_stack_generator import build_ast_data
+from python_call_stack_generator import AstInfoWriter, symbol_index_path
+from source_ingest import ingest_source_tree, is_path_under
+from incremental import IncrementalAnalysis, load_manifest
+from render_pool import RenderPool, RenderQueue, RENDER_MANIFEST_FILE
+from stage_metrics import StageMetrics
+from stage_scheduler import Stage, StageScheduler
+from source_walker import SourceTree, DEFAULT_EXCLUDES
+from analysis_store import AnalysisStore, STORE_FILE
+from progress_events import ProgressEvents
+from memory_budget import budget_bytes
+from pathlib import Path
 from datetime import datetime
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 import os
+import json
 import argparse
 
-def folder_dependency_analysis(target_folder, output_folder="output"):
+def find_analysis_folders(target_folder, source_tree=None):
     # Find all folders containing the target file
-    found_folders = find_folders_with_file(target_folder, 'pyproject.toml')
+    found_folders = find_folders_with_file(target_folder, 'pyproject.toml', source_tree)
 
-    output_list = []
-    
     to_be_analyzed = []
     # If no folders contain the target file, print a message and return
     if found_folders:
@@ -25,39 +37,490 @@ def folder_dependency_analysis(target_folder, output_folder="output"):
     
     if to_be_analyzed == []:
         to_be_analyzed.append(target_folder)
-    
-    for analysis_folder in to_be_analyzed:
-        code_analysis_output = output_folder 
-        # code_analysis_output = output_folder + os.path.sep + analysis_folder.split(os.path.sep)[-1] 
-
-        if not os.path.exists(code_analysis_output):
-            os.makedirs(code_analysis_output)
-        analyze_folder_dependency(analysis_folder, code_analysis_output)
-        output_list.append(code_analysis_output)
+    return to_be_analyzed
+
+
+# A folder holding several pyproject.toml packages gets a full analysis of every package in its own namespace,
+# packages/<package folder> below the output folder, all of them listed in packages.json
+PACKAGES_FOLDER = 'packages'
+PACKAGES_FILE = 'packages.json'
+
+
+def package_name(target_folder, package_folder):
+    return os.path.relpath(package_folder, target_folder).replace(os.path.sep, '/')
+
+
+def package_output(output_folder, target_folder, package_folder):
+    if os.path.abspath(package_folder) == os.path.abspath(target_folder):
+        return output_folder
+    return os.path.join(output_folder, PACKAGES_FOLDER, os.path.relpath(package_folder, target_folder))
+
+
+def folder_dependency_analysis(target_folder, output_folder="output", workers=1):
+    analysis_folders = find_analysis_folders(target_folder)
+    output_list = [package_output(output_folder, target_folder, analysis_folder) for analysis_folder in analysis_folders]
+    for code_analysis_output in output_list:
+        os.makedirs(code_analysis_output, exist_ok=True)
+    # The packages are independent, each one is analyzed in its own process
+    with ProcessPoolExecutor(max_workers=min(len(analysis_folders), os.cpu_count() or 1)) as executor:
+        list(executor.map(partial(analyze_folder_dependency, workers=workers), analysis_folders, output_list))
     return output_list
 
 
-def project_analysis(target_folder, analysis_info_folder, only_get_info=False):
+def ingest_project_sources(target_folder, code_analysis_output_folder, ast_output=None, workers=1, ast_format='json',
+                           incremental=None, source_tree=None, store=None, keep_trees=True, progress=None,
+                           packages=None):
+    """Parse every source file once, writing code_info (and ast_info when ast_output is set) from the same tree.
+
+    With incremental, files whose artifacts are unchanged since the previous run are copied, not parsed.
+    With an AnalysisStore both go to the store instead of their folders. progress(done, total) follows the files.
+    With packages, the folders analyzed in their own namespace, code_info is only written for the files outside
+    their source folders.
+    """
+    if store is None:
+        os.makedirs(code_analysis_output_folder, exist_ok=True)
+    consumers = []
+    if packages:
+        consumers.append(CodeInfoWriter(target_folder, code_analysis_output_folder, store,
+                                        [resolve_source_folder(package_folder) for package_folder in packages]))
+    for analysis_folder in [] if packages else find_analysis_folders(target_folder, source_tree):
+        src_folder = resolve_source_folder(analysis_folder)
+        if is_path_under(src_folder, target_folder):
+            consumers.append(CodeInfoWriter(src_folder, code_analysis_output_folder, store))
+        else:
+            process_python_files(src_folder, Path(code_analysis_output_folder), workers=workers,
+                                 source_tree=source_tree.covering(src_folder) if source_tree is not None else None,
+                                 store=store, progress=progress)
+    if ast_output is not None:
+        if store is None:
+            os.makedirs(ast_output, exist_ok=True)
+        consumers.append(AstInfoWriter(target_folder, ast_output, ast_format, store))
+    def reuse_artifacts(path):
+        digest = incremental.source_digest(path)
+        return all(incremental.reuse(consumer.artifact_path(path), digest) for consumer in consumers if consumer.accepts(path))
+
+    # The trees are only kept when a later stage (code2flow) can reuse them
+    parsed_sources = ingest_source_tree(target_folder, consumers, workers=workers,
+                                        keep_trees=keep_trees and ast_output is not None,
+                                        skip=reuse_artifacts if incremental is not None else None, source_tree=source_tree,
+                                        progress=progress)
+    if incremental is not None:
+        for path in parsed_sources.processed:
+            for consumer in consumers:
+                if consumer.accepts(path):
+                    incremental.record(consumer.artifact_path(path), incremental.source_digest(path))
+    if ast_output is not None:
+        if parsed_sources.skipped:
+            consumers[-1].collect_previous(incremental.previous_path(ast_output), parsed_sources.skipped)
+        consumers[-1].save_symbol_index()
+    return parsed_sources
+
+
+# The stages timed in metrics.json, ingest_project_sources does the work of folder_dependency_analysis and build_ast_data.
+# analyze_package stands for the analyze_package:<package> stage of every package.
+ANALYSIS_STAGES = ['scan_source_tree', 'preview_folder_info', 'ingest_project_sources', 'save_folder_info_to_json', 'analysis_dependency', 'generate_gv_result',
+                   'generate_call_graphs_for_folders', 'render_graphs', 'analyze_package', 'merge_package_dependencies']
+
+
+class AnalysisContext:
+    """What the stages of project_analysis share. Stage processes get a copy of it, without the parsed trees."""
+
+    def __init__(self, target_folder, analysis_info_folder, only_get_info=False, workers=1, ast_format='json',
+                 previous_output=None, info_depth=None, lazy_render=False, excludes=None, use_gitignore=True,
+                 use_store=False, keep_trees=False, progress=None, memory_budget=None, call_graphs=True):
+        self.target_folder = target_folder
+        self.analysis_info_folder = analysis_info_folder
+        self.only_get_info = only_get_info
+        self.workers = workers
+        self.ast_format = ast_format
+        self.previous_output = previous_output
+        self.info_depth = info_depth
+        self.lazy_render = lazy_render
+        self.excludes = excludes
+        self.use_gitignore = use_gitignore
+        self.keep_trees = keep_trees
+        # False leaves out ast_info and the call graphs, which packages_analysis makes for the whole folder
+        self.call_graphs = call_graphs
+        # Bytes the stages that would hold the whole repository in memory stay within, unbounded when None
+        self.memory_budget = memory_budget
+        self.progress = progress or ProgressEvents()
+        self.code_info = analysis_info_folder + os.path.sep + 'code_info'
+        self.folder_info = analysis_info_folder + os.path.sep + 'folder_info'
+        self.folder_package_dep_info = analysis_info_folder + os.path.sep + 'folder_package_dep_info'
+        self.folder_call_graph_info = analysis_info_folder + os.path.sep + 'folder_call_graph_info'
+        self.ast_info = analysis_info_folder + os.path.sep + 'ast_info'
+        self.store_path = os.path.join(analysis_info_folder, STORE_FILE) if use_store else None
+        # Set by the scan_source_tree stage
+        self.source_tree = None
+        self.incremental = None
+        self.parsed_sources = None
+        self.known_sources = None
+        # Set for a folder holding several packages, with the project_analysis arguments of every package
+        self.packages = []
+        self.package_options = {}
+
+    def __getstate__(self):
+        return dict(self.__dict__, parsed_sources=None)
+
+    def open_store(self):
+        return AnalysisStore(self.store_path) if self.store_path else None
+
+    def begin_stage(self):
+        return self.incremental.reused
+
+    def end_stage(self, reused_before):
+        return self.incremental.artifacts, self.incremental.reused - reused_before, self.incremental.hashed
+
+    def merge_stage(self, changes):
+        self.incremental.merge(*changes)
+
+
+def scan_source_tree_stage(context, stage, inputs):
+    # The only walk of the source folder, every stage takes its folders and files from source_tree
+    if context.source_tree is None:
+        context.source_tree = SourceTree(context.target_folder, context.excludes, context.use_gitignore)
+    # Hash the sources so this run can reuse previous_output's artifacts and the next run can reuse ours
+    context.incremental = IncrementalAnalysis(context.target_folder, context.analysis_info_folder,
+                                              context.previous_output, context.source_tree, context.known_sources)
+    stage['files_processed'] = len(context.source_tree.files())
+    stage['paths_skipped'] = len(context.source_tree.skipped)
+
+
+def preview_folder_info_stage(context, stage, inputs):
+    # File and line totals need no parsing, so the folder_info written here is shown while the sources are
+    # parsed. Its class and function counts are 0 until save_folder_info_to_json writes it again in full.
+    line_counts = {}
+
+    def count_lines(path):
+        line_counts[path] = count_lines_in_file(path)
+        return line_counts[path]
+
+    save_folder_info_to_json(context.target_folder, context.folder_info, context.target_folder, context.code_info,
+                             max_depth=context.info_depth, source_tree=context.source_tree,
+                             read_metadata=lambda path: None, count_lines=count_lines)
+    stage['files_processed'] = len(line_counts)
+    # The full folder_info takes the line counts from here instead of reading every file again
+    return line_counts
+
+
+def ingest_project_sources_stage(context, stage, inputs):
+    store = context.open_store()
+    # Artifacts in the store are not reused from a previous output, only the folder files are
+    with_ast = context.call_graphs and not context.only_get_info
+    parsed_sources = ingest_project_sources(context.target_folder, context.code_info,
+                                           context.ast_info if with_ast else None, context.workers,
+                                           context.ast_format, None if store else context.incremental,
+                                           context.source_tree, store, context.keep_trees,
+                                           partial(context.progress.files, 'ingest_project_sources'),
+                                           context.packages)
+    if store is not None:
+        store.close()
+    if context.keep_trees:
+        context.parsed_sources = parsed_sources
+    stage['files_processed'] = len(parsed_sources.processed)
+    stage['files_reused'] = len(parsed_sources.skipped)
+    return len(parsed_sources.processed) + len(parsed_sources.skipped)
+
+
+def _save_folder_info(context, inputs, read_metadata):
+    line_counts = inputs['preview_folder_info']
+    return save_folder_info_to_json(context.target_folder, context.folder_info, context.target_folder,
+                                    context.code_info, context.incremental, max_depth=context.info_depth,
+                                    source_tree=context.source_tree, read_metadata=read_metadata,
+                                    count_lines=lambda path: line_counts[path] if path in line_counts
+                                    else count_lines_in_file(path))
+
+
+def save_folder_info_stage(context, stage, inputs):
+    store = context.open_store()
+    read_metadata = read_metadata_file if store is None else store.code_info_reader(context.code_info)
+    folder_info = _save_folder_info(context, inputs, read_metadata)
+    if store is not None:
+        store.put_folder_info(folder_info)
+        store.set_meta('info_depth', context.info_depth)
+        store.close()
+    stage['files_processed'] = inputs['ingest_project_sources']
+
+
+def analysis_dependency_stage(context, stage, inputs):
+    store = context.open_store()
+    analysis_dependency(context.code_info, context.folder_package_dep_info, "csv",
+                        None if store else context.incremental, store=store, memory_budget=context.memory_budget)
+    if store is not None:
+        store.close()
+    stage['files_processed'] = inputs['ingest_project_sources']
+
+
+def generate_gv_result_stage(context, stage, inputs):
+    # The Graphviz jobs are returned for the render pool of the parent
+    renderer = RenderQueue()
+    # With lazy_render only the graph data is written, lazy_render.py draws a folder's images on first view
+    generate_gv_result(context.folder_package_dep_info, context.folder_package_dep_info, not context.lazy_render,
+                       renderer=renderer)
+    return renderer.jobs
+
+
+def generate_call_graphs_stage(context, stage, inputs):
+    renderer = RenderQueue()
+    # The trees of the ingestion are only there when it ran in this process
+    generate_call_graphs_for_folders(context.target_folder, context.folder_call_graph_info,
+                                     parsed_sources=context.parsed_sources, incremental=context.incremental,
+                                     renderer=renderer, lazy=context.lazy_render, source_tree=context.source_tree)
+    if context.parsed_sources is not None:
+        context.parsed_sources.release()
+    stage['files_processed'] = len(context.source_tree.files('.py'))
+    return renderer.jobs
+
+
+def render_stage_counters(stage, jobs):
+    # The images are rendered on pool threads from the moment they are queued, they are all counted here
+    rendered = [job for job in jobs if job['status'] == 'rendered']
+    stage['files_processed'] = len(jobs)
+    stage['files_written'] = len(rendered)
+    stage['bytes_written'] = sum(job['output_bytes'] for job in rendered)
+
+
+def analyze_package_stage(package_folder, context, stage, inputs):
+    # The whole analysis of one package, its stages one after the other in this stage process. Its files and
+    # their hashes come from the scan of the enclosing folder.
+    output = package_output(context.analysis_info_folder, context.target_folder, package_folder)
+    previous_output = package_output(context.previous_output, context.target_folder, package_folder) \
+        if context.previous_output else None
+    prefix = os.path.relpath(package_folder, context.target_folder) + os.path.sep
+    known_sources = {path[len(prefix):]: list(entry) for path, entry in context.incremental.sources.items()
+                     if path.startswith(prefix)}
+    source_tree = context.source_tree.subtree(package_folder)
+    project_analysis(package_folder, output, previous_output=previous_output, source_tree=source_tree,
+                     known_sources=known_sources, stage_workers=1,
+                     progress=context.progress.for_package(package_name(context.target_folder, package_folder)),
+                     **context.package_options)
+    # The package hashed its files for its own manifest, the folder's takes those hashes instead of reading the
+    # files again
+    package_manifest = load_manifest(output)
+    if package_manifest is not None:
+        context.incremental.take_hashes(package_manifest['sources'], prefix)
+    stage['files_processed'] = len(source_tree.files('.py'))
+    return output
+
+
+def _package_metadata_reader(context, package_outputs):
+    # read_metadata of the folder_info of the whole folder: a file of a package has its code_info in the
+    # namespace of the package, relative to the source folder of the package
+    readers = []
+    stores = []
+    for package_folder, output in package_outputs.items():
+        code_info = output + os.path.sep + 'code_info'
+        read_metadata = read_metadata_file
+        if context.package_options.get('use_store'):
+            stores.append(AnalysisStore(os.path.join(output, STORE_FILE)))
+            read_metadata = stores[-1].code_info_reader(code_info)
+        readers.append((resolve_source_folder(package_folder), code_info, read_metadata))
+
+    def read_package_metadata(metadata_file):
+        source_path = os.path.join(context.target_folder, os.path.relpath(metadata_file, context.code_info))
+        for src_folder, code_info, read_metadata in readers:
+            if is_path_under(source_path, src_folder):
+                return read_metadata(os.path.join(code_info, os.path.relpath(source_path, src_folder)))
+        # Files outside the source folders of the packages have their code_info in the folder's own
+        return read_metadata_file(metadata_file)
+    return read_package_metadata, stores
+
+
+def _package_outputs(context, inputs):
+    return {package_folder: inputs[f'analyze_package:{package_name(context.target_folder, package_folder)}']
+            for package_folder in context.packages}
+
+
+def save_packages_folder_info_stage(context, stage, inputs):
+    read_metadata, stores = _package_metadata_reader(context, _package_outputs(context, inputs))
+    _save_folder_info(context, inputs, read_metadata)
+    for store in stores:
+        store.close()
+    stage['files_processed'] = len(inputs['preview_folder_info'])
+
+
+def merge_package_dependencies_stage(context, stage, inputs):
+    # One node per package, a package depends on another when it imports one of its modules
+    package_models = {}
+    for package_folder, output in _package_outputs(context, inputs).items():
+        name = package_name(context.target_folder, package_folder)
+        if context.package_options.get('use_store'):
+            store = AnalysisStore(os.path.join(output, STORE_FILE))
+            package_models[name] = build_dependency_model_from_store(store, max_depth=0)
+            store.close()
+        elif os.path.isdir(output + os.path.sep + 'code_info'):
+            package_models[name] = build_dependency_model(output + os.path.sep + 'code_info', max_depth=0)
+    analysis_package_dependency(package_models, context.folder_package_dep_info)
+    stage['files_processed'] = len(package_models)
+
+
+def packages_analysis(context, metrics, stage_workers):
+    """Analyze every package of context.packages side by side, each into its own namespace, then the folder
+    info of the whole folder and the dependency graph between the packages.
+
+    ast_info and the call graphs are made once for the whole folder, so calls across packages and from the
+    files outside them are kept. Those files also get their code_info in the folder's namespace.
+    """
+    os.makedirs(context.analysis_info_folder, exist_ok=True)
+    packages_file = os.path.join(context.analysis_info_folder, PACKAGES_FILE)
+    with open(packages_file, 'w') as f:
+        json.dump({'source_root': os.path.abspath(context.target_folder),
+                   'packages': [{'name': package_name(context.target_folder, package_folder),
+                                 'folder': os.path.abspath(package_folder),
+                                 # code_info of the package is relative to its source folder
+                                 'source': os.path.abspath(resolve_source_folder(package_folder)),
+                                 'output': os.path.abspath(package_output(context.analysis_info_folder,
+                                                                          context.target_folder, package_folder))}
+                                for package_folder in context.packages]}, f, indent=4)
+    context.progress.artifact('packages', 'packages', packages_file)
+
+    package_stages = [f'analyze_package:{package_name(context.target_folder, package_folder)}'
+                      for package_folder in context.packages]
+    stages = [
+        Stage('scan_source_tree', scan_source_tree_stage, in_parent=True),
+        Stage('preview_folder_info', preview_folder_info_stage, ['scan_source_tree'], [context.folder_info],
+              preview=True),
+        Stage('ingest_project_sources', ingest_project_sources_stage, ['scan_source_tree'],
+              [context.code_info, context.ast_info, symbol_index_path(context.ast_info)]),
+    ]
+    stages += [Stage(name, partial(analyze_package_stage, package_folder), ['scan_source_tree'],
+                     [package_output(context.analysis_info_folder, context.target_folder, package_folder)])
+               for name, package_folder in zip(package_stages, context.packages)]
+    stages.append(Stage('save_folder_info_to_json', save_packages_folder_info_stage,
+                        ['preview_folder_info', 'ingest_project_sources'] + package_stages, [context.folder_info]))
+    renderer = None
+    if not context.only_get_info:
+        options = context.package_options
+        renderer = RenderPool(context.analysis_info_folder + os.path.sep + RENDER_MANIFEST_FILE,
+                              options['render_workers'], options['render_timeout'], options['render_max_bytes'])
+
+        def queue_renders(jobs):
+            for job in jobs:
+                renderer.submit(*job)
+
+        def render_graphs_stage(context, stage, inputs):
+            render_stage_counters(stage, renderer.close())
+
+        stages += [
+            Stage('merge_package_dependencies', merge_package_dependencies_stage, package_stages,
+                  [context.folder_package_dep_info]),
+            Stage('generate_gv_result', generate_gv_result_stage, ['merge_package_dependencies'],
+                  [context.folder_package_dep_info], on_done=queue_renders),
+            Stage('generate_call_graphs_for_folders', generate_call_graphs_stage, ['scan_source_tree'],
+                  [context.folder_call_graph_info], on_done=queue_renders),
+            Stage('render_graphs', render_graphs_stage, ['generate_gv_result', 'generate_call_graphs_for_folders'],
+                  [context.folder_package_dep_info, context.folder_call_graph_info], in_parent=True),
+        ]
+
+    try:
+        StageScheduler(stages, context, metrics, stage_workers, context.progress).run()
+    finally:
+        metrics.save()
+        if renderer is not None:
+            renderer.executor.shutdown()
+    context.incremental.save()
+    return context.analysis_info_folder
+
+
+def project_analysis(target_folder, analysis_info_folder, only_get_info=False, workers=1, ast_format='json',
+                     previous_output=None, info_depth=None, render_workers=None, render_timeout=120,
+                     render_max_bytes=2 * 1024 * 1024, lazy_render=False, profile_stages=None, excludes=None,
+                     use_gitignore=True, use_store=False, stage_workers=None, progress=None, source_tree=None,
+                     known_sources=None, memory_budget=None, call_graphs=True):
+    """Run the analysis stages of target_folder into analysis_info_folder.
+
+    Independent stages run side by side on stage_workers processes, 1 runs them one after the other in this
+    process. The stages and their status end up in metrics.json. progress, a ProgressEvents, is told about
+    stages, files and artifacts as they are done; a preview of folder_info comes first.
+
+    When target_folder holds pyproject.toml packages, each one is analyzed in full into its own namespace,
+    see packages_analysis. source_tree and known_sources, see IncrementalAnalysis, are taken instead of
+    walking and hashing the folder again. call_graphs=False leaves out ast_info and the call graphs.
+
+    With memory_budget (bytes), stages that would hold data of the whole repository in memory stream it or
+    spill it to disk instead: the parsed trees are not kept for code2flow and the dependency model goes to a
+    temporary SQLite file. The call graph stage parses one file at a time, but its code2flow model of every
+    function and call is held whole, it is not bounded by memory_budget.
+    """
     # current_time = datetime.now().strftime("%Y%m%d_%H%M%S")
-    
-    code_analysis_output_folder = analysis_info_folder + os.path.sep  + 'code_info'
-    folder_analysis_output = analysis_info_folder + os.path.sep  + 'folder_info'
-    folder_package_dep_analysis_output = analysis_info_folder  + os.path.sep + 'folder_package_dep_info'
-    folder_call_graph_output = analysis_info_folder  + os.path.sep + 'folder_call_graph_info'
-    ast_output = analysis_info_folder + os.path.sep + 'ast_info'
-    
-    code_analysis_result_path = folder_dependency_analysis(target_folder, code_analysis_output_folder)[0]
-    save_folder_info_to_json(target_folder, folder_analysis_output, target_folder, code_analysis_result_path)
-    if only_get_info:
-        # only calculate info.js
-        return analysis_info_folder
-    analysis_dependency(code_analysis_result_path,folder_package_dep_analysis_output,"csv")
-    generate_gv_result(folder_package_dep_analysis_output, folder_package_dep_analysis_output)
+    if memory_budget is not None and call_graphs and not only_get_info:
+        print("Warning: the call graph model of generate_call_graphs_for_folders is held whole, it is not bounded "
+              "by the memory budget")
+    metrics = StageMetrics(analysis_info_folder, profile_stages)
+    in_process = stage_workers is not None and stage_workers <= 1
+    # The walk comes first, it tells whether target_folder holds several packages
+    source_tree = source_tree or SourceTree(target_folder, excludes, use_gitignore)
+    packages = [folder for folder in find_analysis_folders(target_folder, source_tree) if folder != target_folder]
+    # Within one process code2flow reuses the trees of the ingestion instead of parsing again
+    context = AnalysisContext(target_folder, analysis_info_folder, only_get_info, workers, ast_format, previous_output,
+                              info_depth, lazy_render, excludes, use_gitignore, use_store and not packages,
+                              keep_trees=in_process and not only_get_info and call_graphs and memory_budget is None,
+                              progress=progress, memory_budget=memory_budget, call_graphs=call_graphs)
+    context.source_tree = source_tree
+    context.known_sources = known_sources
+    if packages:
+        context.packages = packages
+        context.package_options = dict(only_get_info=only_get_info, workers=workers, ast_format=ast_format,
+                                       info_depth=info_depth, render_workers=render_workers,
+                                       render_timeout=render_timeout, render_max_bytes=render_max_bytes,
+                                       lazy_render=lazy_render, profile_stages=profile_stages, use_store=use_store,
+                                       memory_budget=memory_budget, call_graphs=False)
+        return packages_analysis(context, metrics, stage_workers)
+    if use_store:
+        # code_info and ast_info go to a single SQLite file instead of one file per source file,
+        # analysis_store.py --export writes them in their folders for the consumers reading files
+        os.makedirs(analysis_info_folder, exist_ok=True)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(context.store_path + suffix):
+                os.remove(context.store_path + suffix)
+    store_outputs = [context.store_path] if use_store else []
 
-    generate_call_graphs_for_folders(target_folder, folder_call_graph_output)
+    stages = [
+        Stage('scan_source_tree', scan_source_tree_stage, in_parent=True),
+        # Declared first, so it is started before the costly stages
+        Stage('preview_folder_info', preview_folder_info_stage, ['scan_source_tree'], [context.folder_info],
+              preview=True),
+        Stage('ingest_project_sources', ingest_project_sources_stage, ['scan_source_tree'],
+              [context.code_info, context.ast_info, symbol_index_path(context.ast_info)] + store_outputs),
+        Stage('save_folder_info_to_json', save_folder_info_stage, ['preview_folder_info', 'ingest_project_sources'],
+              [context.folder_info] + store_outputs),
+    ]
+    renderer = None
+    if not only_get_info:
+        # Graphviz jobs are queued as the stages finish and rendered on a pool, see render_manifest.json
+        renderer = RenderPool(analysis_info_folder + os.path.sep + RENDER_MANIFEST_FILE, render_workers, render_timeout,
+                              render_max_bytes)
 
-    build_ast_data(target_folder, ast_output)
-    
+        def queue_renders(jobs):
+            for job in jobs:
+                renderer.submit(*job)
+
+        def render_graphs_stage(context, stage, inputs):
+            render_stage_counters(stage, renderer.close())
+
+        stages += [
+            Stage('analysis_dependency', analysis_dependency_stage, ['ingest_project_sources'],
+                  [context.folder_package_dep_info] + store_outputs),
+            Stage('generate_gv_result', generate_gv_result_stage, ['analysis_dependency'],
+                  [context.folder_package_dep_info], on_done=queue_renders),
+        ]
+        if call_graphs:
+            # Needs only the sources, so it runs beside the ingestion
+            stages.append(Stage('generate_call_graphs_for_folders', generate_call_graphs_stage, ['scan_source_tree'],
+                                [context.folder_call_graph_info], on_done=queue_renders))
+        # Images queued by the stages above land here, so their bytes are counted once
+        stages.append(Stage('render_graphs', render_graphs_stage,
+                            ['generate_gv_result'] + (['generate_call_graphs_for_folders'] if call_graphs else []),
+                            [context.folder_package_dep_info, context.folder_call_graph_info], in_parent=True))
+
+    try:
+        StageScheduler(stages, context, metrics, stage_workers, context.progress).run()
+    finally:
+        metrics.save()
+        if renderer is not None:
+            renderer.executor.shutdown()
+    # ast_info was already written by the ingestion stage
+    context.incremental.save()
     return analysis_info_folder
     
 
@@ -72,6 +535,46 @@ if __name__ == "__main__":
                                                                                                  'csharp, python, '
                                                                                                  'java)')
     parser.add_argument('-c', '--csharpDir', type=str, help='The path to get graph.csv for c# scenario')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of processes used to parse source files. '
+                                                                    '1 parses them serially.')
+    parser.add_argument('-p', '--previous', type=str, help='A previous output folder of the same source, its '
+                                                           'unchanged artifacts are reused instead of recomputed.')
+    parser.add_argument('--ast-format', type=str, choices=['json', 'binary'], default='json',
+                        help='The on-disk format of ast_info, binary is smaller and faster to load.')
+    parser.add_argument('--info-depth', type=int, help='Levels of sub folders embedded in each folder_info '
+                                                       'info.json, deeper ones are referenced as shards. '
+                                                       'Unset embeds the whole tree.')
+    parser.add_argument('--stage-workers', type=int, help='Number of processes running independent stages at once, '
+                                                          'defaults to the number of CPUs. 1 runs the stages one '
+                                                          'after the other in this process.')
+    parser.add_argument('--render-workers', type=int, help='Number of Graphviz jobs run at once, defaults to the '
+                                                           'number of CPUs.')
+    parser.add_argument('--render-timeout', type=float, default=120, help='Seconds after which a Graphviz job is '
+                                                                          'killed.')
+    parser.add_argument('--render-max-bytes', type=int, default=2 * 1024 * 1024,
+                        help='Graphs whose dot source is larger are not rendered, only listed in '
+                             'render_manifest.json.')
+    parser.add_argument('--lazy-render', action='store_true', help='Only write the graph data, images are drawn '
+                                                                   'on first view by lazy_render.py.')
+    parser.add_argument('--exclude', type=str, action='append', help='A file or folder name glob left out of the '
+                                                                      'analysis, can be repeated. Starting with / '
+                                                                      'it matches the path from the source folder. '
+                                                                      'Adds to the '
+                                                                      f'default ones: {" ".join(DEFAULT_EXCLUDES)}.')
+    parser.add_argument('--no-ignore', action='store_true', help='Analyze everything: no default excludes and no '
+                                                                 '.gitignore, only --exclude.')
+    parser.add_argument('--store', action='store_true', help=f'Keep code_info, ast_info, folder totals and dependency '
+                                                             f'edges in one SQLite file, {STORE_FILE}, instead of a '
+                                                             f'file per source file.')
+    parser.add_argument('--progress', action='store_true', help='Report the progress as JSON lines on stdout, one '
+                                                                '{"event": ...} object per stage status, file count '
+                                                                'and artifact ready.')
+    parser.add_argument('--memory-budget', type=float, help='Megabytes of analysis data kept in memory: stages '
+                                                            'stream or spill to disk instead of holding the whole '
+                                                            'repository, unbounded by default. The call graph '
+                                                            'model of every function and call is not bounded.')
+    parser.add_argument('--profile-stage', type=str, action='append', choices=ANALYSIS_STAGES,
+                        help='Write a cProfile dump of this stage next to metrics.json, can be repeated.')
 
     args = parser.parse_args()
 
@@ -80,6 +583,21 @@ if __name__ == "__main__":
     target_function = args.target_function
     language = args.language
     csharp_location = args.csharpDir
+    workers = args.workers
+    ast_format = args.ast_format
+    previous_output = args.previous
+    info_depth = args.info_depth
+    render_workers = args.render_workers
+    render_timeout = args.render_timeout
+    render_max_bytes = args.render_max_bytes
+    lazy_render = args.lazy_render
+    profile_stages = args.profile_stage
+    excludes = (args.exclude or []) + ([] if args.no_ignore else DEFAULT_EXCLUDES)
+    use_gitignore = not args.no_ignore
+    use_store = args.store
+    stage_workers = args.stage_workers
+    progress = ProgressEvents(json_lines=args.progress)
+    memory_budget = budget_bytes(args.memory_budget)
 
 
     # project_folder = r"C:\Users\anthu\projects\code2flow\promptflow\src\promptflow-devkit\promptflow"
@@ -88,11 +606,20 @@ if __name__ == "__main__":
     print(target_function)
 
     if target_function:
+        # Query only, the subset comes from the call graph model of the analysis already in output_folder
         generate_call_graphs_for_function(project_folder, output_folder, target_function)
-    if language == 'csharp':
+    elif language == 'csharp':
         generate_gv_result(csharp_location, csharp_location, False)
-        project_analysis(project_folder, output_folder, True)
+        project_analysis(project_folder, output_folder, True, workers=workers, previous_output=previous_output,
+                         info_depth=info_depth, profile_stages=profile_stages, excludes=excludes,
+                         use_gitignore=use_gitignore, use_store=use_store, stage_workers=stage_workers,
+                         progress=progress, memory_budget=memory_budget)
     else:
-        project_analysis(project_folder, output_folder)
+        project_analysis(project_folder, output_folder, workers=workers, ast_format=ast_format,
+                         previous_output=previous_output, info_depth=info_depth, render_workers=render_workers,
+                         render_timeout=render_timeout, render_max_bytes=render_max_bytes, lazy_render=lazy_render,
+                         profile_stages=profile_stages, excludes=excludes, use_gitignore=use_gitignore,
+                         use_store=use_store, stage_workers=stage_workers, progress=progress,
+                         memory_budget=memory_budget)
     
     
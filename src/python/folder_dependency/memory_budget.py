@@ -0,0 +1,41 @@
+from collections import OrderedDict
+
+# --memory-budget is given in megabytes
+MEGABYTE = 1024 * 1024
+
+
+def budget_bytes(megabytes):
+    return None if megabytes is None else int(megabytes * MEGABYTE)
+
+
+class BoundedCache:
+    """The values used last, as long as their sizes add up to at most max_bytes. Unbounded when max_bytes is None.
+
+    Sizes are the caller's estimate of the memory of a value. A value larger than the whole budget is not kept.
+    """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self.values = OrderedDict()
+        self.bytes = 0
+
+    def __contains__(self, key):
+        return key in self.values
+
+    def get(self, key):
+        if key not in self.values:
+            return None
+        self.values.move_to_end(key)
+        return self.values[key][0]
+
+    def put(self, key, value, size):
+        if key in self.values:
+            self.bytes -= self.values.pop(key)[1]
+        if self.max_bytes is not None and size > self.max_bytes:
+            return value
+        self.values[key] = (value, size)
+        self.bytes += size
+        while self.max_bytes is not None and self.bytes > self.max_bytes:
+            _, (_, evicted_size) = self.values.popitem(last=False)
+            self.bytes -= evicted_size
+        return value
@@ -0,0 +1,53 @@
+import json
+import sys
+import time
+
+
+class ProgressEvents:
+    """Reports how far an analysis is: stages starting and ending, files done out of total and artifacts ready.
+
+    With json_lines every event is one JSON object on a line of stdout, e.g.
+    {"event": "files", "stage": "ingest_project_sources", "done": 100, "total": 4000}, for the UI to follow.
+    Otherwise they are short messages. File counts are reported at most every interval seconds. Events of the
+    analysis of one package of a multi-package folder carry its name as "package".
+    Picklable, so stage processes report through their copy of it.
+    """
+
+    def __init__(self, json_lines=False, interval=0.5, package=None):
+        self.json_lines = json_lines
+        self.interval = interval
+        self.package = package
+        self.last_files = 0
+
+    def for_package(self, package):
+        return ProgressEvents(self.json_lines, self.interval, package)
+
+    def _message(self, text):
+        print(text if self.package is None else f"[{self.package}] {text}")
+
+    def emit(self, event, **fields):
+        if self.package is not None:
+            fields['package'] = self.package
+        if self.json_lines:
+            # One write per line, so lines of stage processes sharing stdout do not interleave
+            sys.stdout.write(json.dumps(dict(event=event, **fields)) + '\n')
+            sys.stdout.flush()
+
+    def stage(self, name, status, **fields):
+        self.emit('stage', stage=name, status=status, **fields)
+        if not self.json_lines:
+            self._message(f"Stage {name}: {status}")
+
+    def files(self, stage, done, total):
+        now = time.monotonic()
+        if done < total and now - self.last_files < self.interval:
+            return
+        self.last_files = now
+        self.emit('files', stage=stage, done=done, total=total)
+        if not self.json_lines:
+            self._message(f"{stage}: {done}/{total} files")
+
+    def artifact(self, stage, name, path, preview=False):
+        self.emit('artifact', stage=stage, name=name, path=path, preview=preview)
+        if not self.json_lines:
+            self._message(f"{'Preview of ' if preview else ''}{name} ready: {path}")
@@ -2,25 +2,31 @@ import ast
 import os
 import json
 import argparse
+from collections import deque, OrderedDict
+from ast_store import save_ast_binary, load_ast_binary, encode_ast_binary, AST_BINARY_EXTENSION, JSON_AST_MEMORY_FACTOR, BINARY_AST_MEMORY_FACTOR
+from analysis_store import AnalysisStore, store_for_ast_dir, store_key
+from source_walker import walk_source
+from memory_budget import BoundedCache
+from stage_metrics import count_written
+
+def ast_to_dict(node):
+    if isinstance(node, ast.AST):
+        result = {'_type': node.__class__.__name__}
+        for field, value in ast.iter_fields(node):
+            result[field] = ast_to_dict(value)
+        if hasattr(node, 'lineno'):
+            result['lineno'] = node.lineno
+        return result
+    elif isinstance(node, list):
+        return [ast_to_dict(elem) for elem in node]
+    else:
+        return node
 
 def parse_code_to_ast(path):
     with open(path, 'r', encoding='utf-8') as file:
         code = file.read()
     
     ast_tree = ast.parse(code)
-    
-    def ast_to_dict(node):
-        if isinstance(node, ast.AST):
-            result = {'_type': node.__class__.__name__}
-            for field, value in ast.iter_fields(node):
-                result[field] = ast_to_dict(value)
-            if hasattr(node, 'lineno'):
-                result['lineno'] = node.lineno
-            return result
-        elif isinstance(node, list):
-            return [ast_to_dict(elem) for elem in node]
-        else:
-            return node
 
     ast_dict = ast_to_dict(ast_tree)
     return ast_dict
@@ -41,6 +47,7 @@ def save_ast_to_json(ast_dict, output_path):
     ast_dict = convert_to_serializable(ast_dict)  # Convert bytes and ellipses to serializable format
     with open(output_path, 'w', encoding='utf-8') as json_file:
         json.dump(ast_dict, json_file, ensure_ascii=False, indent=4)
+    count_written(output_path)
 
 def convert_serializable_to_original(obj):
     if isinstance(obj, dict):
@@ -62,64 +69,261 @@ def load_ast_from_json(json_path):
         ast_dict = json.load(json_file)
     # return convert_serializable_to_original(ast_dict)
     return ast_dict
-def dump_ast_for_directory(source_dir, output_dir):
-    for root, _, files in os.walk(source_dir):
+
+def ast_namespace(relative_path):
+    return relative_path.replace('.py', '').replace(os.path.sep, '.')
+
+def write_ast_info(ast_dict, relative_path, output_path):
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    ast_dict['_namespace'] = ast_namespace(relative_path)
+    ast_dict['_file'] = relative_path
+    save_ast_to_json(ast_dict, output_path)
+
+def write_ast_info_binary(tree, relative_path, output_path):
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    save_ast_binary(tree, ast_namespace(relative_path), relative_path, output_path)
+
+def ast_info_path(relative_path, output_dir, ast_format):
+    return os.path.join(output_dir, relative_path + (AST_BINARY_EXTENSION if ast_format == 'binary' else '.json'))
+
+def _write_ast_info(tree, relative_path, output_dir, ast_format):
+    output_path = ast_info_path(relative_path, output_dir, ast_format)
+    if ast_format == 'binary':
+        write_ast_info_binary(tree, relative_path, output_path)
+    else:
+        write_ast_info(ast_to_dict(tree), relative_path, output_path)
+    return output_path
+
+def dump_ast_for_directory(source_dir, output_dir, ast_format='json', source_tree=None):
+    symbols = {}
+    for root, _, files in walk_source(source_dir, source_tree):
         for file in files:
             if file.endswith('.py'):
                 input_path = os.path.join(root, file)
                 relative_path = os.path.relpath(input_path, source_dir)
-                output_path = os.path.join(output_dir, relative_path + '.json')
-                
-                os.makedirs(os.path.dirname(output_path), exist_ok=True)
-                
-                ast_dict = parse_code_to_ast(input_path)
-                ast_dict['_namespace'] = relative_path.replace('.py', '').replace(os.path.sep, '.')
-                ast_dict['_file'] = relative_path
-                save_ast_to_json(ast_dict, output_path)
+
+                with open(input_path, 'r', encoding='utf-8') as source_file:
+                    tree = ast.parse(source_file.read())
+                output_path = _write_ast_info(tree, relative_path, output_dir, ast_format)
+                symbols.update(find_symbol_definitions(tree, ast_namespace(relative_path), relative_path))
                 print(f"Processed {input_path} -> {output_path}")
+    save_symbol_index(symbols, output_dir)
+
+class AstInfoWriter:
+    """Ingestion consumer dumping the ast_info (json or binary) of every python file under source_dir.
+
+    With an AnalysisStore, the binary ASTs and the symbol index go to the store instead.
+    """
+
+    def __init__(self, source_dir, output_dir, ast_format='json', store=None):
+        self.source_dir = source_dir
+        self.output_dir = output_dir
+        self.ast_format = ast_format
+        self.symbols = {}
+        self.store = store
+        self.use_store = store is not None
+
+    def __getstate__(self):
+        # The workers only encode, the store connection stays in the parent
+        return dict(self.__dict__, store=None)
+
+    def accepts(self, path):
+        return True
+
+    def artifact_path(self, path):
+        return ast_info_path(os.path.relpath(path, self.source_dir), self.output_dir, self.ast_format)
+
+    def __call__(self, path, tree):
+        relative_path = os.path.relpath(path, self.source_dir)
+        symbols = find_symbol_definitions(tree, ast_namespace(relative_path), relative_path)
+        if self.use_store:
+            return symbols, encode_ast_binary(tree, ast_namespace(relative_path), relative_path)
+        _write_ast_info(tree, relative_path, self.output_dir, self.ast_format)
+        return symbols
+
+    def collect(self, path, symbols):
+        if self.use_store:
+            symbols, data = symbols
+            self.store.put_ast(store_key(os.path.relpath(path, self.source_dir)), data)
+        self.symbols.update(symbols)
+
+    def collect_previous(self, previous_ast_dir, paths):
+        """Take the symbols of files whose ast_info was reused from the index of a previous run."""
+        previous_symbols = load_symbol_index(previous_ast_dir) or {}
+        files = {os.path.relpath(path, self.source_dir) for path in paths}
+        self.symbols.update({name: entry for name, entry in previous_symbols.items() if entry[0] in files})
+
+    def save_symbol_index(self):
+        if self.use_store:
+            self.store.put_symbols(self.symbols)
+        else:
+            save_symbol_index(self.symbols, self.output_dir)
 
 
-def build_ast_data(source_dir, output_dir):
+def build_ast_data(source_dir, output_dir, ast_format='json'):
     if not os.path.exists(source_dir):
         print(f"The source directory {source_dir} does not exist.")
         return
     
     os.makedirs(output_dir, exist_ok=True)
     
-    dump_ast_for_directory(source_dir, output_dir)
-
-def retrieve_method_callstack(ast_dir, file_name, method_name, output_file):
-    if not os.path.exists(ast_dir):
-        print(f"The AST directory {ast_dir} does not exist.")
-        return
-    asts = load_all_asts(ast_dir)
-    call_stack = generate_call_stack(asts, file_name, method_name)
+    dump_ast_for_directory(source_dir, output_dir, ast_format)
+
+def symbol_index_path(ast_dir):
+    # Kept beside ast_info rather than inside it so load_all_asts never mistakes it for an AST
+    return os.path.normpath(ast_dir) + '.symbols.json'
+
+def find_symbol_definitions(tree, namespace, file_name):
+    """Map every definition in a module to (file, line, kind), keyed like find_function_definitions."""
+    symbols = {}
+
+    def visit(node, parent):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, ast.FunctionDef):
+                kind = 'method' if isinstance(parent, ast.ClassDef) else 'function'
+                symbols.setdefault(f"{namespace}.{child.name}", (file_name, child.lineno, kind))
+            elif isinstance(child, ast.ClassDef):
+                symbols.setdefault(f"{namespace}.{child.name}", (file_name, child.lineno, 'class'))
+            visit(child, child)
+
+    visit(tree, tree)
+    return symbols
+
+def save_symbol_index(symbols, ast_dir):
+    with open(symbol_index_path(ast_dir), 'w', encoding='utf-8') as f:
+        json.dump({'version': 1, 'symbols': symbols}, f)
+    count_written(symbol_index_path(ast_dir))
+
+def load_symbol_index(ast_dir):
+    index_path = symbol_index_path(ast_dir)
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path, 'r', encoding='utf-8') as f:
+        return {name: tuple(entry) for name, entry in json.load(f)['symbols'].items()}
+
+def module_ast(module):
+    """The ast tree of an ast_info module, which is either a json dict or a tree from the binary store."""
+    return module if isinstance(module, ast.AST) else dict_to_ast(module)
+
+def module_attribute(module, name):
+    if isinstance(module, ast.AST):
+        return getattr(module, name, '')
+    return module.get(name, '')
+
+def build_symbol_index(modules):
+    # Fallback for ast_info folders written before the index existed, modules can be a generator
+    symbols = {}
+    for module in modules:
+        symbols.update(find_symbol_definitions(module_ast(module), module_attribute(module, '_namespace'), module_attribute(module, '_file')))
+    return symbols
+
+def load_ast_info(path):
+    if path.endswith(AST_BINARY_EXTENSION):
+        return load_ast_binary(path)
+    return load_ast_from_json(path)
+
+def ast_memory_size(path):
+    """Estimated memory of the module loaded from the ast_info file at path."""
+    factor = BINARY_AST_MEMORY_FACTOR if path.endswith(AST_BINARY_EXTENSION) else JSON_AST_MEMORY_FACTOR
+    return int(os.path.getsize(path) * factor)
+
+class AstDirectory:
+    """Dict-like view of an ast_info folder that loads each module the first time it is used.
+
+    With max_bytes, only the modules used last that fit in it stay loaded, the others are loaded again when used.
+    """
+
+    def __init__(self, ast_dir, max_bytes=None):
+        self.ast_dir = ast_dir
+        self.asts = BoundedCache(max_bytes)
+
+    def _module_path(self, file):
+        binary_path = os.path.join(self.ast_dir, file + AST_BINARY_EXTENSION)
+        if os.path.exists(binary_path):
+            return binary_path
+        return os.path.join(self.ast_dir, file + '.json')
+
+    def __contains__(self, file):
+        return file in self.asts or os.path.exists(self._module_path(file))
+
+    def __getitem__(self, file):
+        module = self.asts.get(file)
+        if module is None:
+            module_path = self._module_path(file)
+            module = self.asts.put(file, load_ast_info(module_path), ast_memory_size(module_path))
+        return module
+
+def ast_data_exists(ast_dir):
+    return os.path.exists(ast_dir) or store_for_ast_dir(ast_dir) is not None
+
+def open_ast_store(ast_dir, memory_budget=None):
+    """Return (asts, symbol_index) for an ast_info folder, loading the module asts lazily when indexed.
+
+    ast_dir can also be an analysis store, or the ast_info folder of an analysis written to its store.
+    With memory_budget (bytes), the loaded asts are kept within it, and a folder without a symbol index is
+    indexed one module at a time and gets its index written instead of being loaded whole. The module cache of
+    find_method_calls is then cut down to the module in use.
+    """
+    set_module_cache_size(MODULE_CACHE_SIZE if memory_budget is None else BUDGET_MODULE_CACHE_SIZE)
+    store_path = store_for_ast_dir(ast_dir)
+    if store_path is not None:
+        store = AnalysisStore(store_path)
+        return store.ast_directory(memory_budget), store.symbol_index()
+    symbol_index = load_symbol_index(ast_dir)
+    if symbol_index is None:
+        if memory_budget is None:
+            asts = load_all_asts(ast_dir)
+            return asts, build_symbol_index(asts.values())
+        symbol_index = build_symbol_index(module for _, module in iter_asts(ast_dir))
+        save_symbol_index(symbol_index, ast_dir)
+    return AstDirectory(ast_dir, memory_budget), symbol_index
+
+def write_call_stack(call_stack, output_file):
     # no_ext_file_name = file_name.replace('.py', '')
     # output_file = os.path.join(output_dir, f'{no_ext_file_name}_{method_name}.json')
     directory = os.path.dirname(output_file)
-    if not os.path.exists(directory):
+    if directory and not os.path.exists(directory):
         os.makedirs(directory)
 
-
     with open(output_file, 'w') as f:
         json.dump(call_stack, f, indent=4)
+
+def retrieve_method_callstack(ast_dir, file_name, method_name, output_file, max_depth=None, max_nodes=None):
+    if not ast_data_exists(ast_dir):
+        print(f"The AST directory {ast_dir} does not exist.")
+        return
+    asts, symbol_index = open_ast_store(ast_dir)
+    call_stack = generate_call_stack(asts, file_name, method_name, symbol_index, max_depth, max_nodes)
+    write_call_stack(call_stack, output_file)
     
     print(f"Call stack for method {method_name} in file {file_name}:")
     print(json.dumps(call_stack, indent=4))
 
     return output_file
 
+def retrieve_batch_callstacks(ast_dir, output_file, file_name=None, max_depth=None):
+    """Write the call stacks of every function of file_name (every file when None) as one call stack."""
+    if not ast_data_exists(ast_dir):
+        print(f"The AST directory {ast_dir} does not exist.")
+        return
+    asts, symbol_index = open_ast_store(ast_dir)
+    call_stack = CallStackExpander(asts, symbol_index).expand_all(file_name, max_depth)
+    write_call_stack(call_stack, output_file)
+    print(f"Call stacks of {len(call_stack)} functions written to {output_file}")
+    return output_file
+
 
-def load_all_asts(output_dir):
-    asts = {}
+def iter_asts(output_dir):
+    """Yield (relative path, module) of every ast_info file in output_dir, loading one module at a time."""
     for root, _, files in os.walk(output_dir):
         for file in files:
-            if file.endswith('.json'):
-                json_path = os.path.join(root, file)
-                ast_dict = load_ast_from_json(json_path)
-                relative_path = os.path.relpath(json_path, output_dir).replace('.json', '')
-                asts[relative_path] = ast_dict
-    return asts
+            if file.endswith('.json') or file.endswith(AST_BINARY_EXTENSION):
+                module_path = os.path.join(root, file)
+                relative_path = os.path.relpath(module_path, output_dir).replace('.json', '').replace(AST_BINARY_EXTENSION, '')
+                yield relative_path, load_ast_info(module_path)
+
+def load_all_asts(output_dir):
+    return dict(iter_asts(output_dir))
 
 def find_function_definitions(ast):
     function_full_names = {}
@@ -147,22 +351,72 @@ def find_function_definitions(ast):
     
     return function_full_names
 
-def find_method_calls(ast_dict, method_name, file_path,function_definitions):
-    import_from_mapping = {}
-    import_mapping = {}
-    method_namespace = ast_dict.get('_namespace', '')
-
-    class ImportVisitor(ast.NodeVisitor):
-        def visit_ImportFrom(self, node):
-            module_name = node.module
-            for alias in node.names:
-                import_from_mapping[alias.name] = module_name
-            self.generic_visit(node)
+class ModuleCallInfo:
+    """What find_method_calls needs of a module, worked out once: its tree, imports and functions by name.
+
+    functions holds the FunctionDefs a visit of the whole module enters, i.e. the ones not nested in another
+    function, so visiting them alone finds the same calls.
+    """
+
+    def __init__(self, module):
+        self.module = module
+        self.tree = module_ast(module)
+        self.import_from_mapping = {}
+        self.import_mapping = {}
+        self.functions = {}
+        import_from_mapping, import_mapping = self.import_from_mapping, self.import_mapping
+
+        class ImportVisitor(ast.NodeVisitor):
+            def visit_ImportFrom(self, node):
+                module_name = node.module
+                for alias in node.names:
+                    import_from_mapping[alias.name] = module_name
+                self.generic_visit(node)
 
-        def visit_Import(self, node):
-            for alias in node.names:
-                import_mapping[alias.name] = alias.name
-            self.generic_visit(node)
+            def visit_Import(self, node):
+                for alias in node.names:
+                    import_mapping[alias.name] = alias.name
+                self.generic_visit(node)
+
+        ImportVisitor().visit(self.tree)
+        stack = [self.tree]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, ast.FunctionDef):
+                self.functions.setdefault(node.name, []).append(node)
+                continue
+            stack.extend(reversed(list(ast.iter_child_nodes(node))))
+
+MODULE_CACHE_SIZE = 256
+# A ModuleCallInfo holds its module and tree, so under a memory budget only the module in use is kept: the
+# modules evicted by the AstDirectory can then be collected and the loaded ASTs stay within the budget
+BUDGET_MODULE_CACHE_SIZE = 1
+_module_cache = OrderedDict()
+_module_cache_size = MODULE_CACHE_SIZE
+
+def set_module_cache_size(size):
+    """Keep the ModuleCallInfo of at most size modules, the ones used last."""
+    global _module_cache_size
+    _module_cache_size = size
+    while len(_module_cache) > size:
+        _module_cache.popitem(last=False)
+
+def module_call_info(module, file_path):
+    """The ModuleCallInfo of module, kept for the modules used last, see set_module_cache_size."""
+    info = _module_cache.get(file_path)
+    if info is None or info.module is not module:
+        info = ModuleCallInfo(module)
+        _module_cache[file_path] = info
+        while len(_module_cache) > _module_cache_size:
+            _module_cache.popitem(last=False)
+    _module_cache.move_to_end(file_path)
+    return info
+
+def find_method_calls(ast_dict, method_name, file_path,function_definitions):
+    module = module_call_info(ast_dict, file_path)
+    import_from_mapping = module.import_from_mapping
+    import_mapping = module.import_mapping
+    method_namespace = module_attribute(ast_dict, '_namespace')
 
     class MethodCallVisitor(ast.NodeVisitor):
         def _match_call_with_import(self, call_name):
@@ -222,16 +476,10 @@ def find_method_calls(ast_dict, method_name, file_path,function_definitions):
             if isinstance(node, ast.Name):
                 attr_list.append(node.id)
             return '.'.join(reversed(attr_list)) 
-    ast_tree = dict_to_ast(ast_dict)
-    import_visitor = ImportVisitor()
-    import_visitor.visit(ast_tree)
-
-    
-    
-
-    # method_ast = dict_to_ast(ast_dict)
+    # Only the bodies of the functions named method_name are visited, not the whole module
     visitor = MethodCallVisitor(method_name,import_mapping,import_from_mapping,function_definitions,method_namespace)
-    visitor.visit(ast_tree)
+    for function_node in module.functions.get(method_name, []):
+        visitor.visit(function_node)
     return visitor.calls
 
 def dict_to_ast(d):
@@ -255,35 +503,101 @@ def find_defined_methods(ast_dict):
                 methods.append(node['name'])
     return methods
 
-def generate_call_stack(asts, file_name, method_name):
-    visited = set()
-
-    function_definitions = {}
-    for ast in asts.values():
-        function_definitions.update(find_function_definitions(ast))
-
-    def recursive_search(file, method, call_stack,function_definitions):
-        if file not in asts:
-            return call_stack
-        ast_dict = asts[file]
-        calls = find_method_calls(ast_dict, method.split('.')[-1], file,function_definitions)
-        filtered_calls = []
-
-        for call in calls:
-            if call['name'] in function_definitions:
-                filtered_calls.append(call)
-
-        call_stack[f"{file}:{method}"] = filtered_calls
-        for call in filtered_calls:
-            if f"{call['file']}:{call['name']}" not in visited:
-                visited.add(f"{call['file']}:{call['name']}")
-                for f, ast in asts.items():
-                    if call['name'] in find_function_definitions(ast):
-                        recursive_search(f, call['name'], call_stack,function_definitions)
-        return call_stack
-
-    call_stack = {}
-    return recursive_search(file_name, method_name, call_stack,function_definitions)
+def find_function_callees(asts, file, method, function_definitions):
+    """Direct calls made by method in file that resolve to a function defined in the analysed source."""
+    calls = find_method_calls(asts[file], method.split('.')[-1], file, function_definitions)
+    return [call for call in calls if call['name'] in function_definitions]
+
+class CallStackExpander:
+    """Expands call stacks of the functions in asts, computing each function's callees once for every query.
+
+    A call stack maps "file:function" to the calls that function makes. Calls back into a function on the path
+    being expanded are marked "cycle", calls left unexpanded by max_depth or max_nodes "truncated".
+    """
+
+    def __init__(self, asts, symbol_index=None):
+        self.asts = asts
+        if symbol_index is None:
+            symbol_index = build_symbol_index(asts.values())
+        self.function_definitions = {name: entry[0] for name, entry in symbol_index.items() if entry[2] != 'class'}
+        self.callees = {}
+
+    def callees_of(self, file, method):
+        """The calls of method in file to analysed functions, None when file has no ast."""
+        key = f"{file}:{method}"
+        if key not in self.callees:
+            self.callees[key] = find_function_callees(self.asts, file, method, self.function_definitions) if file in self.asts else None
+        return self.callees[key]
+
+    def _expand(self, roots, max_depth=None, max_nodes=None):
+        # Breadth first, so every function is reached at its shortest depth from the roots
+        call_stack = {}
+        cut = set()
+        queue = deque((file, method, 0) for file, method in roots)
+        queued = {f"{file}:{method}" for file, method in roots}
+        while queue:
+            file, method, depth = queue.popleft()
+            key = f"{file}:{method}"
+            if (max_depth is not None and depth >= max_depth) or (max_nodes is not None and len(call_stack) >= max_nodes):
+                cut.add(key)
+                continue
+            calls = self.callees_of(file, method)
+            if calls is None:
+                continue
+            call_stack[key] = calls
+            for call in calls:
+                call_key = f"{call['file']}:{call['name']}"
+                if call_key not in queued:
+                    queued.add(call_key)
+                    queue.append((self.function_definitions[call['name']], call['name'], depth + 1))
+        return self._mark(call_stack, roots, cut)
+
+    def _mark(self, call_stack, roots, cut):
+        # Depth first from the roots: a call to a function on the current path closes a cycle
+        marked = {}
+        on_path = set()
+        for file, method in roots:
+            root = f"{file}:{method}"
+            if root not in call_stack or root in marked:
+                continue
+            marked[root] = []
+            on_path.add(root)
+            stack = [(root, iter(call_stack[root]))]
+            while stack:
+                key, calls = stack[-1]
+                call = next(calls, None)
+                if call is None:
+                    on_path.discard(key)
+                    stack.pop()
+                    continue
+                call_key = f"{call['file']}:{call['name']}"
+                entry = dict(call)
+                if call_key in on_path:
+                    entry['cycle'] = True
+                elif call_key in cut:
+                    entry['truncated'] = True
+                marked[key].append(entry)
+                if call_key in call_stack and call_key not in marked:
+                    marked[call_key] = []
+                    on_path.add(call_key)
+                    stack.append((call_key, iter(call_stack[call_key])))
+        return marked
+
+    def expand(self, file_name, method_name, max_depth=None, max_nodes=None):
+        """Call stack of method_name in file_name, down to max_depth calls and max_nodes expanded functions."""
+        return self._expand([(file_name, method_name)], max_depth, max_nodes)
+
+    def expand_all(self, file_name=None, max_depth=None):
+        """One call stack covering every function of file_name, or of every file, each callee list computed once.
+
+        The call stack of any of those functions is the part reachable from its key.
+        """
+        roots = sorted((file, name) for name, file in self.function_definitions.items()
+                       if file_name is None or file == file_name)
+        return self._expand(roots, max_depth)
+
+def generate_call_stack(asts, file_name, method_name, symbol_index=None, max_depth=None, max_nodes=None):
+    return CallStackExpander(asts, symbol_index).expand(file_name, method_name, max_depth, max_nodes)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Retrieve a method call stacks given a set of ast.')
@@ -291,8 +605,16 @@ if __name__ == "__main__":
     parser.add_argument('-f','--file_name', type=str, help='The name of the file to analyze.')
     parser.add_argument('-m','--method_name', type=str, help='The name of the method to analyze.')
     parser.add_argument('-o','--output_file', type=str, help='The directory to save the output.')
+    parser.add_argument('--max-depth', type=int, help='Calls followed below the method, unlimited by default.')
+    parser.add_argument('--max-nodes', type=int, help='Functions expanded at most, unlimited by default.')
+    parser.add_argument('--batch', action='store_true', help='Write the call stacks of every function in -f, or '
+                                                             'in every file without -f, as one call stack.')
     args = parser.parse_args()
-    retrieve_method_callstack(args.ast_dir, args.file_name, args.method_name, args.output_file)
+    if args.batch:
+        retrieve_batch_callstacks(args.ast_dir, args.output_file, args.file_name, args.max_depth)
+    else:
+        retrieve_method_callstack(args.ast_dir, args.file_name, args.method_name, args.output_file, args.max_depth,
+                                  args.max_nodes)
     # build_ast_data(source_dir, output_dir)
 
 # retrieve_method_callstack(r"C:\Users\anthu\.code-analyzer\temp\analysis_output\2024-08-01T08-29-00-300Z\ast_info4",
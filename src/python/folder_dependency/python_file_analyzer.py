@@ -2,10 +2,14 @@ import ast
 import os
 import json
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass, field,asdict
 from typing import List,Dict
 from utils import is_file_in_folder
-from toml_analyzer import find_package_folder_from_toml
+from source_ingest import is_path_under
+from toml_analyzer import find_package_folder_from_toml, find_import_package_from_toml
+from analysis_store import store_key
+from stage_metrics import count_written
 
 # Define a data class to store information
 @dataclass
@@ -19,12 +23,26 @@ class FileInfo:
     classes: List[dict] = field(default_factory=list)
     functions: List[str] = field(default_factory=list)
 
+def resolve_import_from(package_name: str, module, level: int) -> str:
+    """Absolute module of a "from ... import" statement, "from ..sub import x" in pkg.a gives pkg.sub."""
+    module = module if module else ""
+    if not level:
+        return module
+    package_parts = package_name.split(".")
+    if level > len(package_parts):
+        # Goes above the analyzed root, keep what the statement names
+        return module
+    base = ".".join(package_parts[:len(package_parts) - level + 1])
+    return base + "." + module if module else base
+
 # A class to parse the python source code
 class CodeParser:
     def parse_file(self, root_path:Path, file_path: Path) -> FileInfo:
         with open(file_path, "r", encoding="utf-8") as file:
             tree = ast.parse(file.read(), filename=file_path)
-        
+        return self.parse_tree(root_path, file_path, tree)
+
+    def parse_tree(self, root_path:Path, file_path: Path, tree: ast.Module) -> FileInfo:
         # Initialize FileInfo object
         file_info = FileInfo(root_path=str(root_path.resolve()), file_name="")
 
@@ -46,7 +64,7 @@ class CodeParser:
             # Check for from .. import statements
             # TODO： Handle from .. import * statements
             if isinstance(node, ast.ImportFrom):
-                module = node.module if node.module else ""
+                module = resolve_import_from(file_info.package_name, node.module, node.level)
                 if module not in file_info.from_imports:
                     file_info.from_imports[module] = []
                 for alias in node.names:
@@ -83,30 +101,114 @@ def write_file_info_to_json(file_info: FileInfo, file_path: Path):
     file_path.parent.mkdir(parents=True, exist_ok=True)
     with file_path.open('w') as f:
         json.dump(asdict(file_info), f, indent=4)
+    count_written(file_path)
+
+def _parse_python_file(task):
+    # Runs in a worker process, so it only gets picklable arguments and returns the error text
+    # instead of raising, letting the parent report failures exactly like the serial path.
+    input_root, python_file = task
+    try:
+        return python_file, CodeParser().parse_file(root_path=input_root, file_path=python_file), None
+    except Exception as e:
+        return python_file, None, str(e)
+
+def _iter_parsed_files(input_root: Path, python_files, workers=1, chunksize=16):
+    tasks = ((input_root, python_file) for python_file in python_files)
+    if workers is None or workers <= 1:
+        for task in tasks:
+            yield _parse_python_file(task)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # executor.map keeps the rglob order, so output and log order match the serial path
+        yield from executor.map(_parse_python_file, tasks, chunksize=chunksize)
 
-def process_python_files(input_root: Path, output_root: Path):
-    parser = CodeParser()  
-    for python_file in input_root.rglob('*.py'):
-        print(f"Processing: {python_file}")
-        try:
-            file_info = parser.parse_file(root_path=input_root, file_path= python_file)
-        except Exception as e:
-            print(f"Error processing {python_file}: {e}")
+def process_python_files(input_root: Path, output_root: Path, workers=1, chunksize=16, source_tree=None, store=None,
+                         progress=None):
+    """Parse every python file under input_root and write one json per file.
+
+    workers > 1 parses the files on a process pool, submitting them in chunks of chunksize.
+    Returns the list of (file, error) pairs for files that failed to parse. With source_tree only its files
+    are parsed, with an AnalysisStore the jsons go to the store. progress(done, total) is called after every file.
+    """
+    errors = []
+    if source_tree is None:
+        python_files = list(input_root.rglob('*.py'))
+    else:
+        python_files = [Path(path) for path in source_tree.files('.py', input_root)]
+    for done, (python_file, file_info, error) in enumerate(_iter_parsed_files(input_root, python_files, workers,
+                                                                              chunksize), 1):
+        if progress is not None:
+            progress(done, len(python_files))
+        if error is not None:
+            print(f"Error processing {python_file}: {error}")
+            errors.append((python_file, error))
             continue
         relative_path = python_file.relative_to(input_root)
+        if store is not None:
+            store.put_code_info(store_key(str(relative_path)), asdict(file_info))
+            continue
         output_file = output_root / relative_path.with_suffix('.json')
         write_file_info_to_json(file_info, output_file)
-        print(f"Processed and written: {output_file}")
+    return errors
+
+class CodeInfoWriter:
+    """Ingestion consumer writing the code_info json for every python file under input_root, or with an
+    AnalysisStore putting it in the store. Files under the skip_folders are left out."""
+
+    def __init__(self, input_root: Path, output_root: Path, store=None, skip_folders=()):
+        self.input_root = Path(input_root)
+        self.output_root = Path(output_root)
+        self.parser = CodeParser()
+        self.store = store
+        self.use_store = store is not None
+        self.skip_folders = list(skip_folders)
+
+    def __getstate__(self):
+        # The workers only parse, the store connection stays in the parent
+        return dict(self.__dict__, store=None)
+
+    def accepts(self, path) -> bool:
+        return is_path_under(path, self.input_root) and \
+            not any(is_path_under(path, folder) for folder in self.skip_folders)
+
+    def _python_file(self, path) -> Path:
+        # Rebuild the path from input_root so relative_path and package_name match process_python_files
+        return self.input_root / os.path.relpath(os.path.abspath(path), os.path.abspath(self.input_root))
+
+    def artifact_path(self, path) -> Path:
+        return self.output_root / self._python_file(path).relative_to(self.input_root).with_suffix('.json')
+
+    def __call__(self, path, tree: ast.Module):
+        python_file = self._python_file(path)
+        file_info = self.parser.parse_tree(root_path=self.input_root, file_path=python_file, tree=tree)
+        if self.use_store:
+            return asdict(file_info)
+        output_file = self.artifact_path(path)
+        write_file_info_to_json(file_info, output_file)
 
-def analyze_folder_dependency(target_folder, output_folder="output"):
+    def collect(self, path, code_info):
+        self.store.put_code_info(store_key(str(self._python_file(path).relative_to(self.input_root))), code_info)
 
+def resolve_source_folder(target_folder) -> Path:
     src_folder = Path(target_folder)
     if is_file_in_folder('pyproject.toml', target_folder):
         sub_path = find_package_folder_from_toml(target_folder + os.path.sep + 'pyproject.toml')
-        src_folder = Path(target_folder+os.path.sep+sub_path[0])
+        # Without poetry packages in the toml the result is a message, the sources are then the import package
+        # of a PEP 621 project, so module names start at the import root, or else the folder itself
+        if isinstance(sub_path, list):
+            src_folder = Path(target_folder+os.path.sep+sub_path[0])
+        else:
+            sub_path = find_import_package_from_toml(target_folder + os.path.sep + 'pyproject.toml')
+            if sub_path:
+                src_folder = Path(target_folder + os.path.sep + sub_path)
+    return src_folder
+
+def analyze_folder_dependency(target_folder, output_folder="output", workers=1):
+
+    src_folder = resolve_source_folder(target_folder)
 
     target_folder = Path(output_folder)
-    process_python_files(src_folder, target_folder)
+    return process_python_files(src_folder, target_folder, workers=workers)
 
 
 
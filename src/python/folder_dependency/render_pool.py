@@ -0,0 +1,104 @@
+import os
+import json
+import time
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+RENDER_MANIFEST_FILE = 'render_manifest.json'
+
+
+def run_dot(source_path, output_path, format, timeout=None):
+    """Render a dot source with Graphviz, killing dot when it runs longer than timeout seconds."""
+    subprocess.run(['dot', '-T' + format, source_path, '-o', output_path], check=True, timeout=timeout,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+def render_dot(source_path, output_path, format, renderer=None, cleanup=False):
+    """Render source_path into output_path now, or queue it on renderer when one is given."""
+    if renderer is not None:
+        renderer.submit(source_path, output_path, format, cleanup)
+        return
+    try:
+        run_dot(source_path, output_path, format)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Error rendering {source_path}: {e}")
+    if cleanup and os.path.exists(source_path):
+        os.remove(source_path)
+
+
+class RenderQueue:
+    """Stands in for a RenderPool in a stage process: the jobs are only listed, for the parent's pool to run."""
+
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, source_path, output_path, format, cleanup=False):
+        self.jobs.append((source_path, output_path, format, cleanup))
+
+
+class RenderPool:
+    """Runs the Graphviz jobs of an analysis on a worker pool, so a huge graph cannot stall the run.
+
+    Sources larger than max_bytes are not rendered and a job running longer than timeout seconds is
+    killed. Every job ends up in the manifest written by close(), with its status: rendered, skipped,
+    timeout or failed, and the output_bytes of a rendered one.
+    """
+
+    def __init__(self, manifest_path, workers=None, timeout=120, max_bytes=2 * 1024 * 1024):
+        self.manifest_path = manifest_path
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+        self.futures = []
+        self.lock = threading.Lock()
+        self.jobs = []
+
+    def _record(self, job):
+        with self.lock:
+            self.jobs.append(job)
+
+    def _render(self, source_path, output_path, format, cleanup, size):
+        job = {'source': source_path, 'output': output_path, 'format': format, 'bytes': size}
+        started = time.perf_counter()
+        try:
+            run_dot(source_path, output_path, format, self.timeout)
+            job['status'] = 'rendered'
+            job['output_bytes'] = os.path.getsize(output_path)
+        except subprocess.TimeoutExpired:
+            job['status'] = 'timeout'
+            if os.path.exists(output_path):
+                os.remove(output_path)
+        except subprocess.CalledProcessError as e:
+            job['status'] = 'failed'
+            job['error'] = e.stderr.decode('utf-8', errors='replace').strip() if e.stderr else str(e)
+        except OSError as e:
+            job['status'] = 'failed'
+            job['error'] = str(e)
+        job['seconds'] = round(time.perf_counter() - started, 3)
+        if cleanup and os.path.exists(source_path):
+            os.remove(source_path)
+        self._record(job)
+
+    def submit(self, source_path, output_path, format, cleanup=False):
+        size = os.path.getsize(source_path)
+        if self.max_bytes is not None and size > self.max_bytes:
+            # Left unrendered, the dot source stays next to where the image would be
+            self._record({'source': source_path, 'output': output_path, 'format': format, 'bytes': size,
+                          'status': 'skipped'})
+            return
+        self.futures.append(self.executor.submit(self._render, source_path, output_path, format, cleanup, size))
+
+    def close(self):
+        """Wait for every queued job and write the manifest, returns the jobs."""
+        for future in self.futures:
+            future.result()
+        self.executor.shutdown()
+        os.makedirs(os.path.dirname(os.path.abspath(self.manifest_path)), exist_ok=True)
+        with open(self.manifest_path, 'w') as f:
+            json.dump({'timeout': self.timeout, 'max_bytes': self.max_bytes, 'jobs': self.jobs}, f, indent=4)
+        counts = {}
+        for job in self.jobs:
+            counts[job['status']] = counts.get(job['status'], 0) + 1
+        print(f"Rendered graphs: {counts}, see {self.manifest_path}")
+        return self.jobs
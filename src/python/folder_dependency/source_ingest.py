@@ -0,0 +1,133 @@
+import ast
+import os
+from concurrent.futures import ProcessPoolExecutor
+from source_walker import walk_source
+from stage_metrics import written_totals, add_written
+
+
+def read_and_parse(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        return ast.parse(file.read(), filename=path)
+
+
+class ParsedSources:
+    """The parsed trees of one source folder, shared by every analysis stage."""
+
+    def __init__(self, source_dir):
+        self.source_dir = os.path.abspath(source_dir)
+        self.trees = {}
+        self.errors = []
+        self.processed = []
+        self.skipped = []
+
+    def get_tree(self, path):
+        return self.trees.get(os.path.abspath(path))
+
+    def release(self):
+        self.trees = {}
+
+
+def find_python_files(source_dir, source_tree=None):
+    python_files = []
+    for root, _, files in walk_source(source_dir, source_tree):
+        for file in files:
+            if file.endswith('.py'):
+                python_files.append(os.path.join(root, file))
+    return python_files
+
+
+_worker_consumers = []
+
+
+def _init_worker(consumers):
+    global _worker_consumers
+    _worker_consumers = consumers
+
+
+def _ingest_file(path, consumers):
+    results = [None] * len(consumers)
+    try:
+        tree = read_and_parse(path)
+    except Exception as e:
+        return None, e, results
+    for index, consumer in enumerate(consumers):
+        if not consumer.accepts(path):
+            continue
+        try:
+            results[index] = consumer(path, tree)
+        except Exception as e:
+            print(f"Error processing {path} in {type(consumer).__name__}: {e}")
+    return tree, None, results
+
+
+def _ingest_file_in_worker(path):
+    # Trees are not sent back to the parent, pickling them costs about as much as parsing again. What the
+    # consumers wrote is, so the stage of the parent counts it
+    files_before, bytes_before = written_totals()
+    _, error, results = _ingest_file(path, _worker_consumers)
+    files_after, bytes_after = written_totals()
+    return path, error, results, (files_after - files_before, bytes_after - bytes_before)
+
+
+def _collect_results(path, consumers, results):
+    # Consumers may return a small per-file summary, gathered in the parent through collect()
+    for consumer, result in zip(consumers, results):
+        if result is not None and hasattr(consumer, 'collect'):
+            consumer.collect(path, result)
+
+
+def ingest_source_tree(source_dir, consumers, workers=1, chunksize=16, keep_trees=True, skip=None, source_tree=None,
+                       progress=None):
+    """Read and parse every python file under source_dir once and hand the tree to each consumer.
+
+    A consumer is a picklable callable taking (path, tree) with an accepts(path) filter. Anything it
+    returns is passed to its collect(path, result) in the parent process. With workers > 1 the
+    consumers run inside a process pool and no trees are kept in the parent. Files for which
+    skip(path) is true are neither read nor parsed. With source_tree only its files are read.
+    progress(done, total) is called after every file, skipped ones count as done from the start.
+    """
+    parsed = ParsedSources(source_dir)
+    python_files = find_python_files(source_dir, source_tree)
+    if skip is not None:
+        parsed.skipped = [path for path in python_files if skip(path)]
+        skipped = set(parsed.skipped)
+        python_files = [path for path in python_files if path not in skipped]
+    total = len(python_files) + len(parsed.skipped)
+    done = len(parsed.skipped)
+    if progress is not None:
+        progress(done, total)
+
+    if workers is None or workers <= 1:
+        for path in python_files:
+            tree, error, results = _ingest_file(path, consumers)
+            done += 1
+            if progress is not None:
+                progress(done, total)
+            if error is not None:
+                print(f"Error processing {path}: {error}")
+                parsed.errors.append((path, error))
+                continue
+            _collect_results(path, consumers, results)
+            parsed.processed.append(path)
+            if keep_trees:
+                parsed.trees[os.path.abspath(path)] = tree
+        return parsed
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(consumers,)) as executor:
+        for path, error, results, written in executor.map(_ingest_file_in_worker, python_files, chunksize=chunksize):
+            add_written(*written)
+            done += 1
+            if progress is not None:
+                progress(done, total)
+            if error is not None:
+                print(f"Error processing {path}: {error}")
+                parsed.errors.append((path, error))
+                continue
+            _collect_results(path, consumers, results)
+            parsed.processed.append(path)
+    return parsed
+
+
+def is_path_under(path, folder):
+    relative_path = os.path.relpath(os.path.abspath(path), os.path.abspath(folder))
+    return relative_path != '..' and not relative_path.startswith('..' + os.path.sep)
@@ -0,0 +1,189 @@
+import os
+import re
+import fnmatch
+
+# Folders no analysis wants to look into: VCS data, virtual environments, caches and build output. build and
+# dist only at the root, below it they can be real packages, e.g. pip/_internal/operations/build
+DEFAULT_EXCLUDES = ['.git', '.hg', '.svn', '__pycache__', '.venv', 'venv', 'node_modules', '.tox', '.nox',
+                    '.mypy_cache', '.pytest_cache', '.eggs', '*.egg-info', '/build', '/dist']
+
+
+def _glob_to_regex(pattern):
+    # gitignore globs: * and ? stop at /, ** crosses folders
+    regex = ''
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if pattern.startswith('**/', index):
+            regex += '(?:.*/)?'
+            index += 3
+            continue
+        if pattern.startswith('**', index):
+            regex += '.*'
+            index += 2
+            continue
+        if char == '*':
+            regex += '[^/]*'
+        elif char == '?':
+            regex += '[^/]'
+        elif char == '[':
+            end = pattern.find(']', index + 1)
+            if end == -1:
+                regex += re.escape(char)
+            else:
+                regex += '[' + pattern[index + 1:end].replace('\\', '\\\\') + ']'
+                index = end
+        else:
+            regex += re.escape(char)
+        index += 1
+    return re.compile(regex + r'\Z')
+
+
+class IgnoreRule:
+    """One .gitignore line, matched against paths relative to the folder of its .gitignore."""
+
+    def __init__(self, pattern):
+        self.negated = pattern.startswith('!')
+        if self.negated:
+            pattern = pattern[1:]
+        self.directory_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        # A pattern with a slash before its end is anchored to its folder, otherwise it matches any name
+        self.anchored = '/' in pattern
+        self.regex = _glob_to_regex(pattern.lstrip('/'))
+
+    def matches(self, relative_path, is_dir):
+        if self.directory_only and not is_dir:
+            return False
+        if self.anchored:
+            return self.regex.match(relative_path) is not None
+        return self.regex.match(relative_path.rsplit('/', 1)[-1]) is not None
+
+
+def read_ignore_rules(gitignore_path):
+    rules = []
+    with open(gitignore_path, 'r', encoding='utf-8', errors='ignore') as f:
+        for line in f:
+            line = line.rstrip('\n').rstrip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('\\'):
+                line = line[1:]
+            rules.append(IgnoreRule(line))
+    return rules
+
+
+class SourceTree:
+    """One pruned walk of a source folder, shared by every stage of an analysis.
+
+    Names matching excludes (DEFAULT_EXCLUDES unless given, one starting with / matches the path from root
+    instead) and, with use_gitignore, paths ignored by the .gitignore files inside the folder are left out,
+    and ignored folders are never entered. walk() replays the walk like os.walk for any folder below root,
+    files() lists the kept files.
+    """
+
+    def __init__(self, root, excludes=None, use_gitignore=True):
+        self.root = os.path.abspath(root)
+        self.excludes = list(DEFAULT_EXCLUDES if excludes is None else excludes)
+        self.use_gitignore = use_gitignore
+        self.folders = {}
+        self.skipped = []
+        self._scan()
+
+    def _excluded(self, name, relative_path):
+        return any(fnmatch.fnmatch(relative_path, pattern[1:]) if pattern.startswith('/')
+                   else fnmatch.fnmatch(name, pattern) for pattern in self.excludes)
+
+    def _ignored(self, rule_sets, relative_path, is_dir):
+        ignored = False
+        for base, rules in rule_sets:
+            path = relative_path[len(base) + 1:] if base else relative_path
+            for rule in rules:
+                if rule.matches(path, is_dir):
+                    ignored = not rule.negated
+        return ignored
+
+    def _scan(self):
+        # os.walk order, so every stage sees folders and files in the order it always did
+        rules_by_folder = {}
+        for path, dirs, files in os.walk(self.root):
+            relative = os.path.relpath(path, self.root)
+            relative = '' if relative == '.' else relative.replace(os.path.sep, '/')
+            parent = relative.rsplit('/', 1)[0] if '/' in relative else ''
+            rule_sets = list(rules_by_folder.get(parent, [])) if relative else []
+            if self.use_gitignore and '.gitignore' in files:
+                rule_sets.append((relative, read_ignore_rules(os.path.join(path, '.gitignore'))))
+            rules_by_folder[relative] = rule_sets
+
+            def keep(name, is_dir):
+                child = f"{relative}/{name}" if relative else name
+                if self._excluded(name, child) or (rule_sets and self._ignored(rule_sets, child, is_dir)):
+                    self.skipped.append(os.path.join(path, name))
+                    return False
+                return True
+
+            # Pruning dirs in place keeps os.walk out of the skipped folders
+            dirs[:] = [name for name in dirs if keep(name, True)]
+            files = [name for name in files if keep(name, False)]
+            self.folders[relative] = (list(dirs), files)
+
+    def _relative(self, path):
+        relative = os.path.relpath(os.path.abspath(path), self.root)
+        if relative == '.':
+            return ''
+        if relative == os.pardir or relative.startswith(os.pardir + os.path.sep):
+            return None
+        return relative.replace(os.path.sep, '/')
+
+    def covers(self, path):
+        relative = self._relative(path)
+        return relative is not None and relative in self.folders
+
+    def covering(self, path):
+        """This tree when path is inside it, a new tree of path with the same exclusions otherwise."""
+        if self.covers(path):
+            return self
+        return SourceTree(path, self.excludes, self.use_gitignore)
+
+    def subtree(self, path):
+        """The tree of a folder below root, cut out of this walk instead of walking the folder again."""
+        start = self._relative(path)
+        if start is None:
+            return SourceTree(path, self.excludes, self.use_gitignore)
+        tree = SourceTree.__new__(SourceTree)
+        tree.root = os.path.abspath(path)
+        tree.excludes = self.excludes
+        tree.use_gitignore = self.use_gitignore
+        prefix = start + '/' if start else ''
+        tree.folders = {relative[len(prefix):]: entry for relative, entry in self.folders.items()
+                        if relative == start or relative.startswith(prefix)}
+        tree.skipped = [skipped for skipped in self.skipped if tree._relative(skipped) is not None]
+        return tree
+
+    def walk(self, top):
+        """Like os.walk(top), without the skipped folders and files."""
+        start = self._relative(top)
+        if start is None:
+            yield from self.covering(top).walk(top)
+            return
+        if start not in self.folders:
+            return
+        stack = [(str(top), start)]
+        while stack:
+            path, relative = stack.pop()
+            dirs, files = self.folders[relative]
+            yield path, list(dirs), list(files)
+            for name in reversed(dirs):
+                child = f"{relative}/{name}" if relative else name
+                # Symlinked folders are listed but, like os.walk, not entered
+                if child in self.folders:
+                    stack.append((os.path.join(path, name), child))
+
+    def files(self, suffix=None, top=None):
+        return [os.path.join(root, name) for root, _, files in self.walk(top or self.root) for name in files
+                if suffix is None or name.endswith(suffix)]
+
+
+def walk_source(top, source_tree=None):
+    """os.walk(top), or the pruned walk of source_tree when one is given."""
+    return os.walk(top) if source_tree is None else source_tree.walk(top)
@@ -0,0 +1,223 @@
+import os
+import re
+import sys
+import json
+import time
+import cProfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak RSS is then left out
+    resource = None
+
+METRICS_FILE = 'metrics.json'
+
+
+# How often the RSS of the worker processes of a stage is sampled, in seconds
+RSS_SAMPLE_SECONDS = 0.1
+
+
+def peak_rss_bytes(who=None):
+    """Peak RSS of this process, or of its largest finished child with resource.RUSAGE_CHILDREN."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF if who is None else who).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def reset_peak_rss():
+    """Start the peak RSS of this process over from its current RSS, False where only Linux' /proc can."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+# Peak of every stage running in this process, kept over the reset of a stage nested in it, e.g. the stages of
+# a package within analyze_package
+_running_peaks = []
+
+
+def _keep_running_peaks():
+    peak = peak_rss_bytes()
+    if peak is not None:
+        _running_peaks[:] = [max(running, peak) for running in _running_peaks]
+
+
+def _statm_rss_bytes(pid='self'):
+    with open(f'/proc/{pid}/statm', 'r') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def current_rss_bytes():
+    """RSS of this process now, None without /proc."""
+    try:
+        return _statm_rss_bytes()
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def children_rss_bytes():
+    """Summed RSS of the running child processes of this one, e.g. the parse workers, None without /proc."""
+    parent = str(os.getpid())
+    try:
+        pids = [pid for pid in os.listdir('/proc') if pid.isdigit()]
+    except OSError:
+        return None
+    total = 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/stat', 'r') as f:
+                # The command name in parentheses may hold spaces, the parent pid is the second field after it
+                if f.read().rpartition(')')[2].split()[1] != parent:
+                    continue
+            total += _statm_rss_bytes(pid)
+        except (OSError, ValueError, IndexError):
+            # Exited meanwhile
+            pass
+    return total
+
+
+class _ChildrenRssSampler(threading.Thread):
+    """Highest summed RSS of the child processes seen while running, sampled every RSS_SAMPLE_SECONDS."""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.stopped = threading.Event()
+        self.peak = children_rss_bytes()
+
+    def run(self):
+        while self.peak is not None and not self.stopped.wait(RSS_SAMPLE_SECONDS):
+            self.peak = max(self.peak, children_rss_bytes() or 0)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return self.peak
+
+
+_written_lock = threading.Lock()
+_written = [0, 0]
+
+
+def count_written(path=None, size=None):
+    """Count a file just written at path, or size bytes put in a store, in the files_written and bytes_written of
+    the running stages of this process."""
+    if size is None:
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+    with _written_lock:
+        _written[0] += 1
+        _written[1] += size
+
+
+def written_totals():
+    """(files, bytes) counted by count_written in this process so far."""
+    with _written_lock:
+        return tuple(_written)
+
+
+def add_written(files, size):
+    # Counted in a worker process, e.g. a parse worker writing code_info
+    with _written_lock:
+        _written[0] += files
+        _written[1] += size
+
+
+def cpu_seconds():
+    # Includes finished child processes, i.e. the parse workers and the dot renderers
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+class StageMetrics:
+    """Wall time, CPU time, memory, files processed and files and bytes written of every analysis stage.
+
+    A stage's peak_rss_bytes is the peak of the process running it during the stage where /proc can reset it
+    (Linux), the peak of the process so far elsewhere. workers_peak_rss_bytes is the highest summed RSS of its
+    child processes, sampled, or without /proc the peak of the largest one finished. Written files and bytes
+    are counted by the writers, see count_written.
+
+    save() writes them to metrics.json in output_dir. Stages named in profile_stages also get a
+    cProfile dump, profile_<stage>.prof, next to it. A name matches the stages <name>:<anything> as well,
+    e.g. analyze_package every analyze_package:<package>.
+    """
+
+    def __init__(self, output_dir, profile_stages=None):
+        self.output_dir = output_dir
+        self.profile_stages = set(profile_stages or [])
+        self.stages = []
+        self.started = time.perf_counter()
+        self.started_cpu = cpu_seconds()
+        # Wall clock start, stage processes measure their start_seconds from the parent's
+        self.epoch = time.time()
+
+    @contextmanager
+    def stage(self, name):
+        """Measure the body as stage name.
+
+        The body can add counters, e.g. files_processed, to the yielded dict. files_written and bytes_written
+        it sets are added to the ones counted in this process, e.g. for files written by other processes.
+        """
+        metrics = {'name': name, 'start_seconds': round(time.time() - self.epoch, 3)}
+        written_before = written_totals()
+        rss_before = current_rss_bytes()
+        _keep_running_peaks()
+        peak_reset = reset_peak_rss()
+        _running_peaks.append(0)
+        sampler = _ChildrenRssSampler()
+        sampler.start()
+        profiler = cProfile.Profile() if name.partition(':')[0] in self.profile_stages else None
+        wall_started, cpu_started = time.perf_counter(), cpu_seconds()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield metrics
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            metrics['wall_seconds'] = round(time.perf_counter() - wall_started, 3)
+            metrics['cpu_seconds'] = round(cpu_seconds() - cpu_started, 3)
+            _keep_running_peaks()
+            metrics['peak_rss_bytes'] = _running_peaks.pop() if resource is not None else None
+            rss_after = current_rss_bytes()
+            metrics['rss_delta_bytes'] = rss_after - rss_before if rss_before is not None and rss_after is not None \
+                else None
+            workers_peak = sampler.stop()
+            metrics['workers_peak_rss_bytes'] = workers_peak if workers_peak is not None else \
+                peak_rss_bytes(resource.RUSAGE_CHILDREN) if resource is not None else None
+            if not peak_reset:
+                metrics['peak_rss_scope'] = 'process'
+            files_after, bytes_after = written_totals()
+            metrics['files_written'] = metrics.get('files_written', 0) + files_after - written_before[0]
+            metrics['bytes_written'] = metrics.get('bytes_written', 0) + bytes_after - written_before[1]
+            if profiler is not None:
+                os.makedirs(self.output_dir, exist_ok=True)
+                # analyze_package:<package> names hold a : and the folders of the package
+                file_name = re.sub(r'[^\w.-]', '_', name)
+                metrics['profile'] = os.path.join(self.output_dir, f'profile_{file_name}.prof')
+                profiler.dump_stats(metrics['profile'])
+            self.stages.append(metrics)
+            print(f"Stage {name}: {metrics['wall_seconds']}s wall, {metrics['cpu_seconds']}s cpu")
+
+    def save(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        # The peak of this process is reset by every stage, the run's is the highest of the stages and the now
+        peaks = [stage.get('peak_rss_bytes') for stage in self.stages] + [peak_rss_bytes()]
+        workers_peaks = [stage.get('workers_peak_rss_bytes') for stage in self.stages]
+        with open(os.path.join(self.output_dir, METRICS_FILE), 'w') as f:
+            json.dump({
+                'wall_seconds': round(time.perf_counter() - self.started, 3),
+                'cpu_seconds': round(cpu_seconds() - self.started_cpu, 3),
+                'peak_rss_bytes': max((peak for peak in peaks if peak is not None), default=None),
+                'workers_peak_rss_bytes': max((peak for peak in workers_peaks if peak is not None), default=None),
+                'stages': self.stages,
+            }, f, indent=4)
@@ -0,0 +1,154 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from stage_metrics import StageMetrics
+from progress_events import ProgressEvents
+
+
+class Stage:
+    """A step of an analysis, run(context, counters, inputs) where inputs maps the stages in requires to their results.
+
+    Unless in_parent is set the stage runs in a stage process, so run must be a module level function and its
+    result picklable. on_done(result) runs in the parent when the stage is done. The outputs of a preview stage
+    are published as previews, a later stage writes them again in full.
+    """
+
+    def __init__(self, name, run, requires=(), outputs=(), in_parent=False, on_done=None, preview=False):
+        self.name = name
+        self.run = run
+        self.requires = list(requires)
+        self.outputs = list(outputs)
+        self.in_parent = in_parent
+        self.on_done = on_done
+        self.preview = preview
+
+
+def _run_stage(name, run, context, inputs, output_dir, profile_stages, epoch):
+    # In the stage process: measured like the parent measures its own stages, the record goes back with the result
+    metrics = StageMetrics(output_dir, profile_stages)
+    metrics.epoch = epoch
+    start = context.begin_stage()
+    with metrics.stage(name) as counters:
+        result = run(context, counters, inputs)
+    return result, metrics.stages[-1], context.end_stage(start)
+
+
+class StageScheduler:
+    """Runs the stages of an analysis as soon as the stages they require are done, independent ones at once
+    on up to workers stage processes. With workers 1 every stage runs in this process, in the given order.
+
+    Stage processes get a copy of context. It provides begin_stage() and end_stage(start) to sum up what a
+    stage process changed, and merge_stage(changes) to apply that in the parent.
+
+    Every stage is pending, running, done, failed or skipped. When a stage fails no other stage is started, the
+    running ones are waited for and run() raises RuntimeError. Status changes and the outputs of done stages are
+    reported to progress, a ProgressEvents.
+    """
+
+    def __init__(self, stages, context, metrics, workers=None, progress=None):
+        self.stages = {stage.name: stage for stage in stages}
+        for stage in stages:
+            for required in stage.requires:
+                if required not in self.stages:
+                    raise ValueError(f"Stage {stage.name} requires unknown stage {required}")
+        self.context = context
+        self.metrics = metrics
+        self.workers = workers
+        self.progress = progress or ProgressEvents()
+        self.status = {name: 'pending' for name in self.stages}
+        self.results = {}
+
+    def _set_status(self, name, status, **fields):
+        self.status[name] = status
+        self.progress.stage(name, status, **fields)
+
+    def _ready(self):
+        return [name for name, stage in self.stages.items() if self.status[name] == 'pending' and
+                all(self.status[required] == 'done' for required in stage.requires)]
+
+    def _inputs(self, stage):
+        return {required: self.results[required] for required in stage.requires}
+
+    def _done(self, name, result, record):
+        stage = self.stages[name]
+        self.results[name] = result
+        if stage.on_done is not None:
+            stage.on_done(result)
+        self._set_status(name, 'done', wall_seconds=record.get('wall_seconds'))
+        for output in stage.outputs:
+            if os.path.exists(output):
+                self.progress.artifact(name, os.path.basename(output), output, stage.preview)
+
+    def _run_in_parent(self, name):
+        stage = self.stages[name]
+        self._set_status(name, 'running')
+        with self.metrics.stage(name) as counters:
+            result = stage.run(self.context, counters, self._inputs(stage))
+        self._done(name, result, self.metrics.stages[-1])
+
+    def run(self):
+        """Run every stage, returns their results by name."""
+        in_process = self.workers is not None and self.workers <= 1
+        executor = None if in_process else ProcessPoolExecutor(max_workers=self.workers)
+        running = {}
+        failure = None
+        try:
+            while True:
+                ready = [] if failure is not None else self._ready()
+                in_parent = [name for name in ready if in_process or self.stages[name].in_parent]
+                # Stage processes are started first, so they go on while a stage runs in the parent
+                for name in ready:
+                    if name not in in_parent:
+                        stage = self.stages[name]
+                        running[executor.submit(_run_stage, name, stage.run, self.context, self._inputs(stage),
+                                                self.metrics.output_dir, self.metrics.profile_stages,
+                                                self.metrics.epoch)] = name
+                        self._set_status(name, 'running')
+                if in_parent:
+                    try:
+                        self._run_in_parent(in_parent[0])
+                    except Exception as e:
+                        failure = (in_parent[0], e)
+                        self._set_status(in_parent[0], 'failed', error=repr(e))
+                    continue
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        result, record, changes = future.result()
+                    except Exception as e:
+                        failure = failure or (name, e)
+                        self.metrics.stages.append({'name': name, 'error': repr(e)})
+                        self._set_status(name, 'failed', error=repr(e))
+                        continue
+                    self.metrics.stages.append(record)
+                    self.context.merge_stage(changes)
+                    self._done(name, result, record)
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+            for name, status in self.status.items():
+                if status == 'pending':
+                    self._set_status(name, 'skipped')
+            self._summarize()
+        if failure is not None:
+            name, error = failure
+            raise RuntimeError(f"Stage {name} failed: {error!r}") from error
+        return self.results
+
+    def _summarize(self):
+        records = {record['name']: record for record in self.metrics.stages}
+        for name, status in self.status.items():
+            records.setdefault(name, {'name': name})['status'] = status
+        self.metrics.stages = [records[name] for name in self.stages if name in records] + \
+                              [record for name, record in records.items() if name not in self.stages]
+        finished = [record for record in self.metrics.stages if 'wall_seconds' in record]
+        if finished:
+            busy = sum(record['wall_seconds'] for record in finished)
+            elapsed = max(record['start_seconds'] + record['wall_seconds'] for record in finished)
+            # With stages side by side the run takes its critical path, not the sum of the stages
+            print(f"Stages: {elapsed:.3f}s elapsed for {busy:.3f}s of stage time, " +
+                  ", ".join(f"{name} {status}" for name, status in self.status.items()))
+            self.progress.emit('stages', elapsed_seconds=round(elapsed, 3), stage_seconds=round(busy, 3),
+                               status=self.status)
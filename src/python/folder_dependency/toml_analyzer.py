@@ -1,3 +1,5 @@
+import os
+import re
 import toml
 
 def find_package_folder_from_toml(file_path):
@@ -12,8 +14,9 @@ def find_package_folder_from_toml(file_path):
         if not packages:
             return "No 'packages' field found in pyproject.toml."
         
-        # Extract the values of the 'include' field
-        include_values = [pkg.get('include') for pkg in packages if 'include' in pkg]
+        # Extract the values of the 'include' field, below the 'from' folder when there is one
+        include_values = [os.path.join(pkg['from'], pkg['include']) if pkg.get('from') else pkg.get('include')
+                          for pkg in packages if 'include' in pkg]
         
         if include_values:
             return include_values
@@ -22,6 +25,33 @@ def find_package_folder_from_toml(file_path):
     except Exception as e:
         return f"Error parsing pyproject.toml: {e}"
 
+def find_import_package_from_toml(file_path):
+    """Folder of the import package of a PEP 621 project, relative to the folder of its pyproject.toml.
+
+    Like the build backends, it is the package named after the project, in src for a src layout, else the only
+    package there. None when it is not a single folder.
+    """
+    try:
+        with open(file_path, 'r') as f:
+            pyproject_data = toml.load(f)
+    except Exception:
+        return None
+    project_folder = os.path.dirname(file_path)
+    name = pyproject_data.get('project', {}).get('name')
+    for import_root in ('src', ''):
+        root_folder = os.path.join(project_folder, import_root)
+        if not os.path.isdir(root_folder):
+            continue
+        if name:
+            package = re.sub(r'[-_.]+', '_', name).lower()
+            if os.path.isdir(os.path.join(root_folder, package)):
+                return os.path.join(import_root, package) if import_root else package
+        packages = [entry for entry in sorted(os.listdir(root_folder))
+                    if os.path.isfile(os.path.join(root_folder, entry, '__init__.py'))]
+        if len(packages) == 1:
+            return os.path.join(import_root, packages[0]) if import_root else packages[0]
+    return None
+
 # # Example usage
 # file_path = 'path/to/your/pyproject.toml'
 # include_values = parse_pyproject_toml(file_path)
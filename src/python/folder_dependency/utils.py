@@ -1,10 +1,11 @@
 import os
+from source_walker import walk_source
 
-def find_folders_with_file(root_dir, target_file):
+def find_folders_with_file(root_dir, target_file, source_tree=None):
     folders_with_file = []
     
     # Walk through the directory tree
-    for dirpath, dirnames, filenames in os.walk(root_dir):
+    for dirpath, dirnames, filenames in walk_source(root_dir, source_tree):
         # Check if the target file is in the current directory
         if target_file in filenames and dirpath != root_dir:
             folders_with_file.append(dirpath)